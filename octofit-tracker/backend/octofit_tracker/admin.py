@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import User, Team, Activity, ActivityRollup, Job, Leaderboard, TeamStats, Workout
 
 
 @admin.register(User)
@@ -30,6 +30,15 @@ class ActivityAdmin(admin.ModelAdmin):
     date_hierarchy = 'date'
 
 
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(admin.ModelAdmin):
+    """Admin configuration for ActivityRollup model"""
+    list_display = ['id', 'user_id', 'period', 'bucket_start', 'activity_type', 'activity_count', 'total_calories', 'total_duration']
+    list_filter = ['period', 'activity_type']
+    search_fields = ['user_id']
+    date_hierarchy = 'bucket_start'
+
+
 @admin.register(Leaderboard)
 class LeaderboardAdmin(admin.ModelAdmin):
     """Admin configuration for Leaderboard model"""
@@ -40,6 +49,15 @@ class LeaderboardAdmin(admin.ModelAdmin):
     ordering = ['rank']
 
 
+@admin.register(TeamStats)
+class TeamStatsAdmin(admin.ModelAdmin):
+    """Admin configuration for TeamStats model"""
+    list_display = ['id', 'team_id', 'member_count', 'total_calories', 'total_activities', 'total_duration', 'updated_at']
+    search_fields = ['team_id']
+    readonly_fields = ['updated_at']
+    ordering = ['-total_calories']
+
+
 @admin.register(Workout)
 class WorkoutAdmin(admin.ModelAdmin):
     """Admin configuration for Workout model"""
@@ -47,3 +65,11 @@ class WorkoutAdmin(admin.ModelAdmin):
     list_filter = ['activity_type', 'difficulty', 'created_at']
     search_fields = ['name', 'description', 'activity_type']
     readonly_fields = ['created_at']
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Admin configuration for Job model"""
+    list_display = ['id', 'name', 'status', 'attempts', 'enqueued_at', 'started_at', 'finished_at']
+    list_filter = ['name', 'status']
+    readonly_fields = ['enqueued_at', 'started_at', 'finished_at']
@@ -0,0 +1,218 @@
+"""
+Async read endpoints for ASGI deployments.
+
+These serve the hottest reads, the leaderboard, a user's rank and a user's
+activity history, with Django's async ORM interface. With Django 4.1 that
+interface still runs every query synchronously, on one thread shared by
+the process, so these views do not free threads or speed up database work;
+they let an ASGI deployment serve these reads without a thread pool. DRF
+views are synchronous, so these are plain Django views; rows go through
+the compiled serializer plans, so items look exactly like the DRF API's.
+
+Each view has a synchronous twin running the same queries, which
+benchmark_concurrency serves through WSGI to compare the two handlers on
+equal code paths.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Min, Q
+from django.http import HttpResponse, HttpResponseNotAllowed
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+
+from . import leaderboard
+from .fast_serializers import compile_serializer
+from .filters import datetime_param, filter_activities, int_param
+from .models import Activity, Leaderboard
+from .serializers import ActivitySerializer, LeaderboardSerializer
+
+ACTIVITY_FILTERS = ['activity_type', 'date__gte', 'date__lt']
+
+
+def _json(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def async_get(view):
+    """Restrict an async view to GET/HEAD and render DRF validation errors as 400s"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        try:
+            return await view(request, *args, **kwargs)
+        except ValidationError as exc:
+            return _json(exc.detail, status=400)
+    return wrapper
+
+
+def sync_get(view):
+    """The synchronous counterpart of async_get"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        try:
+            return view(request, *args, **kwargs)
+        except ValidationError as exc:
+            return _json(exc.detail, status=400)
+    return wrapper
+
+
+def _page_size(params):
+    if 'page_size' not in params:
+        return settings.API_PAGE_SIZE
+    page_size = int_param(params, 'page_size')
+    if page_size < 1:
+        raise ValidationError({'page_size': ['Ensure this value is greater than or equal to 1.']})
+    return min(page_size, settings.API_MAX_PAGE_SIZE)
+
+
+def _next_url(request, **params):
+    query = request.GET.copy()
+    for name, value in params.items():
+        query[name] = value
+    return request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+
+def _leaderboard_query(request):
+    page_size = _page_size(request.GET)
+    # Keyset on (rank, user_id): ranks repeat while they are stale, e.g. as 0 for new entries
+    entries = Leaderboard.objects.order_by('rank', 'user_id')
+    if 'after_rank' in request.GET:
+        after_rank = int_param(request.GET, 'after_rank')
+        if 'after_user_id' in request.GET:
+            after_user_id = int_param(request.GET, 'after_user_id')
+            entries = entries.filter(Q(rank__gt=after_rank) | Q(rank=after_rank, user_id__gt=after_user_id))
+        else:
+            entries = entries.filter(rank__gt=after_rank)
+    return entries[:page_size + 1], page_size
+
+
+def _leaderboard_page(request, rows, page_size):
+    next_url = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_url = _next_url(request, after_rank=rows[-1]['rank'], after_user_id=rows[-1]['user_id'])
+    return {'next': next_url, 'results': compile_serializer(LeaderboardSerializer).to_representation(rows)}
+
+
+@async_get
+async def leaderboard_list(request):
+    """
+    Leaderboard entries by rank. ?page_size= sets the page length; the next
+    link carries ?after_rank= and ?after_user_id=, the rank and user of the
+    last entry returned.
+    """
+    await sync_to_async(leaderboard.ensure_ranks_fresh)()
+    entries, page_size = _leaderboard_query(request)
+    rows = [row async for row in compile_serializer(LeaderboardSerializer).values(entries)]
+    return _json(_leaderboard_page(request, rows, page_size))
+
+
+@sync_get
+def sync_leaderboard_list(request):
+    """Synchronous twin of leaderboard_list"""
+    leaderboard.ensure_ranks_fresh()
+    entries, page_size = _leaderboard_query(request)
+    rows = list(compile_serializer(LeaderboardSerializer).values(entries))
+    return _json(_leaderboard_page(request, rows, page_size))
+
+
+def _ranking(request):
+    ranking = request.GET.get('ranking', leaderboard.COMPETITION)
+    if ranking not in leaderboard.RANKINGS:
+        raise ValidationError({'ranking': [f'Choose one of: {", ".join(leaderboard.RANKINGS)}.']})
+    return ranking
+
+
+def _rank_response(user_id, entry, ranking, rank):
+    if entry is None:
+        return _json({'detail': f'User {user_id} has no leaderboard entry.'}, status=404)
+    return _json({
+        'user_id': entry.user_id,
+        'rank': rank,
+        'ranking': ranking,
+        'total_calories': entry.total_calories,
+        'total_activities': entry.total_activities,
+        'total_duration': entry.total_duration,
+    })
+
+
+@async_get
+async def leaderboard_rank(request, user_id):
+    """A user's leaderboard totals and rank (?ranking=competition|dense)"""
+    ranking = _ranking(request)
+    await sync_to_async(leaderboard.ensure_ranks_fresh)()
+    entry = await Leaderboard.objects.filter(user_id=user_id).afirst()
+    rank = None
+    if entry is not None:
+        if ranking == leaderboard.DENSE:
+            rank = entry.dense_rank
+        else:
+            tie = Leaderboard.objects.filter(total_calories=entry.total_calories)
+            rank = (await tie.aaggregate(Min('rank')))['rank__min']
+    return _rank_response(user_id, entry, ranking, rank)
+
+
+@sync_get
+def sync_leaderboard_rank(request, user_id):
+    """Synchronous twin of leaderboard_rank"""
+    ranking = _ranking(request)
+    leaderboard.ensure_ranks_fresh()
+    entry = Leaderboard.objects.filter(user_id=user_id).first()
+    rank = None
+    if entry is not None:
+        if ranking == leaderboard.DENSE:
+            rank = entry.dense_rank
+        else:
+            tie = Leaderboard.objects.filter(total_calories=entry.total_calories)
+            rank = tie.aggregate(Min('rank'))['rank__min']
+    return _rank_response(user_id, entry, ranking, rank)
+
+
+def _activities_query(request, user_id):
+    page_size = _page_size(request.GET)
+    params = {name: request.GET[name] for name in ACTIVITY_FILTERS if name in request.GET}
+    activities = filter_activities(Activity.objects.filter(user_id=user_id), params)
+    if 'before' in request.GET:
+        before = datetime_param(request.GET, 'before')
+        before_id = int_param(request.GET, 'before_id') if 'before_id' in request.GET else None
+        if before_id is None:
+            activities = activities.filter(date__lt=before)
+        else:
+            activities = activities.filter(date__lte=before).exclude(date=before, id__gte=before_id)
+    return activities.order_by('-date', '-id')[:page_size + 1], page_size
+
+
+def _activities_page(request, user_id, rows, page_size):
+    next_url = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_url = _next_url(request, before=rows[-1]['date'].isoformat(), before_id=rows[-1]['id'])
+    return {
+        'user_id': user_id, 'next': next_url,
+        'results': compile_serializer(ActivitySerializer).to_representation(rows),
+    }
+
+
+@async_get
+async def user_activities(request, user_id):
+    """
+    A user's activities, newest first, filtered by activity_type, date__gte
+    and date__lt. ?page_size= sets the page length; the next link carries
+    ?before= and ?before_id=, the date and id of the last row returned.
+    """
+    activities, page_size = _activities_query(request, user_id)
+    rows = [row async for row in compile_serializer(ActivitySerializer).values(activities)]
+    return _json(_activities_page(request, user_id, rows, page_size))
+
+
+@sync_get
+def sync_user_activities(request, user_id):
+    """Synchronous twin of user_activities"""
+    activities, page_size = _activities_query(request, user_id)
+    rows = list(compile_serializer(ActivitySerializer).values(activities))
+    return _json(_activities_page(request, user_id, rows, page_size))
@@ -0,0 +1,86 @@
+"""
+Helpers shared by the benchmark management commands.
+"""
+import math
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def isolated_database(keepdb=False):
+    """Run the block against a throwaway test database instead of the real one"""
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+class Stopwatch:
+    """Context manager that records the elapsed wall-clock seconds"""
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.started
+
+
+def measure(operation, iterations, warmup=0):
+    """Run operation warmup + iterations times and return the timed durations in seconds"""
+    for _ in range(warmup):
+        operation()
+    durations = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        operation()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(durations):
+    """Latency percentiles in milliseconds and throughput in operations per second"""
+    ordered = sorted(durations)
+    total = sum(ordered)
+    return {
+        'iterations': len(ordered),
+        'mean_ms': total / len(ordered) * 1000 if ordered else 0.0,
+        'min_ms': ordered[0] * 1000 if ordered else 0.0,
+        'p50_ms': percentile(ordered, 0.50) * 1000,
+        'p90_ms': percentile(ordered, 0.90) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'max_ms': ordered[-1] * 1000 if ordered else 0.0,
+        'ops_per_sec': len(ordered) / total if total else 0.0,
+    }
+
+
+def find_regressions(results, baseline, threshold, metrics=('p50_ms', 'p90_ms')):
+    """
+    Compare two result sets and list (scenario, metric, baseline, current)
+    for every metric that got slower by more than threshold (0.2 = 20%).
+    Scenarios missing from either side are skipped.
+    """
+    regressions = []
+    for scenario, current in sorted(results.items()):
+        previous = baseline.get(scenario)
+        if previous is None:
+            continue
+        for metric in metrics:
+            if metric in previous and current.get(metric, 0) > previous[metric] * (1 + threshold):
+                regressions.append((scenario, metric, previous[metric], current[metric]))
+    return regressions
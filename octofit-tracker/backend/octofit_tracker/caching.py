@@ -0,0 +1,162 @@
+"""
+Read-through cache for rendered API responses, validated with strong ETags.
+
+Cached entries are keyed on a version counter that the code paths changing
+the underlying rows bump, so invalidation never has to enumerate keys. The
+store is pluggable through the LEADERBOARD_CACHE_BACKEND setting:
+LocalMemoryBackend keeps everything in the current process, DjangoCacheBackend
+goes through the Django cache framework so several worker processes share
+entries and version counters.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from django.utils.module_loading import import_string
+
+LEADERBOARD_VERSION_KEY = 'leaderboard:version'
+
+
+class LocalMemoryBackend:
+    """In-process store holding at most max_entries responses (LRU)"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def incr(self, key):
+        with self._lock:
+            self._data[key] = self._data.get(key, 0) + 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoCacheBackend:
+    """Store backed by a Django cache alias, shared between processes"""
+
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, None)
+
+    def incr(self, key):
+        self.cache.add(key, 0, None)
+        return self.cache.incr(key)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.LEADERBOARD_CACHE_BACKEND)()
+    return _backend
+
+
+def reset_backend():
+    """Drop the configured backend instance (used by tests and settings changes)"""
+    global _backend
+    _backend = None
+
+
+def leaderboard_version():
+    return get_backend().get(LEADERBOARD_VERSION_KEY) or 0
+
+
+def invalidate_leaderboard():
+    """Bump the leaderboard version so every cached leaderboard response is bypassed"""
+    get_backend().incr(LEADERBOARD_VERSION_KEY)
+
+
+def _etag(content):
+    return '"%s"' % hashlib.sha256(content).hexdigest()
+
+
+def _not_modified(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    # If-None-Match uses weak comparison; compressed responses carry W/ ETags
+    etags = {tag.removeprefix('W/') for tag in parse_etags(if_none_match)}
+    return '*' in etags or etag.removeprefix('W/') in etags
+
+
+def _cached(entry):
+    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    response['ETag'] = entry['etag']
+    return response
+
+
+def cached_response(request, namespace, version, render):
+    """
+    Serve a GET from the cache, falling back to render() and caching its
+    rendered output. Responses carry a strong ETag of their content and
+    requests whose If-None-Match matches get 304 Not Modified.
+    """
+    if request.accepted_renderer.format == 'api':
+        # The browsable API embeds per-request forms, so it is never cached
+        return render()
+
+    backend = get_backend()
+    key = f'{namespace}:{version}:{request.accepted_media_type}:{request.get_full_path()}'
+    entry = backend.get(key)
+    if entry is not None:
+        if _not_modified(request, entry['etag']):
+            return HttpResponseNotModified(headers={'ETag': entry['etag']})
+        return _cached(entry)
+
+    response = render()
+    if response.status_code != 200:
+        return response
+
+    def store(rendered):
+        entry = {
+            'content': rendered.content,
+            'content_type': rendered['Content-Type'],
+            'etag': _etag(rendered.content),
+        }
+        backend.set(key, entry)
+        if _not_modified(request, entry['etag']):
+            return HttpResponseNotModified(headers={'ETag': entry['etag']})
+        rendered['ETag'] = entry['etag']
+
+    response.add_post_render_callback(store)
+    return response
@@ -0,0 +1,337 @@
+"""
+Columnar snapshot of the activities collection for analytics.
+
+Each Activity field is stored as one flat array in its own file under
+ACTIVITY_COLUMNS_DIR, with activity_type dictionary-encoded as small integer
+codes and dates as UTC epoch seconds. Queries memory-map the files and
+aggregate with NumPy, so a group-by over millions of activities touches a
+few contiguous arrays instead of decoding every document.
+
+`refresh_columns()` (the refresh_activity_columns command) appends the rows
+whose id is above the stored watermark. It rebuilds instead when rows at or
+below the watermark were deleted, edited or committed late, which shows up
+as a count mismatch or, for edits, as a DerivedState flag set by
+record_activity_changes.
+"""
+import json
+import os
+import threading
+from datetime import timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+
+from .models import Activity, DerivedState
+
+# DerivedState row flagging edits below the watermark; the refresh command
+# runs in its own process, so the flag lives in the database
+COLUMNS_STATE = 'activity_columns'
+META_FILE = 'meta.json'
+BATCH_SIZE = 50000
+
+# Column name -> dtype; activity_type is stored as codes into meta['types']
+COLUMNS = {
+    'id': 'int64',
+    'user_id': 'int64',
+    'activity_type': 'uint16',
+    'duration': 'int32',
+    'distance': 'float64',  # NaN when unset
+    'calories': 'int32',
+    'date': 'int64',  # UTC epoch seconds
+}
+METRICS = ['count', 'calories', 'duration', 'distance']
+GROUPS = ['activity_type', 'user_id', 'year', 'month', 'week', 'day']
+
+
+def columns_dir():
+    return str(settings.ACTIVITY_COLUMNS_DIR)
+
+
+def record_activity_changes(added=(), removed=()):
+    """Edits and deletes land below the watermark, so the next refresh must rebuild"""
+    if removed and not DerivedState.objects.filter(name=COLUMNS_STATE).update(stale=True):
+        DerivedState.objects.get_or_create(name=COLUMNS_STATE, defaults={'stale': True})
+
+
+def _column_path(directory, name, generation):
+    return os.path.join(directory, f'{name}.{generation}.bin')
+
+
+def _read_meta(directory):
+    try:
+        with open(os.path.join(directory, META_FILE)) as meta_file:
+            return json.load(meta_file)
+    except FileNotFoundError:
+        return None
+
+
+def _write_meta(directory, meta):
+    # Readers trust the row count in meta.json, so it is replaced atomically after the data
+    path = os.path.join(directory, META_FILE)
+    with open(f'{path}.tmp', 'w') as meta_file:
+        json.dump(meta, meta_file)
+        meta_file.flush()
+        os.fsync(meta_file.fileno())
+    os.replace(f'{path}.tmp', path)
+
+
+def _to_epoch(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return int(value.timestamp())
+
+
+def _encode(rows, types):
+    """Column arrays for a batch of values_list rows, adding unseen types to the dictionary"""
+    codes = {name: code for code, name in enumerate(types)}
+    ids, user_ids, type_codes, durations, distances, calories, dates = zip(*rows)
+    for name in type_codes:
+        if name not in codes:
+            codes[name] = len(types)
+            types.append(name)
+    return {
+        'id': np.array(ids, dtype=COLUMNS['id']),
+        'user_id': np.array(user_ids, dtype=COLUMNS['user_id']),
+        'activity_type': np.array([codes[name] for name in type_codes], dtype=COLUMNS['activity_type']),
+        'duration': np.array(durations, dtype=COLUMNS['duration']),
+        'distance': np.array([np.nan if value is None else value for value in distances], dtype=COLUMNS['distance']),
+        'calories': np.array(calories, dtype=COLUMNS['calories']),
+        'date': np.array([_to_epoch(value) for value in dates], dtype=COLUMNS['date']),
+    }
+
+
+def _append(directory, meta, batch_size, commit_batches):
+    """
+    Append activities above the watermark to meta's generation and return
+    the rows added. With commit_batches, meta.json is updated after every
+    batch, so readers see the new rows as they arrive.
+    """
+    generation = meta['generation']
+    # Drop anything a crashed refresh wrote past the committed row count
+    for name, dtype in COLUMNS.items():
+        with open(_column_path(directory, name, generation), 'ab') as column:
+            column.truncate(meta['rows'] * np.dtype(dtype).itemsize)
+
+    rows = (
+        Activity.objects.filter(id__gt=meta['watermark']).order_by('id')
+        .values_list(*COLUMNS).iterator(chunk_size=batch_size)
+    )
+    added = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            added += _write_batch(directory, meta, batch, commit_batches)
+            batch = []
+    if batch:
+        added += _write_batch(directory, meta, batch, commit_batches)
+    return added
+
+
+def _write_batch(directory, meta, batch, commit):
+    arrays = _encode(batch, meta['types'])
+    for name, array in arrays.items():
+        with open(_column_path(directory, name, meta['generation']), 'ab') as column:
+            array.tofile(column)
+    meta['rows'] += len(batch)
+    meta['watermark'] = int(arrays['id'][-1])
+    if commit:
+        _write_meta(directory, meta)
+    return len(batch)
+
+
+def refresh_columns(directory=None, rebuild=False, batch_size=BATCH_SIZE):
+    """
+    Bring the snapshot up to date and return (rows added, rebuilt). Appends
+    new activities, or rewrites the snapshot as a new generation when asked
+    to or when existing rows changed.
+    """
+    directory = directory or columns_dir()
+    os.makedirs(directory, exist_ok=True)
+    meta = _read_meta(directory)
+    if meta is not None and not rebuild:
+        # Deletes and late commits change the count below the watermark
+        rebuild = (
+            DerivedState.objects.filter(name=COLUMNS_STATE, stale=True).exists()
+            or Activity.objects.filter(id__lte=meta['watermark']).count() != meta['rows']
+        )
+    previous = meta
+    if meta is None or rebuild:
+        DerivedState.objects.filter(name=COLUMNS_STATE).update(stale=False)
+        generation = previous['generation'] + 1 if previous else 1
+        meta = {'generation': generation, 'rows': 0, 'watermark': 0, 'types': []}
+    # A new generation only becomes visible once complete
+    added = _append(directory, meta, batch_size, commit_batches=meta is previous)
+    if meta is not previous:
+        _write_meta(directory, meta)
+        if previous:
+            for name in COLUMNS:
+                try:
+                    os.remove(_column_path(directory, name, previous['generation']))
+                except FileNotFoundError:
+                    pass
+    return added, meta is not previous
+
+
+class ActivityColumns:
+    """A read-only, memory-mapped view of one snapshot generation"""
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.rows = meta['rows']
+        self.watermark = meta['watermark']
+        self.types = list(meta['types'])
+        self.columns = {}
+        for name, dtype in COLUMNS.items():
+            if self.rows:
+                array = np.memmap(
+                    _column_path(directory, name, meta['generation']), dtype=dtype, mode='r', shape=(self.rows,)
+                )
+            else:
+                array = np.empty(0, dtype=dtype)
+            self.columns[name] = array
+        self.dates = self.columns['date'].view('datetime64[s]')
+
+    def __len__(self):
+        return self.rows
+
+    def mask(self, activity_type=None, user_id=None, date_gte=None, date_lt=None):
+        """
+        Boolean row selection, or None when there are no filters; dates are
+        aware or UTC-naive datetimes
+        """
+        conditions = []
+        if activity_type is not None:
+            code = self.types.index(activity_type) if activity_type in self.types else -1
+            conditions.append(self.columns['activity_type'] == code)
+        if user_id is not None:
+            conditions.append(self.columns['user_id'] == user_id)
+        if date_gte is not None:
+            conditions.append(self.columns['date'] >= _to_epoch(date_gte))
+        if date_lt is not None:
+            conditions.append(self.columns['date'] < _to_epoch(date_lt))
+        if not conditions:
+            return None
+        selected = conditions[0]
+        for condition in conditions[1:]:
+            selected &= condition
+        return selected
+
+    def column(self, name, selected=None):
+        return self.columns[name] if selected is None else self.columns[name][selected]
+
+    def group_keys(self, name, selected):
+        """
+        Per-row integer keys of a group for the selected rows, and a function
+        turning a key back into its label
+        """
+        if name == 'activity_type':
+            return self.column('activity_type', selected), lambda code: self.types[code]
+        if name == 'user_id':
+            return self.column('user_id', selected), int
+        days = self.column('date', selected) // 86400
+        if name == 'day':
+            return days, lambda day: str(np.datetime64(int(day), 'D'))
+        if name == 'week':
+            # ISO weeks start on Monday; day 0, 1970-01-01, was a Thursday
+            return days - (days + 3) % 7, lambda day: str(np.datetime64(int(day), 'D'))
+        # Calendar units: look each day up in a table covering the date range,
+        # which is much cheaper than converting every timestamp
+        unit = {'year': 'Y', 'month': 'M'}[name]
+        if not len(days):
+            return days, str
+        first = int(days.min())
+        table = np.arange(first, int(days.max()) + 1).astype('datetime64[D]').astype(f'datetime64[{unit}]')
+        return table.astype('int64')[days - first], lambda value: str(np.datetime64(int(value), unit))
+
+    def aggregate(self, group_by=(), metrics=METRICS, **filters):
+        """
+        Totals of metrics per combination of group_by keys over the rows
+        matching filters (see mask), as a list of dicts ordered by key, with
+        activity types in the order they were first seen. Weeks are labelled
+        by their Monday; all buckets are in UTC.
+        """
+        for name in group_by:
+            if name not in GROUPS:
+                raise ValueError(f'Unknown group: {name}')
+        for name in metrics:
+            if name not in METRICS:
+                raise ValueError(f'Unknown metric: {name}')
+        selected = self.mask(**filters)
+        count = self.rows if selected is None else int(np.count_nonzero(selected))
+        if not count:
+            return []
+
+        # Number each row's group with one mixed-radix digit per group key
+        combined = np.zeros(count, dtype='int64')
+        size = 1
+        levels = []
+        for name in group_by:
+            keys, label = self.group_keys(name, selected)
+            low, high = int(keys.min()), int(keys.max())
+            if high - low < 2 * count:
+                # Small key ranges (types, days, months) need no sort
+                values, digits = np.arange(low, high + 1), keys - low
+            else:
+                values, digits = np.unique(keys, return_inverse=True)
+                digits = digits.reshape(-1)
+            combined = combined * len(values) + digits
+            size *= len(values)
+            levels.append((name, values, label))
+        if size <= max(2 * count, 1 << 16):
+            # Few possible groups: bucket directly and keep the non-empty ones
+            groups = None
+        else:
+            groups, combined = np.unique(combined, return_inverse=True)
+            combined = combined.reshape(-1)
+            size = len(groups)
+
+        totals = {'count': np.bincount(combined, minlength=size)}
+        for name in metrics:
+            if name == 'distance':
+                weights = np.nan_to_num(self.column('distance', selected))
+            elif name != 'count':
+                weights = self.column(name, selected)
+            else:
+                continue
+            totals[name] = np.bincount(combined, weights=weights, minlength=size)
+        if groups is None:
+            groups = np.flatnonzero(totals['count'])
+            totals = {name: total[groups] for name, total in totals.items()}
+
+        results = []
+        for index, group in enumerate(groups.tolist()):
+            row = {}
+            for name, values, label in reversed(levels):
+                group, position = divmod(group, len(values))
+                row[name] = label(values[position])
+            row = {name: row[name] for name in group_by}
+            for name in metrics:
+                value = totals[name][index]
+                row[name] = float(value) if name == 'distance' else int(round(value))
+            results.append(row)
+        return results
+
+    def totals(self, metrics=METRICS, **filters):
+        """Totals of metrics over the rows matching filters"""
+        results = self.aggregate(metrics=metrics, **filters)
+        return results[0] if results else dict.fromkeys(metrics, 0)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def open_columns(directory=None):
+    """The current snapshot, or None if none was built; reopened when a refresh commits"""
+    directory = directory or columns_dir()
+    meta = _read_meta(directory)
+    if meta is None:
+        return None
+    version = (meta['generation'], meta['rows'])
+    with _cache_lock:
+        cached = _cache.get(directory)
+        if cached is None or cached[0] != version:
+            cached = (version, ActivityColumns(directory, meta))
+            _cache[directory] = cached
+        return cached[1]
@@ -0,0 +1,126 @@
+"""
+Negotiated response compression.
+
+CompressionMiddleware compresses responses of at least COMPRESSION_MIN_SIZE
+bytes with the best encoding the client accepts: Brotli when the optional
+brotli package is installed, otherwise gzip. Streamed responses (exports)
+are compressed chunk by chunk. Compressed responses carry a weak ETag, as
+with Django's GZipMiddleware, since their bytes differ per encoding.
+"""
+import asyncio
+import gzip
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+GZIP = 'gzip'
+BROTLI = 'br'
+IDENTITY = 'identity'
+# Compression pays off for text formats; images and archives are already compressed
+COMPRESSIBLE_TYPES = re.compile(r'^(text/|application/(json|javascript|xml|x-ndjson|vnd\.[\w.+-]+\+json|msgpack))')
+
+
+def available_encodings():
+    """Encodings this server can produce, best first"""
+    return [BROTLI, GZIP] if brotli is not None else [GZIP]
+
+
+def negotiate(accept_encoding):
+    """The best available encoding the Accept-Encoding header allows, or None"""
+    accepted = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        quality = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding] = quality
+    candidates = [
+        encoding for encoding in available_encodings()
+        if accepted.get(encoding, accepted.get('*', 0)) > 0
+    ]
+    if not candidates:
+        return None
+    # Prefer the client's highest weight, then our own order
+    return max(candidates, key=lambda encoding: accepted.get(encoding, accepted.get('*', 0)))
+
+
+def compress(content, encoding):
+    if encoding == BROTLI:
+        return brotli.compress(content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    if encoding == GZIP:
+        return gzip.compress(content, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+    return content
+
+
+def _brotli_sequence(sequence):
+    compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+    for chunk in sequence:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+    """Compress large responses with Brotli or gzip, as negotiated through Accept-Encoding"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function, as MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        if not COMPRESSIBLE_TYPES.match(response.get('Content-Type', '')):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        # The response depends on Accept-Encoding whether or not this client gets it compressed
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if encoding == BROTLI:
+                response.streaming_content = _brotli_sequence(response.streaming_content)
+            else:
+                response.streaming_content = compress_sequence(response.streaming_content)
+            del response['Content-Length']
+        else:
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
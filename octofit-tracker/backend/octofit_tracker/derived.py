@@ -0,0 +1,13 @@
+"""
+Fan-out of activity writes to every store derived from activities.
+"""
+from . import columnar, leaderboard, recommendations, rollups
+
+
+def record_activity_changes(added=(), removed=()):
+    """Propagate added and removed activities to every derived store and cache"""
+    leaderboard.record_activity_changes(added, removed)
+    rollups.record_activity_changes(added, removed)
+    columnar.record_activity_changes(added, removed)
+    recommendations.record_activity_changes(added, removed)
+
@@ -0,0 +1,206 @@
+"""
+Sparse fieldsets and embedded related objects for API responses.
+
+?fields=id,rank limits a response to the named fields, and ?expand=user,team
+embeds the related objects that rows only reference by id. Expanded objects
+are always included and can be narrowed with dotted names
+(?fields=rank,user.name). Expansions are resolved for a whole page at once,
+with one id__in query per related model, so embedding users in a page of
+leaderboard rows costs one query rather than one request per row.
+
+Serializers opt in with ExpandableSerializerMixin and an `expandable` map;
+both the classic serializer path and the compiled list path (see
+fast_serializers.py) apply the same selection to their output rows.
+"""
+from functools import cached_property, lru_cache
+
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+class Expansion:
+    """
+    A related object embedded under the expansion's name, found by the id in
+    the row's source field. With through, source is read from the object of
+    another expansion instead (a user's team_id for an activity's team).
+    """
+
+    def __init__(self, serializer, source, through=None):
+        self.serializer_path = serializer
+        self.source = source
+        self.through = through
+
+    @cached_property
+    def serializer_class(self):
+        return import_string(self.serializer_path)
+
+    @property
+    def model(self):
+        return self.serializer_class.Meta.model
+
+    def fetch(self, ids):
+        """Representations of the objects with the given ids, by id, in one query"""
+        # fast_serializers applies selections through this module, so import it late
+        from .fast_serializers import compile_serializer
+
+        queryset = self.model.objects.filter(id__in=ids)
+        compiled = compile_serializer(self.serializer_class)
+        if compiled is None:
+            items = self.serializer_class(queryset, many=True).data
+        else:
+            items = compiled.to_representation(compiled.values(queryset))
+        return {item['id']: item for item in items}
+
+
+class FieldSelection:
+    """The fields and expansions a request asked for"""
+
+    def __init__(self, fields, nested, expand, sources):
+        self.fields = fields  # top-level fields to return, or None for all
+        self.nested = nested  # expansion name -> fields of the embedded object
+        self.expand = expand  # expansion names, dependencies first
+        self.sources = sources  # fields only read to resolve expansions
+
+    def includes(self, name):
+        return self.fields is None or name in self.fields or name in self.sources
+
+
+@lru_cache(maxsize=None)
+def readable_fields(serializer_class):
+    return tuple(field.field_name for field in serializer_class()._readable_fields)
+
+
+def _names(params, name):
+    return [value for value in params.get(name, '').split(',') if value]
+
+
+def parse_selection(serializer_class, params):
+    """
+    The selection requested by ?fields= and ?expand=, or None when the
+    request asks for neither. Unknown names are a validation error.
+    """
+    if FIELDS_PARAM not in params and EXPAND_PARAM not in params:
+        return None
+    expandable = getattr(serializer_class, 'expandable', {})
+    available = readable_fields(serializer_class)
+
+    expand = _names(params, EXPAND_PARAM)
+    unknown = [name for name in expand if name not in expandable]
+    if unknown:
+        raise ValidationError({
+            EXPAND_PARAM: [f'Cannot expand: {", ".join(unknown)}. Choose from: {", ".join(expandable)}.']
+        })
+
+    fields, nested = None, {}
+    if FIELDS_PARAM in params:
+        fields = set()
+        for name in _names(params, FIELDS_PARAM):
+            prefix, _, child = name.partition('.')
+            if child:
+                if prefix not in expand:
+                    raise ValidationError({FIELDS_PARAM: [f'Add {prefix} to ?expand= to select its fields.']})
+                if child not in readable_fields(expandable[prefix].serializer_class):
+                    raise ValidationError({FIELDS_PARAM: [f'Unknown field: {name}.']})
+                nested.setdefault(prefix, set()).add(child)
+            elif name in available or name in expand:
+                fields.add(name)
+            else:
+                raise ValidationError({FIELDS_PARAM: [f'Unknown field: {name}.']})
+
+    # Expansions that go through another one are resolved after it, and the
+    # id fields they start from are read even when not asked for
+    ordered = sorted(expand, key=lambda name: expandable[name].through is not None)
+    sources = {expandable[expandable[name].through or name].source for name in expand}
+    if fields is not None:
+        sources -= fields
+    return FieldSelection(fields, nested, ordered, sources)
+
+
+def expand_rows(serializer_class, rows, selection):
+    """Embed the selected expansions into representation rows and trim them to the selected fields"""
+    if selection is None:
+        return rows
+    expandable = serializer_class.expandable
+    fetched = {}
+    for name in selection.expand:
+        expansion = expandable[name]
+        if expansion.through is None:
+            keys = [row.get(expansion.source) for row in rows]
+        else:
+            through = expandable[expansion.through]
+            through_ids = {row[through.source] for row in rows if row.get(through.source) is not None}
+            if expansion.through in fetched:
+                through_objects = fetched[expansion.through]
+                links = {key: item.get(expansion.source) for key, item in through_objects.items()}
+            else:
+                links = dict(through.model.objects.filter(id__in=through_ids).values_list('id', expansion.source))
+            keys = [links.get(row.get(through.source)) for row in rows]
+        ids = {key for key in keys if key is not None}
+        fetched[name] = expansion.fetch(ids) if ids else {}
+        for row, key in zip(rows, keys):
+            row[name] = fetched[name].get(key)
+
+    # Narrow embedded objects once per object rather than once per row
+    for name, fields in selection.nested.items():
+        trimmed = {
+            key: {field: value for field, value in item.items() if field in fields}
+            for key, item in fetched[name].items()
+        }
+        for row in rows:
+            if row[name] is not None:
+                row[name] = trimmed[row[name]['id']]
+    if selection.sources and selection.fields is not None:
+        for row in rows:
+            for name in selection.sources:
+                row.pop(name, None)
+    return rows
+
+
+def request_selection(serializer_class, request):
+    """The request's selection for an expandable serializer, otherwise None"""
+    if request is None or not issubclass(serializer_class, ExpandableSerializerMixin):
+        return None
+    return parse_selection(serializer_class, request.query_params)
+
+
+class ExpandableListSerializer(serializers.ListSerializer):
+    """List serializer that resolves the child's expansions for the whole list at once"""
+
+    def to_representation(self, data):
+        rows = super().to_representation(data)
+        if self.parent is None:
+            expand_rows(type(self.child), rows, self.child.field_selection)
+        return rows
+
+
+class ExpandableSerializerMixin:
+    """
+    Serializer mixin honouring ?fields= and ?expand= when it is the
+    response's top-level serializer. Set Meta.list_serializer_class to
+    ExpandableListSerializer (or a subclass) so lists expand in batches.
+    """
+    expandable = {}
+
+    @cached_property
+    def field_selection(self):
+        top_level = self.parent is None or (isinstance(self.parent, serializers.ListSerializer) and self.parent.parent is None)
+        if not top_level:
+            return None
+        return request_selection(type(self), self.context.get('request'))
+
+    @property
+    def _readable_fields(self):
+        selection = self.field_selection
+        for field in super()._readable_fields:
+            if selection is None or selection.includes(field.field_name):
+                yield field
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if self.parent is None:
+            expand_rows(type(self), [data], self.field_selection)
+        return data
@@ -0,0 +1,67 @@
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .models import User
+
+
+def int_param(params, name):
+    """Parse a required integer query parameter"""
+    try:
+        return int(params[name])
+    except ValueError:
+        raise ValidationError({name: ['A valid integer is required.']})
+
+
+def datetime_param(params, name):
+    """Parse a required date or date/time query parameter into an aware datetime"""
+    value = params[name]
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError({name: ['Enter a valid date or date/time.']})
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def date_param(params, name):
+    """Parse an optional YYYY-MM-DD query parameter, or return None if absent"""
+    if name not in params:
+        return None
+    day = parse_date(params[name]) if params[name] else None
+    if day is None:
+        raise ValidationError({name: ['Enter a valid date (YYYY-MM-DD).']})
+    return day
+
+
+def filter_activities(queryset, params):
+    """
+    Narrow an Activity queryset by the user_id, activity_type, team_id,
+    date__gte and date__lt query parameters.
+    """
+    if 'user_id' in params:
+        queryset = queryset.filter(user_id=int_param(params, 'user_id'))
+    if 'team_id' in params:
+        # Resolved up front so the activity lookup can use the (user_id, date) index
+        member_ids = list(User.objects.filter(team_id=int_param(params, 'team_id')).values_list('id', flat=True))
+        queryset = queryset.filter(user_id__in=member_ids)
+    if 'activity_type' in params:
+        queryset = queryset.filter(activity_type=params['activity_type'])
+    if 'date__gte' in params:
+        queryset = queryset.filter(date__gte=datetime_param(params, 'date__gte'))
+    if 'date__lt' in params:
+        queryset = queryset.filter(date__lt=datetime_param(params, 'date__lt'))
+    return queryset
+
+
+class ActivityFilterBackend(BaseFilterBackend):
+    """Filter backend applying filter_activities to the request's query parameters"""
+
+    def filter_queryset(self, request, queryset, view):
+        return filter_activities(queryset, request.query_params)
@@ -0,0 +1,197 @@
+"""
+Background jobs for derived data.
+
+With DERIVED_DATA_JOBS enabled, reads no longer recompute stale leaderboard
+ranks on the request path; a job is queued instead. Jobs are identified by
+name and coalesce: queueing a job that is already pending is a no-op, so a
+burst of writes costs one recomputation. The store is pluggable through the
+JOB_STORE setting: DatabaseJobStore keeps jobs in the jobs table for
+`manage.py run_jobs` workers, LocalJobStore keeps them in process memory and
+runs them once the current response has been sent, so no broker or worker
+process is needed.
+"""
+import itertools
+import logging
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+JOBS = {
+    'recompute_ranks': 'octofit_tracker.leaderboard.recompute_ranks',
+    'rebuild_leaderboard': 'octofit_tracker.leaderboard.rebuild_leaderboard',
+    'refresh_team_stats': 'octofit_tracker.team_stats.refresh_team_stats',
+    'rebuild_rollups': 'octofit_tracker.rollups.rebuild_rollups',
+}
+
+
+def enabled():
+    return settings.DERIVED_DATA_JOBS
+
+
+class DatabaseJobStore:
+    """Jobs persisted in the jobs table, shared by every process using the database"""
+
+    def enqueue(self, name):
+        if Job.objects.filter(name=name, status=Job.PENDING).exists():
+            return False
+        try:
+            with transaction.atomic():
+                Job.objects.create(name=name)
+        except IntegrityError:
+            # Another process queued it first
+            return False
+        return True
+
+    def claim(self):
+        """Mark the oldest pending job running and return it, or None if there is none"""
+        self.expire_stalled()
+        for job in Job.objects.filter(status=Job.PENDING).order_by('enqueued_at', 'id')[:10]:
+            claimed = Job.objects.filter(id=job.id, status=Job.PENDING).update(
+                status=Job.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1,
+            )
+            if claimed:
+                job.refresh_from_db()
+                return job
+        return None
+
+    def expire_stalled(self):
+        """Fail jobs whose worker stopped responding and queue them again"""
+        cutoff = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT)
+        stalled = list(Job.objects.filter(status=Job.RUNNING, started_at__lt=cutoff).values_list('id', 'name'))
+        for job_id, name in stalled:
+            failed = Job.objects.filter(id=job_id, status=Job.RUNNING).update(
+                status=Job.FAILED, error='Timed out', finished_at=timezone.now(),
+            )
+            if failed:
+                self.enqueue(name)
+
+    def finish(self, job, error=''):
+        job.finished_at = timezone.now()
+        job.error = error
+        job.status = Job.FAILED if error else Job.DONE
+        if error and job.attempts < settings.JOB_MAX_ATTEMPTS:
+            try:
+                with transaction.atomic():
+                    Job.objects.filter(id=job.id).update(status=Job.PENDING, error=error)
+                return
+            except IntegrityError:
+                # A newer pending job will redo the work
+                pass
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        # Keep only the latest finished job of each name
+        Job.objects.filter(name=job.name, status__in=[Job.DONE, Job.FAILED]).exclude(id=job.id).delete()
+
+    def recent(self):
+        """Pending and running jobs, and the last finished job of each name"""
+        return list(Job.objects.order_by('enqueued_at', 'id'))
+
+
+class LocalJobStore:
+    """Jobs held in process memory and run after the response that queued them"""
+
+    def __init__(self):
+        self._jobs = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def enqueue(self, name):
+        with self._lock:
+            if any(job.name == name and job.status == Job.PENDING for job in self._jobs):
+                return False
+            self._jobs.append(Job(id=next(self._ids), name=name, enqueued_at=timezone.now()))
+            return True
+
+    def claim(self):
+        with self._lock:
+            for job in self._jobs:
+                if job.status == Job.PENDING:
+                    job.status = Job.RUNNING
+                    job.started_at = timezone.now()
+                    job.attempts += 1
+                    return job
+            return None
+
+    def finish(self, job, error=''):
+        with self._lock:
+            job.finished_at = timezone.now()
+            job.error = error
+            retry = (
+                error and job.attempts < settings.JOB_MAX_ATTEMPTS
+                and not any(other.name == job.name and other.status == Job.PENDING for other in self._jobs)
+            )
+            job.status = Job.PENDING if retry else Job.FAILED if error else Job.DONE
+            if job.status != Job.PENDING:
+                self._jobs = [
+                    other for other in self._jobs
+                    if other is job or other.name != job.name or other.status in (Job.PENDING, Job.RUNNING)
+                ]
+
+    def recent(self):
+        with self._lock:
+            return list(self._jobs)
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = import_string(settings.JOB_STORE)()
+    return _store
+
+
+def reset_store():
+    """Drop the configured store instance (used by tests and settings changes)"""
+    global _store
+    _store = None
+
+
+def enqueue(name):
+    """Queue a job by name unless one is already pending; returns whether one was queued"""
+    if name not in JOBS:
+        raise ValueError(f'Unknown job: {name}')
+    return get_store().enqueue(name)
+
+
+def run_job(store, job):
+    """Run a claimed job and record the outcome"""
+    try:
+        import_string(JOBS[job.name])()
+    except Exception:
+        logger.exception('Job %s failed', job.name)
+        store.finish(job, error=traceback.format_exc())
+    else:
+        store.finish(job)
+
+
+def run_pending(store=None, limit=None):
+    """Run queued jobs until none are pending or limit jobs ran; returns how many ran"""
+    store = store or get_store()
+    ran = 0
+    while limit is None or ran < limit:
+        job = store.claim()
+        if job is None:
+            break
+        run_job(store, job)
+        ran += 1
+    return ran
+
+
+def _run_local_jobs(**kwargs):
+    if enabled() and isinstance(get_store(), LocalJobStore):
+        run_pending()
+
+
+request_finished.connect(_run_local_jobs, dispatch_uid='octofit_tracker.jobs')
@@ -0,0 +1,330 @@
+"""
+Leaderboard maintenance.
+
+Activity writes apply per-user deltas to the Leaderboard totals with a single
+atomic increment. Ranks are not touched on write; instead the ranks are marked
+stale and recomputed in one batch the next time they are read, or, with
+DERIVED_DATA_JOBS enabled, by a background job (see jobs.py) while reads keep
+serving the previous ranks. Every change bumps the leaderboard cache version
+(see caching.py).
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Min, Q, Sum
+from django.utils import timezone
+
+from . import caching, jobs, team_stats
+from .routers import primary
+from .models import Activity, ActivityRollup, DerivedState, Leaderboard
+
+# DerivedState row flagging ranks that need recomputing; it lives in the
+# database so every worker process sees writes made by the others
+RANKS_STATE = 'leaderboard_ranks'
+BATCH_SIZE = 1000
+
+# Tie handling for rank lookups: competition ranking is 1, 2, 2, 4 and dense ranking 1, 2, 2, 3
+COMPETITION = 'competition'
+DENSE = 'dense'
+RANKINGS = [COMPETITION, DENSE]
+
+# Windowed leaderboards: rolling 7 and 30 days including today, and the calendar month
+WINDOWS = ['7d', '30d', 'month']
+
+
+def activity_deltas(added=(), removed=()):
+    """Net (calories, activities, duration) change per user_id"""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for sign, activities in ((1, added), (-1, removed)):
+        for activity in activities:
+            delta = deltas[activity.user_id]
+            delta[0] += sign * activity.calories
+            delta[1] += sign
+            delta[2] += sign * activity.duration
+    return {user_id: tuple(delta) for user_id, delta in deltas.items() if any(delta)}
+
+
+def apply_delta(user_id, calories=0, activities=0, duration=0):
+    """
+    Add a delta to a user's totals in one atomic increment. Returns whether
+    an entry changed; the caller marks the ranks stale (see entries_changed).
+    """
+    updated = Leaderboard.objects.filter(user_id=user_id).update(
+        total_calories=F('total_calories') + calories,
+        total_activities=F('total_activities') + activities,
+        total_duration=F('total_duration') + duration,
+        updated_at=timezone.now(),
+    )
+    if updated:
+        return True
+    if activities <= 0:
+        # Nothing to take away from; reconcile_leaderboard repairs any drift
+        return False
+    try:
+        with transaction.atomic():
+            Leaderboard.objects.create(
+                user_id=user_id,
+                total_calories=calories,
+                total_activities=activities,
+                total_duration=duration,
+            )
+    except IntegrityError:
+        # Another writer created the entry first, so increment it instead
+        return apply_delta(user_id, calories, activities, duration)
+    return True
+
+
+def record_activity_changes(added=(), removed=()):
+    """
+    Apply the leaderboard deltas for added and removed activities, then mark
+    the ranks stale and invalidate cached reads once for the whole write
+    """
+    deltas = activity_deltas(added, removed)
+    changed = False
+    for user_id, delta in deltas.items():
+        changed = apply_delta(user_id, *delta) or changed
+    team_stats.record_user_deltas(deltas)
+    if changed:
+        entries_changed()
+
+
+def record_entry_change(previous=None, current=None):
+    """Account for a Leaderboard row edited directly rather than through activities"""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for sign, entry in ((-1, previous), (1, current)):
+        if entry is not None:
+            delta = deltas[entry.user_id]
+            delta[0] += sign * entry.total_calories
+            delta[1] += sign * entry.total_activities
+            delta[2] += sign * entry.total_duration
+    team_stats.record_user_deltas({user_id: tuple(delta) for user_id, delta in deltas.items() if any(delta)})
+    entries_changed()
+
+
+def entries_changed():
+    """Flag ranks for recomputation and invalidate cached leaderboard reads"""
+    # Only the write that makes the ranks stale needs to queue the recompute
+    if mark_ranks_stale() and jobs.enabled():
+        jobs.enqueue('recompute_ranks')
+    caching.invalidate_leaderboard()
+
+
+def mark_ranks_stale():
+    """Flag the ranks stale; returns whether they were fresh until now"""
+    if DerivedState.objects.filter(name=RANKS_STATE, stale=False).update(stale=True):
+        return True
+    _, created = DerivedState.objects.get_or_create(name=RANKS_STATE, defaults={'stale': True})
+    return created
+
+
+def ranks_are_stale():
+    # Read from the primary; a lagging replica would hide the latest writes
+    with primary():
+        return DerivedState.objects.filter(name=RANKS_STATE, stale=True).exists()
+
+
+def ranks_recomputed_at():
+    return DerivedState.objects.filter(name=RANKS_STATE).values_list('refreshed_at', flat=True).first()
+
+
+def ensure_ranks_fresh():
+    """
+    Recompute ranks if any totals changed since the last recompute. With
+    background jobs the recompute is queued instead (a no-op if it already is).
+    """
+    if ranks_are_stale():
+        if jobs.enabled():
+            jobs.enqueue('recompute_ranks')
+        else:
+            # The new ranks must come from current totals, not a lagging replica
+            with primary():
+                recompute_ranks()
+
+
+def assign_ranks(entries):
+    """
+    Walk (id, total_calories, rank, dense_rank) rows sorted best first and
+    return the (id, rank, dense_rank) triples whose stored ranks differ from
+    their position and their count of distinct totals so far
+    """
+    changed = []
+    dense_rank = 0
+    previous = None
+    for position, (entry_id, calories, rank, stored_dense_rank) in enumerate(entries, start=1):
+        if calories != previous:
+            dense_rank += 1
+            previous = calories
+        if (rank, stored_dense_rank) != (position, dense_rank):
+            changed.append((entry_id, position, dense_rank))
+    return changed
+
+
+def bulk_update_ranks(changed):
+    """Store (id, rank, dense_rank) triples with bulk_update in chunks of BATCH_SIZE"""
+    Leaderboard.objects.bulk_update(
+        [Leaderboard(id=entry_id, rank=rank, dense_rank=dense_rank) for entry_id, rank, dense_rank in changed],
+        ['rank', 'dense_rank'],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def write_ranks(changed):
+    """
+    Store (id, rank, dense_rank) triples, touching only the rank columns.
+
+    SQL backends get one parameterized UPDATE per entry, sent in batches of
+    BATCH_SIZE with executemany, rather than bulk_update: bulk_update builds
+    a CASE WHEN over every id in the batch for each column, which the
+    database evaluates row by row. Re-ranking 100k entries on SQLite took
+    1.4s this way and 45s with bulk_update (benchmark_ranks --bulk-update).
+    """
+    if not changed:
+        return
+    if connection.vendor == 'djongo':
+        # djongo cannot translate raw UPDATEs, so go through the ORM
+        bulk_update_ranks(changed)
+        return
+    quote = connection.ops.quote_name
+    sql = 'UPDATE %s SET %s = %%s, %s = %%s WHERE %s = %%s' % (
+        quote(Leaderboard._meta.db_table), quote('rank'), quote('dense_rank'), quote('id'),
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(changed), BATCH_SIZE):
+            cursor.executemany(
+                sql, [(rank, dense_rank, entry_id) for entry_id, rank, dense_rank in changed[start:start + BATCH_SIZE]]
+            )
+
+
+def recompute_ranks():
+    """
+    Reassign ordinal and dense ranks by total calories in one sorted pass,
+    writing only the ranks that changed. Returns the number of entries moved.
+    """
+    # Clear the flag first so writes that land during the recompute re-mark it
+    DerivedState.objects.filter(name=RANKS_STATE).update(stale=False)
+    ordered = (
+        Leaderboard.objects.order_by('-total_calories', 'id')
+        .values_list('id', 'total_calories', 'rank', 'dense_rank')
+    )
+    changed = assign_ranks(ordered.iterator(chunk_size=BATCH_SIZE))
+    write_ranks(changed)
+    if not DerivedState.objects.filter(name=RANKS_STATE).update(refreshed_at=timezone.now()):
+        DerivedState.objects.get_or_create(name=RANKS_STATE, defaults={'refreshed_at': timezone.now()})
+    if changed:
+        caching.invalidate_leaderboard()
+    return len(changed)
+
+
+def entries_around(user_id, radius, ranking=COMPETITION):
+    """
+    The user's entry and up to radius neighbours on either side, as a list of
+    (entry, rank) pairs, or None if the user has no entry.
+
+    Neighbours are the entries just before and after the user's in
+    (-total_calories, id) order, which recompute_ranks turns into the
+    ordinal ranks. Selecting them by that order rather than by stored rank
+    keeps the window right while ranks are stale, when new entries all
+    have rank 0. Tied entries share a rank: under competition ranking that
+    is the lowest stored rank of the tie, found through the
+    (total_calories, rank) index; the dense rank is stored with each entry.
+    """
+    ensure_ranks_fresh()
+    entry = Leaderboard.objects.filter(user_id=user_id).first()
+    if entry is None:
+        return None
+    calories = entry.total_calories
+    above = (
+        Leaderboard.objects
+        .filter(Q(total_calories__gt=calories) | Q(total_calories=calories, id__lt=entry.id))
+        .order_by('total_calories', '-id')[:radius]
+    )
+    below = (
+        Leaderboard.objects
+        .filter(Q(total_calories__lt=calories) | Q(total_calories=calories, id__gt=entry.id))
+        .order_by('-total_calories', 'id')[:radius]
+    )
+    window = [*reversed(above), entry, *below]
+
+    if ranking == DENSE:
+        return [(current, current.dense_rank) for current in window]
+
+    first = window[0]
+    rank = Leaderboard.objects.filter(total_calories=first.total_calories).aggregate(Min('rank'))['rank__min']
+    ranked = [(first, rank)]
+    for previous, current in zip(window, window[1:]):
+        if current.total_calories != previous.total_calories:
+            rank = current.rank
+        ranked.append((current, rank))
+    return ranked
+
+
+def rebuild_leaderboard():
+    """
+    Rebuild every Leaderboard entry from Activity with one grouped aggregation.
+    Returns the number of entries created and corrected.
+    """
+    totals = (
+        Activity.objects.order_by()
+        .values('user_id')
+        .annotate(
+            total_calories=Sum('calories'),
+            total_activities=Count('id'),
+            total_duration=Sum('duration'),
+        )
+    )
+    totals = {row.pop('user_id'): row for row in totals}
+    fields = ['total_calories', 'total_activities', 'total_duration']
+    empty = dict.fromkeys(fields, 0)
+
+    with transaction.atomic():
+        corrected = []
+        for entry in Leaderboard.objects.all():
+            expected = totals.pop(entry.user_id, empty)
+            if any(getattr(entry, field) != expected[field] for field in fields):
+                for field in fields:
+                    setattr(entry, field, expected[field])
+                entry.updated_at = timezone.now()
+                corrected.append(entry)
+        Leaderboard.objects.bulk_update(corrected, fields + ['updated_at'], batch_size=BATCH_SIZE)
+        created = Leaderboard.objects.bulk_create(
+            [Leaderboard(user_id=user_id, **row) for user_id, row in totals.items()],
+            batch_size=BATCH_SIZE,
+        )
+    recompute_ranks()
+    if team_stats.snapshot_enabled():
+        team_stats.refresh_team_stats()
+    return len(created), len(corrected)
+
+
+def window_start(window, today):
+    """First day included in a leaderboard window ending today"""
+    if window == '7d':
+        return today - timedelta(days=6)
+    if window == '30d':
+        return today - timedelta(days=29)
+    if window == 'month':
+        return today.replace(day=1)
+    raise ValueError(f'Unknown leaderboard window: {window}')
+
+
+def windowed_leaderboard(window, limit, today=None):
+    """
+    Top users by calories within a window, summed from the daily rollups
+    rather than from raw activities.
+    """
+    today = today or timezone.localdate()
+    rows = (
+        ActivityRollup.objects
+        .filter(period=ActivityRollup.DAY, bucket_start__gte=window_start(window, today), bucket_start__lte=today)
+        .order_by()
+        .values('user_id')
+        .annotate(
+            total_calories=Sum('total_calories'),
+            total_activities=Sum('activity_count'),
+            total_duration=Sum('total_duration'),
+        )
+        .filter(total_activities__gt=0)
+        .order_by('-total_calories', 'user_id')[:limit]
+    )
+    return [dict(row, rank=rank) for rank, row in enumerate(rows, start=1)]
@@ -0,0 +1,182 @@
+import itertools
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from octofit_tracker import leaderboard, rollups
+from octofit_tracker.benchmarking import find_regressions, isolated_database, measure, summarize
+from octofit_tracker.models import Workout
+from octofit_tracker.synthetic import ACTIVITY_TYPES, SyntheticDataGenerator
+from octofit_tracker.urls import router
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark list, retrieve and create on every API resource plus leaderboard rank '
+        'recomputation against a seeded throwaway database, optionally failing on regressions'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Synthetic users to seed')
+        parser.add_argument('--teams', type=int, default=20, help='Synthetic teams to seed')
+        parser.add_argument('--activities-per-user', type=int, default=10, help='Activities seeded per user')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests before each scenario')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset and payloads')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', help='Results file from an earlier run to compare against')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Allowed slowdown of p50/p90 over the baseline before failing (0.2 = 20%%)',
+        )
+        parser.add_argument('--keepdb', action='store_true', help='Keep the benchmark database between runs')
+
+    def handle(self, *args, **options):
+        baseline = self.load_baseline(options['baseline'])
+        generator = SyntheticDataGenerator(
+            seed=options['seed'],
+            activities_per_user=(options['activities_per_user'], options['activities_per_user']),
+        )
+
+        with isolated_database(keepdb=options['keepdb']):
+            user_ids = self.seed(generator, options)
+            results = self.run_scenarios(generator, user_ids, options)
+
+        self.report(results)
+        report = {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'dataset': {
+                    'users': options['users'],
+                    'teams': options['teams'],
+                    'activities_per_user': options['activities_per_user'],
+                    'seed': options['seed'],
+                },
+                'iterations': options['iterations'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if baseline is not None:
+            regressions = find_regressions(results, baseline, options['threshold'])
+            for scenario, metric, previous, current in regressions:
+                self.stderr.write(self.style.ERROR(
+                    f'{scenario} {metric}: {previous:.2f}ms -> {current:.2f}ms '
+                    f'(+{(current / previous - 1) * 100 if previous else float("inf"):.0f}%)'
+                ))
+            if regressions:
+                raise CommandError(
+                    f'{len(regressions)} metric(s) regressed by more than {options["threshold"]:.0%}'
+                )
+            self.stdout.write(self.style.SUCCESS(f'No regressions beyond {options["threshold"]:.0%} of the baseline'))
+
+    def load_baseline(self, path):
+        if not path:
+            return None
+        try:
+            with open(path) as baseline:
+                return json.load(baseline)['results']
+        except (OSError, ValueError, KeyError) as exc:
+            raise CommandError(f'Cannot read baseline {path}: {exc}')
+
+    def seed(self, generator, options):
+        """Populate the benchmark database and return the seeded user ids"""
+        team_ids = generator.create_teams(options['teams'])
+        user_ids = []
+        for chunk in generator.iter_user_chunks(options['users'], team_ids):
+            generator.create_activities(chunk)
+            user_ids.extend(chunk)
+        Workout.objects.bulk_create([
+            Workout(
+                name=f'{activity_type} session {level}',
+                description='Synthetic benchmark workout',
+                activity_type=activity_type,
+                difficulty=level,
+                estimated_duration=30,
+                estimated_calories=300,
+            )
+            for activity_type in ACTIVITY_TYPES
+            for level in ['Beginner', 'Intermediate', 'Advanced']
+        ])
+        leaderboard.rebuild_leaderboard()
+        rollups.rebuild_rollups()
+        return user_ids
+
+    def run_scenarios(self, generator, user_ids, options):
+        client = APIClient()
+        iterations, warmup = options['iterations'], options['warmup']
+        results = {}
+        for prefix, viewset, basename in router.registry:
+            queryset = viewset.queryset.model.objects.order_by('id')
+            retrieve_ids = itertools.cycle(queryset.values_list('id', flat=True)[:iterations] or [0])
+            payloads = self.payloads(basename, generator, user_ids, options['users'])
+
+            results[f'{prefix}.list'] = summarize(measure(
+                lambda: self.request(client.get, f'/api/{prefix}/', 200),
+                iterations, warmup,
+            ))
+            results[f'{prefix}.retrieve'] = summarize(measure(
+                lambda: self.request(client.get, f'/api/{prefix}/{next(retrieve_ids)}/', 200),
+                iterations, warmup,
+            ))
+            results[f'{prefix}.create'] = summarize(measure(
+                lambda: self.request(client.post, f'/api/{prefix}/', 201, next(payloads), format='json'),
+                iterations, warmup,
+            ))
+
+        results['leaderboard.recompute_ranks'] = summarize(measure(
+            leaderboard.recompute_ranks, iterations, warmup,
+        ))
+        return results
+
+    def request(self, method, url, expected_status, *args, **kwargs):
+        response = method(url, *args, **kwargs)
+        if response.status_code != expected_status:
+            raise CommandError(f'{method.__name__.upper()} {url} returned {response.status_code}: {response.content[:500]!r}')
+        return response
+
+    def payloads(self, basename, generator, user_ids, offset):
+        """Endless stream of valid create bodies for a resource"""
+        for number in itertools.count(offset + 1):
+            if basename == 'user':
+                yield {'name': f'Benchmark {number}', 'email': f'benchmark{number}@octofit.example'}
+            elif basename == 'team':
+                yield {'name': f'Benchmark Team {number}', 'description': 'Benchmark team'}
+            elif basename == 'activity':
+                fields = generator.activity_fields(generator.random.choice(user_ids))
+                fields['date'] = fields['date'].isoformat()
+                yield fields
+            elif basename == 'leaderboard':
+                # user ids past the seeded range so every entry is new
+                yield {'user_id': number, 'total_calories': generator.random.randint(0, 50000)}
+            elif basename == 'workout':
+                yield {
+                    'name': f'Benchmark Workout {number}',
+                    'description': 'Benchmark workout',
+                    'activity_type': generator.random.choice(ACTIVITY_TYPES),
+                    'difficulty': 'Intermediate',
+                    'estimated_duration': 45,
+                    'estimated_calories': 400,
+                }
+            else:
+                raise CommandError(f'No create payload defined for {basename}')
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"scenario":<32}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"max ms":>10}{"ops/sec":>12}'
+        )
+        for scenario, stats in results.items():
+            self.stdout.write(
+                f'{scenario:<32}{stats["p50_ms"]:>10.2f}{stats["p90_ms"]:>10.2f}'
+                f'{stats["p99_ms"]:>10.2f}{stats["max_ms"]:>10.2f}{stats["ops_per_sec"]:>12.1f}'
+            )
@@ -0,0 +1,83 @@
+import tempfile
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from octofit_tracker import columnar
+from octofit_tracker.benchmarking import Stopwatch, isolated_database, measure, summarize
+from octofit_tracker.models import Activity
+from octofit_tracker.synthetic import SyntheticDataGenerator
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare analytics queries on the activities table with the same queries on the columnar '
+        'snapshot, on a throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000, help='Synthetic users whose activities to seed')
+        parser.add_argument('--activities-per-user', type=int, default=10, help='Activities per user')
+        parser.add_argument('--days', type=int, default=365, help='Spread activity dates over this many days')
+        parser.add_argument('--iterations', type=int, default=5, help='Timed runs per query')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the benchmark database between runs')
+
+    def handle(self, *args, **options):
+        per_user = options['activities_per_user']
+        generator = SyntheticDataGenerator(
+            seed=options['seed'], days=options['days'], activities_per_user=(per_user, per_user), chunk_size=10000,
+        )
+
+        with isolated_database(keepdb=options['keepdb']), tempfile.TemporaryDirectory() as directory:
+            with Stopwatch() as seeding:
+                created = generator.create_activities(range(1, options['users'] + 1))
+            self.stdout.write(f'Seeded {created} activities in {seeding.elapsed:.1f}s')
+
+            with Stopwatch() as building:
+                columnar.refresh_columns(directory)
+            columns = columnar.open_columns(directory)
+            self.stdout.write(f'Built the columnar snapshot in {building.elapsed:.1f}s')
+
+            window_end = timezone.now()
+            window_start = window_end - timedelta(days=30)
+            queries = [
+                (
+                    'calories by type per month',
+                    lambda: list(
+                        Activity.objects.annotate(month=TruncMonth('date'))
+                        .values('activity_type', 'month')
+                        .annotate(count=Count('id'), calories=Sum('calories'))
+                    ),
+                    lambda: columns.aggregate(['activity_type', 'month'], ['count', 'calories']),
+                ),
+                (
+                    'running totals, last 30 days',
+                    lambda: Activity.objects.filter(
+                        activity_type='Running', date__gte=window_start, date__lt=window_end,
+                    ).aggregate(count=Count('id'), calories=Sum('calories'), duration=Sum('duration')),
+                    lambda: columns.totals(
+                        ['count', 'calories', 'duration'],
+                        activity_type='Running', date_gte=window_start, date_lt=window_end,
+                    ),
+                ),
+            ]
+            self.stdout.write(f'{"query":<32}{"store":<10}{"p50 ms":>10}{"p90 ms":>10}')
+            for name, orm_query, columnar_query in queries:
+                self.check_totals(name, orm_query(), columnar_query())
+                for store, query in [('database', orm_query), ('columnar', columnar_query)]:
+                    stats = summarize(measure(query, options['iterations'], warmup=1))
+                    self.stdout.write(f'{name:<32}{store:<10}{stats["p50_ms"]:>10.1f}{stats["p90_ms"]:>10.1f}')
+
+    def check_totals(self, name, expected, actual):
+        """Both stores must agree on the overall totals before their timings are compared"""
+        if isinstance(expected, dict):
+            expected, actual = [expected], [actual]
+        for metric in ('count', 'calories'):
+            database_total = sum(row[metric] or 0 for row in expected)
+            columnar_total = sum(row[metric] for row in actual)
+            if database_total != columnar_total:
+                raise CommandError(f'{name}: {metric} is {database_total} in the database but {columnar_total} in the snapshot')
@@ -0,0 +1,159 @@
+import asyncio
+import queue
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client, override_settings
+from django.urls import path
+
+from octofit_tracker import async_views, leaderboard, rollups
+from octofit_tracker.benchmarking import Stopwatch, isolated_database, summarize
+from octofit_tracker.synthetic import SyntheticDataGenerator
+
+# Each async view next to its synchronous twin, which runs the same queries
+# and builds the same response, so the runs differ only in the handler
+urlpatterns = [
+    path('sync/leaderboard/', async_views.sync_leaderboard_list),
+    path('sync/leaderboard/rank/<int:user_id>/', async_views.sync_leaderboard_rank),
+    path('sync/users/<int:user_id>/activities/', async_views.sync_user_activities),
+    path('async/leaderboard/', async_views.leaderboard_list),
+    path('async/leaderboard/rank/<int:user_id>/', async_views.leaderboard_rank),
+    path('async/users/<int:user_id>/activities/', async_views.user_activities),
+]
+
+# (scenario, path under /sync/ and /async/)
+SCENARIOS = [
+    ('leaderboard list', 'leaderboard/?page_size=50'),
+    ('rank lookup', 'leaderboard/rank/{user_id}/'),
+    ('user activities', 'users/{user_id}/activities/?page_size=50'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare request throughput of the async read views through the ASGI handler with that of '
+        'their synchronous twins through the WSGI handler, at a fixed number of concurrent clients'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help='Requests per scenario and handler')
+        parser.add_argument('--concurrency', type=int, default=20, help='Concurrent clients')
+        parser.add_argument('--users', type=int, default=500, help='Synthetic users to seed')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset')
+        parser.add_argument(
+            '--db-latency-ms', type=float, default=0,
+            help='Sleep this long in every query to mimic a database across the network',
+        )
+        parser.add_argument('--keepdb', action='store_true', help='Keep the benchmark database between runs')
+
+    def handle(self, *args, **options):
+        generator = SyntheticDataGenerator(seed=options['seed'])
+        latency = options['db_latency_ms'] / 1000
+
+        def delay(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def install_delay(connection, **kwargs):
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        with isolated_database(keepdb=options['keepdb']), override_settings(ROOT_URLCONF=__name__):
+            user_ids = []
+            for chunk in generator.iter_user_chunks(options['users'], generator.create_teams(10)):
+                generator.create_activities(chunk)
+                user_ids.extend(chunk)
+            leaderboard.rebuild_leaderboard()
+            rollups.rebuild_rollups()
+
+            if latency:
+                connection_created.connect(install_delay)
+                for connection in connections.all():
+                    install_delay(connection)
+            self.stdout.write(
+                f'{options["requests"]} requests per run, {options["concurrency"]} concurrent clients, '
+                f'{options["db_latency_ms"]:g}ms added per query'
+            )
+            self.stdout.write(f'{"scenario":<18}{"handler":<8}{"req/sec":>10}{"p50 ms":>10}{"p99 ms":>10}')
+            try:
+                for name, template in SCENARIOS:
+                    for handler, prefix, run in [('wsgi', '/sync/', self.run_wsgi), ('asgi', '/async/', self.run_asgi)]:
+                        urls = [
+                            prefix + template.format(user_id=generator.random.choice(user_ids))
+                            for _ in range(options['requests'])
+                        ]
+                        rate, stats = run(urls, options['concurrency'])
+                        self.stdout.write(
+                            f'{name:<18}{handler:<8}{rate:>10.1f}{stats["p50_ms"]:>10.1f}{stats["p99_ms"]:>10.1f}'
+                        )
+            finally:
+                connection_created.disconnect(install_delay)
+                for connection in connections.all():
+                    if delay in connection.execute_wrappers:
+                        connection.execute_wrappers.remove(delay)
+
+    def run_wsgi(self, urls, concurrency):
+        """Requests from concurrency threads, each with its own client and database connection"""
+        pending = queue.SimpleQueue()
+        for url in urls:
+            pending.put(url)
+        durations = []
+        errors = []
+
+        def worker():
+            client = Client()
+            try:
+                while True:
+                    try:
+                        url = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    durations.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        errors.append(f'GET {url} returned {response.status_code}')
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        with Stopwatch() as total:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return self.result(urls, durations, errors, total)
+
+    def run_asgi(self, urls, concurrency):
+        """Requests from concurrency coroutines sharing one event loop"""
+        pending = iter(urls)
+        durations = []
+        errors = []
+
+        async def worker(client):
+            for url in pending:
+                started = time.perf_counter()
+                response = await client.get(url)
+                durations.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors.append(f'GET {url} returned {response.status_code}')
+
+        async def run():
+            client = AsyncClient()
+            try:
+                await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+            finally:
+                await sync_to_async(connections.close_all)()
+
+        with Stopwatch() as total:
+            asyncio.run(run())
+        return self.result(urls, durations, errors, total)
+
+    def result(self, urls, durations, errors, total):
+        if errors:
+            raise CommandError(f'{len(errors)} requests failed, e.g. {errors[0]}')
+        return len(urls) / total.elapsed, summarize(durations)
@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from octofit_tracker.benchmarking import Stopwatch, isolated_database
+from octofit_tracker.models import Activity
+from octofit_tracker.synthetic import SyntheticDataGenerator
+
+
+class Command(BaseCommand):
+    help = 'Benchmark bulk activity ingestion through /api/activities/bulk/ on a throwaway database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--activities', type=int, default=10000, help='Total activities to ingest')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Activities per request')
+        parser.add_argument('--users', type=int, default=100, help='Distinct user ids to spread activities over')
+        parser.add_argument('--format', choices=['json', 'ndjson'], default='json', help='Request body format')
+        parser.add_argument('--target', type=float, default=10000, help='Target throughput in activities/sec')
+        parser.add_argument('--seed', type=int, help='Random seed for reproducible payloads')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the benchmark database between runs')
+
+    def handle(self, *args, **options):
+        batches = list(self.build_batches(options))
+        client = APIClient()
+
+        with isolated_database(keepdb=options['keepdb']):
+            with Stopwatch() as total:
+                for body, content_type in batches:
+                    response = client.post('/api/activities/bulk/', body, content_type=content_type)
+                    if response.status_code != 201:
+                        self.stderr.write(f'Batch failed with {response.status_code}: {response.content[:500]!r}')
+                        return
+            ingested = Activity.objects.count()
+
+        rate = ingested / total.elapsed if total.elapsed else 0.0
+        self.stdout.write(f'Ingested {ingested} activities in {len(batches)} requests in {total.elapsed:.2f}s')
+        if rate >= options['target']:
+            self.stdout.write(self.style.SUCCESS(f'Throughput: {rate:,.0f} activities/sec'))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'Throughput: {rate:,.0f} activities/sec (below target of {options["target"]:,.0f})'
+            ))
+
+    def build_batches(self, options):
+        """Pre-encode every request body so only ingestion is timed"""
+        generator = SyntheticDataGenerator(seed=options['seed'])
+        remaining = options['activities']
+        while remaining > 0:
+            size = min(options['batch_size'], remaining)
+            remaining -= size
+            items = []
+            for _ in range(size):
+                fields = generator.activity_fields(generator.random.randint(1, options['users']))
+                fields['date'] = fields['date'].isoformat()
+                items.append(fields)
+            if options['format'] == 'ndjson':
+                yield '\n'.join(json.dumps(item) for item in items), 'application/x-ndjson'
+            else:
+                yield json.dumps(items), 'application/json'
@@ -0,0 +1,77 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from octofit_tracker import compression, leaderboard
+from octofit_tracker.benchmarking import isolated_database, measure, summarize
+from octofit_tracker.renderers import ColumnarJSONRenderer, MessagePackRenderer, msgpack
+from octofit_tracker.synthetic import SyntheticDataGenerator
+
+ENDPOINTS = ['/api/activities/', '/api/leaderboard/']
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the size and render/compress time of API pages in each response format and '
+        'content encoding, on a throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Synthetic users to seed')
+        parser.add_argument('--teams', type=int, default=20, help='Synthetic teams to seed')
+        parser.add_argument('--activities-per-user', type=int, default=10, help='Activities seeded per user')
+        parser.add_argument('--page-size', type=int, default=100, help='Items per page')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed runs per combination')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the benchmark database between runs')
+
+    def handle(self, *args, **options):
+        renderers = [('json', JSONRenderer()), ('columnar', ColumnarJSONRenderer())]
+        if msgpack is not None:
+            renderers.append(('msgpack', MessagePackRenderer()))
+        else:
+            self.stderr.write('msgpack is not installed; skipping MessagePack')
+        encodings = [compression.IDENTITY, *reversed(compression.available_encodings())]
+        generator = SyntheticDataGenerator(
+            seed=options['seed'],
+            activities_per_user=(options['activities_per_user'], options['activities_per_user']),
+        )
+
+        with isolated_database(keepdb=options['keepdb']):
+            team_ids = generator.create_teams(options['teams'])
+            for chunk in generator.iter_user_chunks(options['users'], team_ids):
+                generator.create_activities(chunk)
+            leaderboard.rebuild_leaderboard()
+            pages = {endpoint: self.fetch(f'{endpoint}?page_size={options["page_size"]}') for endpoint in ENDPOINTS}
+
+        self.stdout.write(
+            f'{"endpoint":<20}{"format":<10}{"encoding":<10}{"bytes":>10}{"vs json":>9}{"p50 ms":>10}{"p90 ms":>10}'
+        )
+        for endpoint, data in pages.items():
+            baseline = None
+            for name, renderer in renderers:
+                rendered = renderer.render(data)
+                render_time = summarize(measure(lambda: renderer.render(data), options['iterations'], warmup=1))
+                for encoding in encodings:
+                    size = len(compression.compress(rendered, encoding))
+                    if encoding == compression.IDENTITY:
+                        stats = render_time
+                    else:
+                        # Rendering and compressing together, as a response would
+                        stats = summarize(measure(
+                            lambda: compression.compress(renderer.render(data), encoding),
+                            options['iterations'], warmup=1,
+                        ))
+                    baseline = baseline or size
+                    self.stdout.write(
+                        f'{endpoint:<20}{name:<10}{encoding:<10}{size:>10}{size / baseline:>9.2f}'
+                        f'{stats["p50_ms"]:>10.2f}{stats["p90_ms"]:>10.2f}'
+                    )
+
+    def fetch(self, url):
+        response = APIClient().get(url, HTTP_ACCEPT='application/json')
+        if response.status_code != 200:
+            raise CommandError(f'GET {url} returned {response.status_code}: {response.content[:500]!r}')
+        return json.loads(response.content)
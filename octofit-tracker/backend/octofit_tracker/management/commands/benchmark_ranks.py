@@ -0,0 +1,76 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from octofit_tracker import leaderboard
+from octofit_tracker.benchmarking import Stopwatch, isolated_database
+from octofit_tracker.models import Leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Time leaderboard rank recomputation on a throwaway database with many entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000, help='Leaderboard entries to seed')
+        parser.add_argument('--churn', type=float, default=0.01, help='Fraction of entries whose totals change between runs')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the totals')
+        parser.add_argument(
+            '--legacy', action='store_true',
+            help='Also time the old approach of one save() per entry (slow at large sizes)',
+        )
+        parser.add_argument(
+            '--bulk-update', action='store_true',
+            help='Also time a full re-rank written with chunked bulk_update, as on MongoDB',
+        )
+        parser.add_argument('--keepdb', action='store_true', help='Keep the benchmark database between runs')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        users = options['users']
+
+        with isolated_database(keepdb=options['keepdb']):
+            Leaderboard.objects.bulk_create(
+                [
+                    Leaderboard(user_id=user_id, total_calories=rng.randint(0, 100000), total_activities=1, total_duration=30)
+                    for user_id in range(1, users + 1)
+                ],
+                batch_size=leaderboard.BATCH_SIZE,
+            )
+            self.stdout.write(f'{users} leaderboard entries')
+
+            self.time('initial ranking', leaderboard.recompute_ranks)
+            self.time('nothing changed', leaderboard.recompute_ranks)
+
+            changed_ids = rng.sample(range(1, users + 1), max(1, int(users * options['churn'])))
+            Leaderboard.objects.filter(user_id__in=changed_ids).update(total_calories=F('total_calories') + 5000)
+            self.time(f'{len(changed_ids)} totals changed', leaderboard.recompute_ranks)
+
+            if options['bulk_update']:
+                Leaderboard.objects.update(rank=0, dense_rank=0)
+                self.time('initial ranking, bulk_update', self.bulk_update_recompute)
+
+            if options['legacy']:
+                Leaderboard.objects.update(rank=0, dense_rank=0)
+                self.time('legacy save() per entry', self.legacy_recompute)
+
+    def time(self, label, recompute):
+        with Stopwatch() as stopwatch:
+            moved = recompute()
+        self.stdout.write(f'{label:<28}{stopwatch.elapsed:>8.2f}s  {moved} ranks written')
+
+    def bulk_update_recompute(self):
+        ordered = (
+            Leaderboard.objects.order_by('-total_calories', 'id')
+            .values_list('id', 'total_calories', 'rank', 'dense_rank')
+        )
+        changed = leaderboard.assign_ranks(ordered.iterator(chunk_size=leaderboard.BATCH_SIZE))
+        leaderboard.bulk_update_ranks(changed)
+        return len(changed)
+
+    def legacy_recompute(self):
+        entries = Leaderboard.objects.all().order_by('-total_calories', 'id')
+        for position, entry in enumerate(entries, start=1):
+            entry.rank = position
+            entry.save()
+        return len(entries)
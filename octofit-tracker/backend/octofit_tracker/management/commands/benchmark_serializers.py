@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from octofit_tracker import leaderboard
+from octofit_tracker.benchmarking import isolated_database, measure, summarize
+from octofit_tracker.fast_serializers import compile_serializer
+from octofit_tracker.models import Activity, Leaderboard, User
+from octofit_tracker.serializers import ActivitySerializer, LeaderboardSerializer, UserSerializer
+from octofit_tracker.synthetic import SyntheticDataGenerator
+
+SCENARIOS = [
+    ('activities', Activity, ActivitySerializer, ('date', 'id')),
+    ('leaderboard', Leaderboard, LeaderboardSerializer, ('rank', 'id')),
+    ('users', User, UserSerializer, ('id',)),
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare classic and compiled list serialization of large pages on a throwaway database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Rows per page')
+        parser.add_argument('--iterations', type=int, default=10, help='Timed runs per path')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the benchmark database between runs')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        generator = SyntheticDataGenerator(seed=options['seed'], activities_per_user=(1, 1))
+        renderer = JSONRenderer()
+
+        with isolated_database(keepdb=options['keepdb']):
+            for user_ids in generator.iter_user_chunks(rows, generator.create_teams(10)):
+                generator.create_activities(user_ids)
+            leaderboard.rebuild_leaderboard()
+
+            self.stdout.write(f'{"page":<14}{"classic ms":>12}{"fast ms":>12}{"speedup":>10}')
+            for name, model, serializer_class, ordering in SCENARIOS:
+                page = model.objects.order_by(*ordering)[:rows]
+                compiled = compile_serializer(serializer_class)
+
+                def classic():
+                    return renderer.render(serializer_class(list(page), many=True).data)
+
+                def fast():
+                    return renderer.render(compiled.to_representation(compiled.values(page)))
+
+                if classic() != fast():
+                    raise CommandError(f'{name}: fast output differs from the serializer output')
+                classic_ms = summarize(measure(classic, options['iterations'], warmup=1))['p50_ms']
+                fast_ms = summarize(measure(fast, options['iterations'], warmup=1))['p50_ms']
+                self.stdout.write(
+                    f'{name:<14}{classic_ms:>12.1f}{fast_ms:>12.1f}{classic_ms / fast_ms:>9.1f}x'
+                )
+        self.stdout.write(f'Pages of {rows} rows, fetch + serialize + render, median of {options["iterations"]} runs')
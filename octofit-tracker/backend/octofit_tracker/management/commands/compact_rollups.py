@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.rollups import compact_rollups
+
+# The longest leaderboard window (30 days or a calendar month) must stay covered
+MIN_RETAIN_DAYS = 31
+
+
+class Command(BaseCommand):
+    help = 'Expire old daily activity rollups; schedule it to run once a day (e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retain-days', type=int, default=settings.ROLLUP_DAY_RETENTION_DAYS,
+                            help='Number of days of daily buckets to keep')
+
+    def handle(self, *args, **options):
+        retain_days = options['retain_days']
+        if retain_days < MIN_RETAIN_DAYS:
+            raise CommandError(f'--retain-days must be at least {MIN_RETAIN_DAYS} to cover the leaderboard windows')
+        self.stdout.write(f'Compacting daily rollups older than {retain_days} days...')
+        deleted = compact_rollups(retain_days)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} rollup buckets'))
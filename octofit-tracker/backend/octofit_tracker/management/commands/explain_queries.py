@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.query_plans import explain, hot_queries
+
+
+class Command(BaseCommand):
+    help = 'Report which index each hot API query uses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help='Exit with an error if any hot query needs a full collection scan')
+        parser.add_argument('--show-plans', action='store_true', help='Print the full query plans')
+
+    def handle(self, *args, **options):
+        scans = []
+        for hot_query in hot_queries():
+            plan = explain(hot_query)
+            if plan.full_scan:
+                scans.append(plan.name)
+                self.stdout.write(self.style.WARNING(f'{plan.name}: FULL SCAN'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{plan.name}: {", ".join(plan.indexes)}'))
+            if options['show_plans']:
+                self.stdout.write(f'  {plan.plan}')
+
+        if scans and options['fail_on_scan']:
+            raise CommandError(f'{len(scans)} hot queries need a full scan: {", ".join(scans)}')
@@ -1,115 +1,104 @@
+import argparse
+import time
+
 from django.core.management.base import BaseCommand
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime, timedelta
-import random
+from django.db.models import Max
+from octofit_tracker.models import User, Team, Activity, ActivityRollup, Leaderboard, TeamStats, Workout
+from octofit_tracker.leaderboard import rebuild_leaderboard
+from octofit_tracker.recommendations import invalidate_catalogue
+from octofit_tracker.rollups import rebuild_rollups
+from octofit_tracker.synthetic import SyntheticDataGenerator
+
+
+def activity_range(value):
+    """Parse N or MIN-MAX into a (min, max) tuple"""
+    try:
+        low, _, high = value.partition('-')
+        low, high = int(low), int(high or low)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected N or MIN-MAX, got {value!r}')
+    if not 0 <= low <= high:
+        raise argparse.ArgumentTypeError(f'expected 0 <= MIN <= MAX, got {value!r}')
+    return low, high
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
-    def handle(self, *args, **kwargs):
-        self.stdout.write('Clearing existing data...')
-        # Delete existing data using Django ORM
-        Activity.objects.all().delete()
-        Leaderboard.objects.all().delete()
-        User.objects.all().delete()
-        Team.objects.all().delete()
-        Workout.objects.all().delete()
-        self.stdout.write(self.style.SUCCESS('Existing data cleared'))
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int,
+                            help='Generate this many synthetic users instead of the superhero roster')
+        parser.add_argument('--teams', type=int,
+                            help='Number of synthetic teams (default 10 when --users is given)')
+        parser.add_argument('--activities-per-user', type=activity_range, default=(5, 10),
+                            help='Activities per user, as N or MIN-MAX (default 5-10)')
+        parser.add_argument('--days', type=int, default=30,
+                            help='Spread activity dates over this many past days (default 30)')
+        parser.add_argument('--seed', type=int, help='Random seed for reproducible data')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows per bulk insert (default 5000)')
+        parser.add_argument('--append', action='store_true', help='Keep existing data instead of clearing it first')
 
-        # Create teams
-        self.stdout.write('Creating teams...')
-        team_marvel = Team.objects.create(
-            name='Team Marvel',
-            description='Earth\'s Mightiest Heroes unite for fitness!'
+    def handle(self, *args, **options):
+        generator = SyntheticDataGenerator(
+            seed=options['seed'],
+            days=options['days'],
+            activities_per_user=options['activities_per_user'],
+            chunk_size=options['chunk_size'],
         )
-        team_dc = Team.objects.create(
-            name='Team DC',
-            description='Justice League training program for peak performance!'
-        )
-        self.stdout.write(self.style.SUCCESS(f'Created teams: {team_marvel.name}, {team_dc.name}'))
 
-        # Create superhero users
-        self.stdout.write('Creating superhero users...')
-        marvel_heroes = [
-            {'name': 'Tony Stark', 'email': 'ironman@avengers.com', 'team_id': team_marvel.id},
-            {'name': 'Steve Rogers', 'email': 'captain@avengers.com', 'team_id': team_marvel.id},
-            {'name': 'Natasha Romanoff', 'email': 'blackwidow@avengers.com', 'team_id': team_marvel.id},
-            {'name': 'Thor Odinson', 'email': 'thor@asgard.com', 'team_id': team_marvel.id},
-            {'name': 'Bruce Banner', 'email': 'hulk@avengers.com', 'team_id': team_marvel.id},
-            {'name': 'Peter Parker', 'email': 'spiderman@avengers.com', 'team_id': team_marvel.id},
-        ]
-        
-        dc_heroes = [
-            {'name': 'Clark Kent', 'email': 'superman@justiceleague.com', 'team_id': team_dc.id},
-            {'name': 'Bruce Wayne', 'email': 'batman@justiceleague.com', 'team_id': team_dc.id},
-            {'name': 'Diana Prince', 'email': 'wonderwoman@justiceleague.com', 'team_id': team_dc.id},
-            {'name': 'Barry Allen', 'email': 'flash@justiceleague.com', 'team_id': team_dc.id},
-            {'name': 'Arthur Curry', 'email': 'aquaman@justiceleague.com', 'team_id': team_dc.id},
-            {'name': 'Victor Stone', 'email': 'cyborg@justiceleague.com', 'team_id': team_dc.id},
-        ]
-        
-        all_heroes = marvel_heroes + dc_heroes
-        users = []
-        for hero in all_heroes:
-            user = User.objects.create(**hero)
-            users.append(user)
-            self.stdout.write(f'  Created user: {user.name}')
+        if not options['append']:
+            self.stdout.write('Clearing existing data...')
+            # Delete existing data using Django ORM
+            Activity.objects.all().delete()
+            ActivityRollup.objects.all().delete()
+            Leaderboard.objects.all().delete()
+            TeamStats.objects.all().delete()
+            User.objects.all().delete()
+            Team.objects.all().delete()
+            Workout.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS('Existing data cleared'))
 
-        # Create activities
+        if options['users'] is None and options['teams'] is None:
+            user_chunks = [self.create_superheroes()]
+        else:
+            team_count = 10 if options['teams'] is None else options['teams']
+            offset = User.objects.aggregate(Max('id'))['id__max'] or 0
+            self.stdout.write(f'Creating {team_count} teams...')
+            team_ids = generator.create_teams(team_count, offset=Team.objects.aggregate(Max('id'))['id__max'] or 0)
+            self.stdout.write(self.style.SUCCESS(f'Created {len(team_ids)} teams'))
+            self.stdout.write(f'Creating {options["users"] or 0} users...')
+            user_chunks = generator.iter_user_chunks(options['users'] or 0, team_ids, offset=offset)
+
+        # Create activities, streaming user chunks so memory stays bounded
         self.stdout.write('Creating activities...')
-        activity_types = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Yoga', 'Boxing', 'HIIT']
-        activity_count = 0
-        
-        for user in users:
-            # Each user gets 5-10 random activities
-            num_activities = random.randint(5, 10)
-            for i in range(num_activities):
-                activity_type = random.choice(activity_types)
-                duration = random.randint(20, 120)  # 20-120 minutes
-                distance = round(random.uniform(1.0, 20.0), 2) if activity_type in ['Running', 'Cycling', 'Swimming'] else None
-                calories = duration * random.randint(5, 12)  # Rough calorie calculation
-                days_ago = random.randint(0, 30)
-                date = datetime.now() - timedelta(days=days_ago)
-                
-                Activity.objects.create(
-                    user_id=user.id,
-                    activity_type=activity_type,
-                    duration=duration,
-                    distance=distance,
-                    calories=calories,
-                    date=date
-                )
-                activity_count += 1
-        
-        self.stdout.write(self.style.SUCCESS(f'Created {activity_count} activities'))
+        started = time.perf_counter()
+        user_count = activity_count = 0
+        for user_ids in user_chunks:
+            user_count += len(user_ids)
+            activity_count += generator.create_activities(user_ids)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'  {user_count} users, {activity_count} activities '
+                f'({(user_count + activity_count) / elapsed if elapsed else 0:,.0f} rows/sec)'
+            )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {activity_count} activities for {user_count} users in {elapsed:.1f}s'
+        ))
 
         # Create leaderboard entries
         self.stdout.write('Creating leaderboard entries...')
-        for user in users:
-            # Calculate user stats
-            user_activities = Activity.objects.filter(user_id=user.id)
-            total_calories = sum(a.calories for a in user_activities)
-            total_activities = user_activities.count()
-            total_duration = sum(a.duration for a in user_activities)
-            
-            Leaderboard.objects.create(
-                user_id=user.id,
-                total_calories=total_calories,
-                total_activities=total_activities,
-                total_duration=total_duration,
-                rank=0  # Will update ranks after
-            )
-        
-        # Update leaderboard ranks
-        leaderboard_entries = Leaderboard.objects.all().order_by('-total_calories')
-        for idx, entry in enumerate(leaderboard_entries, start=1):
-            entry.rank = idx
-            entry.save()
-        
-        self.stdout.write(self.style.SUCCESS(f'Created {len(users)} leaderboard entries'))
+        created, _ = rebuild_leaderboard()
+        self.stdout.write(self.style.SUCCESS(f'Created {created} leaderboard entries'))
+
+        # Build activity rollups
+        self.stdout.write('Building activity rollups...')
+        buckets = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Built {buckets} rollup buckets'))
 
         # Create workout suggestions
+        if options['append'] and Workout.objects.exists():
+            return self.summarize()
         self.stdout.write('Creating workout suggestions...')
         workouts = [
             {
@@ -194,15 +183,57 @@ class Command(BaseCommand):
             },
         ]
         
-        for workout_data in workouts:
-            Workout.objects.create(**workout_data)
+        Workout.objects.bulk_create([Workout(**workout_data) for workout_data in workouts])
+        invalidate_catalogue()
         
         self.stdout.write(self.style.SUCCESS(f'Created {len(workouts)} workout suggestions'))
-        
-        # Summary
+        self.summarize()
+
+    def summarize(self):
         self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
         self.stdout.write(f'Teams: {Team.objects.count()}')
         self.stdout.write(f'Users: {User.objects.count()}')
         self.stdout.write(f'Activities: {Activity.objects.count()}')
         self.stdout.write(f'Leaderboard entries: {Leaderboard.objects.count()}')
         self.stdout.write(f'Workouts: {Workout.objects.count()}')
+
+    def create_superheroes(self):
+        """Create Team Marvel, Team DC and their heroes; return the heroes' ids"""
+        # Create teams
+        self.stdout.write('Creating teams...')
+        team_marvel = Team.objects.create(
+            name='Team Marvel',
+            description='Earth\'s Mightiest Heroes unite for fitness!'
+        )
+        team_dc = Team.objects.create(
+            name='Team DC',
+            description='Justice League training program for peak performance!'
+        )
+        self.stdout.write(self.style.SUCCESS(f'Created teams: {team_marvel.name}, {team_dc.name}'))
+
+        # Create superhero users
+        self.stdout.write('Creating superhero users...')
+        marvel_heroes = [
+            {'name': 'Tony Stark', 'email': 'ironman@avengers.com', 'team_id': team_marvel.id},
+            {'name': 'Steve Rogers', 'email': 'captain@avengers.com', 'team_id': team_marvel.id},
+            {'name': 'Natasha Romanoff', 'email': 'blackwidow@avengers.com', 'team_id': team_marvel.id},
+            {'name': 'Thor Odinson', 'email': 'thor@asgard.com', 'team_id': team_marvel.id},
+            {'name': 'Bruce Banner', 'email': 'hulk@avengers.com', 'team_id': team_marvel.id},
+            {'name': 'Peter Parker', 'email': 'spiderman@avengers.com', 'team_id': team_marvel.id},
+        ]
+        
+        dc_heroes = [
+            {'name': 'Clark Kent', 'email': 'superman@justiceleague.com', 'team_id': team_dc.id},
+            {'name': 'Bruce Wayne', 'email': 'batman@justiceleague.com', 'team_id': team_dc.id},
+            {'name': 'Diana Prince', 'email': 'wonderwoman@justiceleague.com', 'team_id': team_dc.id},
+            {'name': 'Barry Allen', 'email': 'flash@justiceleague.com', 'team_id': team_dc.id},
+            {'name': 'Arthur Curry', 'email': 'aquaman@justiceleague.com', 'team_id': team_dc.id},
+            {'name': 'Victor Stone', 'email': 'cyborg@justiceleague.com', 'team_id': team_dc.id},
+        ]
+        
+        all_heroes = marvel_heroes + dc_heroes
+        User.objects.bulk_create([User(**hero) for hero in all_heroes])
+        users = User.objects.filter(email__in=[hero['email'] for hero in all_heroes])
+        for user in users:
+            self.stdout.write(f'  Created user: {user.name}')
+        return [user.id for user in users]
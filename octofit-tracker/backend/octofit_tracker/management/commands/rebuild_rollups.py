@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily and weekly activity rollups from the activities collection'
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write('Rebuilding activity rollups...')
+        buckets = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {buckets} rollup buckets'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.leaderboard import rebuild_leaderboard, recompute_ranks
+
+
+class Command(BaseCommand):
+    help = 'Rebuild leaderboard totals and ranks from the activities collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ranks-only', action='store_true',
+            help='Only reassign ranks from the stored totals, without re-aggregating activities',
+        )
+
+    def handle(self, *args, **options):
+        if options['ranks_only']:
+            moved = recompute_ranks()
+            self.stdout.write(self.style.SUCCESS(f'Ranks reassigned: {moved} entries moved'))
+            return
+        self.stdout.write('Reconciling leaderboard with activities...')
+        created, corrected = rebuild_leaderboard()
+        self.stdout.write(self.style.SUCCESS(
+            f'Leaderboard reconciled: {created} entries created, {corrected} entries corrected'
+        ))
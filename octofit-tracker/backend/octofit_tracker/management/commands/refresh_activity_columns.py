@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import columnar
+
+
+class Command(BaseCommand):
+    help = 'Append new activities to the columnar analytics snapshot, rebuilding it when existing rows changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Rewrite the whole snapshot')
+        parser.add_argument('--directory', help='Snapshot directory (default: ACTIVITY_COLUMNS_DIR)')
+        parser.add_argument('--batch-size', type=int, default=columnar.BATCH_SIZE, help='Activities read per batch')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        added, rebuilt = columnar.refresh_columns(
+            options['directory'], rebuild=options['rebuild'], batch_size=options['batch_size'],
+        )
+        columns = columnar.open_columns(options['directory'])
+        action = 'Rebuilt snapshot with' if rebuilt else 'Appended'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {added} activities in {time.perf_counter() - started:.2f}s; '
+            f'{len(columns)} rows up to id {columns.watermark}, {len(columns.types)} activity types'
+        ))
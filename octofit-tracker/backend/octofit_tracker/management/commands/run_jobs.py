@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from octofit_tracker import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued derived-data jobs (leaderboard ranks, team stats, rollups), polling for new ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--enqueue', action='append', default=[], choices=sorted(jobs.JOBS), metavar='JOB',
+            help=f'Queue a job before running; one of {", ".join(sorted(jobs.JOBS))} (repeatable)',
+        )
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty instead of polling')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--max-jobs', type=int, help='Exit after running this many jobs')
+
+    def handle(self, *args, **options):
+        store = jobs.get_store()
+        for name in options['enqueue']:
+            queued = jobs.enqueue(name)
+            self.stdout.write(f'Queued {name}' if queued else f'{name} is already pending')
+
+        ran = 0
+        try:
+            while options['max_jobs'] is None or ran < options['max_jobs']:
+                job = store.claim()
+                if job is None:
+                    if options['once']:
+                        break
+                    # A long-running worker must not hold on to broken or expired connections
+                    close_old_connections()
+                    time.sleep(options['poll_interval'])
+                    continue
+                started = time.perf_counter()
+                jobs.run_job(store, job)
+                ran += 1
+                outcome = self.style.ERROR('failed') if job.error else self.style.SUCCESS('done')
+                self.stdout.write(f'{job.name} (attempt {job.attempts}) {outcome} in {time.perf_counter() - started:.2f}s')
+        except KeyboardInterrupt:
+            self.stdout.write('Interrupted')
+        self.stdout.write(f'Ran {ran} jobs')
@@ -0,0 +1,219 @@
+"""
+Per-request instrumentation.
+
+RequestMetricsMiddleware counts database queries and times them, the
+serializers and the whole request, reports the numbers in a Server-Timing
+header and folds them into per-route histograms served by /api/metrics/.
+It is enabled with the REQUEST_METRICS setting; when disabled the middleware
+removes itself at startup and serializers only pay for one context variable
+lookup.
+
+Timings live in a context variable, so they follow a request into the
+threads sync_to_async runs ORM calls in; the query timer is installed on
+every database connection as it is opened for the same reason.
+"""
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is open-ended
+BUCKETS_MS = [1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+QUERY_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500]
+METRICS = ['total_ms', 'db_ms', 'serializer_ms', 'db_queries']
+
+_current = contextvars.ContextVar('octofit_request_timings', default=None)
+
+
+class RequestTimings:
+    """Query count and time spent in the database and serializers for one request"""
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+
+def _time_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_time += time.perf_counter() - started
+        timings.db_queries += 1
+
+
+def _install_query_timer(connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def install_query_timer():
+    """Time queries on every connection, open now or opened later; idle without a request in flight"""
+    connection_created.connect(_install_query_timer, dispatch_uid='octofit_tracker.metrics')
+    for connection in connections.all():
+        _install_query_timer(connection)
+
+
+@contextmanager
+def timed_serializer():
+    """Add the block's duration to the request's serializer time, ignoring nested serializers"""
+    timings = _current.get()
+    if timings is None or timings.serializer_depth:
+        yield
+        return
+    timings.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serializer_time += time.perf_counter() - started
+        timings.serializer_depth -= 1
+
+
+class TimedSerializerMixin:
+    """Serializer mixin that reports representation and validation time to the request metrics"""
+
+    def to_representation(self, instance):
+        if _current.get() is None:
+            return super().to_representation(instance)
+        with timed_serializer():
+            return super().to_representation(instance)
+
+    def run_validation(self, data=None):
+        if _current.get() is None:
+            return super().run_validation(data)
+        with timed_serializer():
+            return super().run_validation(data)
+
+
+class Histogram:
+    """Fixed-bucket histogram with a running count and sum"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        """Cumulative bucket counts, Prometheus style"""
+        buckets = []
+        running = 0
+        for bound, count in zip(self.bounds + ['+Inf'], self.counts):
+            running += count
+            buckets.append({'le': bound, 'count': running})
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+
+class MetricsRegistry:
+    """Per-route histograms for every metric, shared by all threads of the process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, values):
+        with self._lock:
+            histograms = self._routes.get(route)
+            if histograms is None:
+                histograms = self._routes[route] = {
+                    metric: Histogram(QUERY_BUCKETS if metric == 'db_queries' else BUCKETS_MS)
+                    for metric in METRICS
+                }
+            for metric in METRICS:
+                histograms[metric].observe(values[metric])
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                route: {metric: histogram.as_dict() for metric, histogram in histograms.items()}
+                for route, histograms in sorted(self._routes.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+registry = MetricsRegistry()
+
+
+def metrics_enabled():
+    return settings.REQUEST_METRICS
+
+
+def route_name(request):
+    """Method and URL name of the matched view, e.g. 'GET leaderboard-list'"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return f'{request.method} <unresolved>'
+    return f'{request.method} {match.view_name or match.route}'
+
+
+class RequestMetricsMiddleware:
+    """Measure every request and report it in Server-Timing and the metrics registry"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_query_timer()
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function, as MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    def finish(self, request, response, timings, total):
+        values = {
+            'total_ms': total * 1000,
+            'db_ms': timings.db_time * 1000,
+            'serializer_ms': timings.serializer_time * 1000,
+            'db_queries': timings.db_queries,
+        }
+        registry.record(route_name(request), values)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={values["db_ms"]:.2f};desc="{timings.db_queries} queries"',
+            f'serializer;dur={values["serializer_ms"]:.2f}',
+            f'total;dur={values["total_ms"]:.2f}',
+        ])
+        return response
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0002_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('team_id', models.IntegerField(unique=True)),
+                ('member_count', models.IntegerField(default=0)),
+                ('total_calories', models.IntegerField(default=0)),
+                ('total_activities', models.IntegerField(default=0)),
+                ('total_duration', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'team stats',
+                'db_table': 'team_stats',
+            },
+        ),
+    ]
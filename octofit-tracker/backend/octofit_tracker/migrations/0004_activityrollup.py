@@ -0,0 +1,38 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0003_teamstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField()),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'ISO week')], max_length=4)),
+                ('bucket_start', models.DateField()),
+                ('activity_type', models.CharField(max_length=100)),
+                ('activity_count', models.IntegerField(default=0)),
+                ('total_calories', models.IntegerField(default=0)),
+                ('total_duration', models.IntegerField(default=0)),
+                ('total_distance', models.FloatField(default=0)),
+            ],
+            options={
+                'db_table': 'activity_rollups',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='activityrollup',
+            index=models.Index(fields=['period', 'bucket_start'], name='activity_rollup_period_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='activityrollup',
+            constraint=models.UniqueConstraint(fields=('user_id', 'period', 'bucket_start', 'activity_type'), name='activity_rollup_bucket_uniq'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0004_activityrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['total_calories', 'rank'], name='leaderboard_calories_rank_idx'),
+        ),
+    ]
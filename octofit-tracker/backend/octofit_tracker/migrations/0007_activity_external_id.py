@@ -0,0 +1,24 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:56
+
+from django.db import migrations, models
+
+from octofit_tracker.mongo.operations import AddPartialUniqueConstraint
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0006_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='external_id',
+            field=models.CharField(max_length=200, null=True),
+        ),
+        AddPartialUniqueConstraint(
+            model_name='activity',
+            constraint=models.UniqueConstraint(condition=models.Q(('external_id__isnull', False)), fields=('external_id',), name='activity_external_id_uniq'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 21:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0007_activity_external_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DerivedState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('stale', models.BooleanField(default=False)),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+                ('version', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'derived_state',
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 21:11
+
+from django.db import migrations, models
+
+
+def mark_ranks_stale(apps, schema_editor):
+    # Existing entries start at dense_rank 0; the next read recomputes them
+    if apps.get_model('octofit_tracker', 'Leaderboard').objects.exists():
+        DerivedState = apps.get_model('octofit_tracker', 'DerivedState')
+        DerivedState.objects.update_or_create(name='leaderboard_ranks', defaults={'stale': True})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0008_derivedstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leaderboard',
+            name='dense_rank',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(mark_ranks_stale, migrations.RunPython.noop),
+    ]
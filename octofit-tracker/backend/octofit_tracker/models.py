@@ -10,6 +10,9 @@ class User(models.Model):
     
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team_id'], name='user_team_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -36,16 +39,60 @@ class Activity(models.Model):
     distance = models.FloatField(null=True, blank=True)  # in km
     calories = models.IntegerField()
     date = models.DateTimeField()
+    # Client-chosen key (e.g. client, device and start time) that makes retried creates idempotent
+    external_id = models.CharField(max_length=200, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         db_table = 'activities'
         verbose_name_plural = 'activities'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['external_id'], condition=models.Q(external_id__isnull=False),
+                name='activity_external_id_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['user_id', 'date'], name='activity_user_date_idx'),
+            models.Index(fields=['activity_type', 'date'], name='activity_type_date_idx'),
+            models.Index(fields=['date', 'id'], name='activity_date_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.activity_type} - {self.duration} mins"
 
 
+class ActivityRollup(models.Model):
+    """Model for pre-aggregated per-user activity totals by day and ISO week"""
+    DAY = 'day'
+    WEEK = 'week'
+    PERIOD_CHOICES = [(DAY, 'Day'), (WEEK, 'ISO week')]
+    
+    user_id = models.IntegerField()
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket_start = models.DateField()  # the day, or the Monday of the ISO week
+    activity_type = models.CharField(max_length=100)
+    activity_count = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0)  # in minutes
+    total_distance = models.FloatField(default=0)  # in km
+    
+    class Meta:
+        db_table = 'activity_rollups'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user_id', 'period', 'bucket_start', 'activity_type'],
+                name='activity_rollup_bucket_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'bucket_start'], name='activity_rollup_period_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.period} {self.bucket_start} - User {self.user_id} {self.activity_type}"
+
+
 class Leaderboard(models.Model):
     """Model for leaderboard collection"""
     user_id = models.IntegerField(unique=True)
@@ -53,16 +100,84 @@ class Leaderboard(models.Model):
     total_activities = models.IntegerField(default=0)
     total_duration = models.IntegerField(default=0)  # in minutes
     rank = models.IntegerField(default=0)
+    dense_rank = models.IntegerField(default=0)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'leaderboard'
         ordering = ['-total_calories']
+        indexes = [
+            models.Index(fields=['rank'], name='leaderboard_rank_idx'),
+            models.Index(fields=['total_calories', 'rank'], name='leaderboard_calories_rank_idx'),
+        ]
     
     def __str__(self):
         return f"Rank {self.rank} - User {self.user_id}"
 
 
+class TeamStats(models.Model):
+    """Model for the materialized team leaderboard snapshot"""
+    team_id = models.IntegerField(unique=True)
+    member_count = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    total_activities = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0)  # in minutes
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'team_stats'
+        verbose_name_plural = 'team stats'
+    
+    def __str__(self):
+        return f"Team {self.team_id} - {self.total_calories} calories"
+
+
+class Job(models.Model):
+    """Model for queued recomputations of derived data"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+    
+    name = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    enqueued_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'jobs'
+        constraints = [
+            # Duplicate requests coalesce into the one pending job of that name
+            models.UniqueConstraint(
+                fields=['name'], condition=models.Q(status='pending'), name='job_pending_name_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'enqueued_at'], name='job_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+
+class DerivedState(models.Model):
+    """Model for freshness flags of derived data, shared by every process using the database"""
+    name = models.CharField(max_length=100, unique=True)
+    stale = models.BooleanField(default=False)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+    version = models.IntegerField(default=0)  # bumped on every change to the source data
+    
+    class Meta:
+        db_table = 'derived_state'
+    
+    def __str__(self):
+        return f"{self.name} ({'stale' if self.stale else 'fresh'})"
+
+
 class Workout(models.Model):
     """Model for workout suggestions collection"""
     name = models.CharField(max_length=200)
@@ -0,0 +1,10 @@
+"""
+djongo database backend with process-wide MongoDB connection pooling.
+
+Use it as the ENGINE ('octofit_tracker.mongo') in place of 'djongo'. Every
+Django connection to the same database alias shares one MongoClient, whose
+pool is sized by the CLIENT options (maxPoolSize, minPoolSize, ...).
+Closing a Django connection returns nothing to the network; the client keeps
+its pooled sockets and retires idle ones itself. With CONN_HEALTH_CHECKS the
+backend pings the server before reusing a persistent connection.
+"""
@@ -0,0 +1,90 @@
+"""
+The djongo DatabaseWrapper behind the octofit_tracker.mongo engine.
+
+It hands every Django connection of a database alias the same pooled
+MongoClient, checks that client's health before reusing a persistent
+connection, and wraps djongo's cursor so duplicate-key errors surface as
+IntegrityError.
+"""
+import threading
+from collections import OrderedDict
+
+from djongo import base as djongo_base
+from djongo import database as djongo_database
+from djongo.cursor import Cursor as DjongoCursor
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+from .pool import pool_stats
+
+# One client per database alias; djongo keys its clients by database name,
+# which would hand a replica alias the primary's client
+_clients = {}
+_clients_lock = threading.Lock()
+
+DUPLICATE_KEY = 11000
+
+
+def is_duplicate_key(exc):
+    """Whether a unique index rejected the write that raised exc, somewhere in its cause chain"""
+    while exc is not None:
+        if isinstance(exc, DuplicateKeyError):
+            return True
+        if isinstance(exc, BulkWriteError) and any(
+            error.get('code') == DUPLICATE_KEY for error in exc.details.get('writeErrors', [])
+        ):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class Cursor(DjongoCursor):
+    """
+    djongo cursor reporting unique index violations as IntegrityError; djongo
+    raises a bare DatabaseError for every failure, which callers handling
+    concurrent inserts cannot tell apart from real errors
+    """
+
+    def execute(self, sql, params=None):
+        try:
+            return super().execute(sql, params)
+        except djongo_database.DatabaseError as exc:
+            if is_duplicate_key(exc):
+                raise djongo_database.IntegrityError(*exc.args) from exc
+            raise
+
+
+class DatabaseWrapper(djongo_base.DatabaseWrapper):
+    """djongo wrapper sharing one pooled MongoClient per database alias across the process"""
+
+    def get_new_connection(self, connection_params):
+        name = connection_params.pop('name')
+        enforce_schema = connection_params.pop('enforce_schema')
+        connection_params['document_class'] = OrderedDict
+        connection_params['event_listeners'] = [*connection_params.get('event_listeners', []), pool_stats]
+        # djongo closes the cached client here, which would tear down the pool
+        # under every other thread; reuse it instead
+        with _clients_lock:
+            if self.alias not in _clients:
+                _clients[self.alias] = MongoClient(**connection_params, connect=False)
+            self.client_connection = _clients[self.alias]
+        database = self.client_connection[name]
+        self.djongo_connection = djongo_base.DjongoClient(database, enforce_schema)
+        return database
+
+    def create_cursor(self, name=None):
+        return Cursor(self.client_connection, self.connection, self.djongo_connection)
+
+    def is_usable(self):
+        if self.connection is None:
+            return False
+        try:
+            self.connection.client.admin.command('ping')
+        except PyMongoError:
+            return False
+        return True
+
+    def _close(self):
+        # The shared client keeps its sockets pooled (idle ones are retired
+        # after maxIdleTimeMS), so there is nothing to close per connection
+        pass
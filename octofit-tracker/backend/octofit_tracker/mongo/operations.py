@@ -0,0 +1,74 @@
+"""
+Migration operations for constraints djongo cannot express.
+
+djongo turns a conditional UniqueConstraint into a plain unique index: the
+WHERE clause is dropped and its text replaces the indexed field, so the
+index covers a key that is missing from every document and the second
+insert into the collection fails. AddPartialUniqueConstraint keeps the
+constraint as-is on SQL backends and, on MongoDB, creates the unique index
+itself with a partialFilterExpression built from the condition.
+"""
+from django.db import migrations
+from django.db.models import Q
+
+# BSON types of the values stored for a field, for `isnull=False` conditions;
+# djongo stores None as an explicit null, so `$exists` would still match it
+BSON_TYPES = {
+    'CharField': 'string',
+    'TextField': 'string',
+    'IntegerField': 'int',
+    'BigIntegerField': 'long',
+}
+
+
+def partial_filter(model, condition):
+    """The partialFilterExpression for a constraint condition of equality and isnull=False lookups"""
+    expression = {}
+    for child in condition.children:
+        if isinstance(child, Q) or condition.connector != Q.AND or condition.negated:
+            raise ValueError(f'Cannot express {condition} as a MongoDB partial filter')
+        lookup, value = child
+        name, _, operator = lookup.partition('__')
+        field = model._meta.get_field(name)
+        if operator in ('', 'exact'):
+            expression[field.column] = value
+        elif operator == 'isnull' and value is False and field.get_internal_type() in BSON_TYPES:
+            expression[field.column] = {'$type': BSON_TYPES[field.get_internal_type()]}
+        else:
+            raise ValueError(f'Cannot express {lookup}={value!r} as a MongoDB partial filter')
+    return expression
+
+
+def create_partial_index(connection, model, constraint):
+    """Create a constraint's unique index on MongoDB"""
+    connection.ensure_connection()
+    connection.connection[model._meta.db_table].create_index(
+        [(model._meta.get_field(name).column, 1) for name in constraint.fields],
+        name=constraint.name,
+        unique=True,
+        partialFilterExpression=partial_filter(model, constraint.condition),
+    )
+
+
+def drop_partial_index(connection, model, constraint):
+    connection.ensure_connection()
+    connection.connection[model._meta.db_table].drop_index(constraint.name)
+
+
+class AddPartialUniqueConstraint(migrations.AddConstraint):
+    """AddConstraint for a conditional UniqueConstraint that djongo would otherwise mistranslate"""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'djongo':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            create_partial_index(schema_editor.connection, model, self.constraint)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'djongo':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            drop_partial_index(schema_editor.connection, model, self.constraint)
+
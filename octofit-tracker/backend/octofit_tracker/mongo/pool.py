@@ -0,0 +1,79 @@
+"""
+Connection pool counters for the process-wide MongoClients.
+
+pool_stats listens to pymongo's pool events and keeps per-server counts of
+sockets created and closed, checkouts in use and their peak, checkout
+failures and pool clears, as reported by the diagnostics endpoint.
+"""
+import threading
+from collections import defaultdict
+
+from pymongo import monitoring
+
+COUNTERS = ['created', 'closed', 'checked_out', 'checked_in', 'checkout_failures', 'clears']
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counts pymongo connection pool events per server address"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = defaultdict(self._empty)
+
+    @staticmethod
+    def _empty():
+        return {**dict.fromkeys(COUNTERS, 0), 'in_use': 0, 'max_in_use': 0}
+
+    def _count(self, event, counter, in_use=0):
+        address = '%s:%s' % event.address
+        with self._lock:
+            pool = self._pools[address]
+            pool[counter] += 1
+            pool['in_use'] += in_use
+            pool['max_in_use'] = max(pool['max_in_use'], pool['in_use'])
+
+    def pool_created(self, event):
+        with self._lock:
+            self._pools.setdefault('%s:%s' % event.address, self._empty())
+
+    def pool_cleared(self, event):
+        self._count(event, 'clears')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._count(event, 'created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count(event, 'closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._count(event, 'checkout_failures')
+
+    def connection_checked_out(self, event):
+        self._count(event, 'checked_out', in_use=1)
+
+    def connection_checked_in(self, event):
+        self._count(event, 'checked_in', in_use=-1)
+
+    def snapshot(self):
+        """Per-address counters plus the sockets currently open (created minus closed)"""
+        with self._lock:
+            return {
+                address: {**pool, 'open': pool['created'] - pool['closed']}
+                for address, pool in sorted(self._pools.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._pools.clear()
+
+
+pool_stats = PoolStats()
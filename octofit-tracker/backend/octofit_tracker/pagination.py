@@ -0,0 +1,22 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination that seeks past the last row of the previous page,
+    so every page costs the same as the first one.
+    """
+    ordering = ('id',)
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+
+class ActivityPagination(KeysetPagination):
+    """Keyset pagination for activities ordered by (date, id)"""
+    ordering = ('date', 'id')
+
+
+class LeaderboardPagination(KeysetPagination):
+    """Keyset pagination for leaderboard entries ordered by rank"""
+    ordering = ('rank', 'id')
@@ -0,0 +1,113 @@
+"""
+Query plan inspection for the API's hot queries.
+
+Each hot query is described twice: as the Django queryset the API runs, and
+as the equivalent MongoDB find() so the plan can be read from MongoDB when the
+djongo backend is in use (djongo does not implement QuerySet.explain()).
+"""
+import re
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import Activity, Leaderboard, User
+
+HotQuery = namedtuple('HotQuery', ['name', 'queryset', 'mongo'])
+MongoQuery = namedtuple('MongoQuery', ['collection', 'filter', 'sort', 'limit'])
+QueryPlan = namedtuple('QueryPlan', ['name', 'indexes', 'full_scan', 'plan'])
+
+SQL_INDEX_PATTERN = re.compile(
+    r'USING (?:COVERING )?INDEX (\w+)'        # SQLite
+    r'|Index (?:Only )?Scan using (\w+)'      # PostgreSQL
+    r'|Bitmap Index Scan on (\w+)'            # PostgreSQL
+    r'|USING (INTEGER PRIMARY KEY)'           # SQLite rowid lookups
+)
+SQL_FULL_SCAN_PATTERN = re.compile(r'\bSCAN \w+\b(?! USING)|Seq Scan on')
+
+
+def hot_queries():
+    """The queries behind the busiest API endpoints"""
+    now = timezone.now()
+    week_ago = now - timedelta(days=7)
+    return [
+        HotQuery(
+            'activities for a user in a date range',
+            Activity.objects.filter(user_id=1, date__gte=week_ago, date__lt=now).order_by('date', 'id'),
+            MongoQuery('activities', {'user_id': 1, 'date': {'$gte': week_ago, '$lt': now}}, [('date', 1), ('id', 1)], 0),
+        ),
+        HotQuery(
+            'activities of a type in a date range',
+            Activity.objects.filter(activity_type='Running', date__gte=week_ago, date__lt=now).order_by('date', 'id'),
+            MongoQuery('activities', {'activity_type': 'Running', 'date': {'$gte': week_ago, '$lt': now}}, [('date', 1), ('id', 1)], 0),
+        ),
+        HotQuery(
+            'activities for a team in a date range',
+            Activity.objects.filter(user_id__in=[1, 2, 3], date__gte=week_ago, date__lt=now).order_by('date', 'id'),
+            MongoQuery('activities', {'user_id': {'$in': [1, 2, 3]}, 'date': {'$gte': week_ago, '$lt': now}}, [('date', 1), ('id', 1)], 0),
+        ),
+        HotQuery(
+            'activities page',
+            Activity.objects.order_by('date', 'id')[:100],
+            MongoQuery('activities', {}, [('date', 1), ('id', 1)], 100),
+        ),
+        HotQuery(
+            'users in a team',
+            User.objects.filter(team_id=1),
+            MongoQuery('users', {'team_id': 1}, None, 0),
+        ),
+        HotQuery(
+            'leaderboard page',
+            Leaderboard.objects.order_by('rank', 'id')[:100],
+            MongoQuery('leaderboard', {}, [('rank', 1), ('id', 1)], 100),
+        ),
+        HotQuery(
+            'leaderboard neighbours by rank',
+            Leaderboard.objects.filter(rank__gte=45, rank__lte=55).order_by('rank'),
+            MongoQuery('leaderboard', {'rank': {'$gte': 45, '$lte': 55}}, [('rank', 1)], 0),
+        ),
+        HotQuery(
+            'leaderboard tie group',
+            Leaderboard.objects.filter(total_calories=1000).order_by('rank')[:1],
+            MongoQuery('leaderboard', {'total_calories': 1000}, [('rank', 1)], 1),
+        ),
+        HotQuery(
+            'leaderboard entry for a user',
+            Leaderboard.objects.filter(user_id=1),
+            MongoQuery('leaderboard', {'user_id': 1}, None, 0),
+        ),
+    ]
+
+
+def explain(hot_query):
+    """Return the QueryPlan the database picks for a hot query"""
+    if connection.vendor == 'djongo':
+        return _explain_mongo(hot_query)
+    plan = hot_query.queryset.explain()
+    indexes = [next(name for name in match.groups() if name) for match in SQL_INDEX_PATTERN.finditer(plan)]
+    return QueryPlan(hot_query.name, indexes, bool(SQL_FULL_SCAN_PATTERN.search(plan)), plan)
+
+
+def _explain_mongo(hot_query):
+    connection.ensure_connection()
+    spec = hot_query.mongo
+    cursor = connection.connection[spec.collection].find(spec.filter)
+    if spec.sort:
+        cursor = cursor.sort(spec.sort)
+    if spec.limit:
+        cursor = cursor.limit(spec.limit)
+    winning_plan = cursor.explain()['queryPlanner']['winningPlan']
+
+    indexes, full_scan = [], False
+    stages = [winning_plan]
+    while stages:
+        stage = stages.pop()
+        if stage.get('stage') == 'IXSCAN':
+            indexes.append(stage['indexName'])
+        elif stage.get('stage') == 'COLLSCAN':
+            full_scan = True
+        if 'inputStage' in stage:
+            stages.append(stage['inputStage'])
+        stages.extend(stage.get('inputStages', []))
+    return QueryPlan(hot_query.name, indexes, full_scan, str(winning_plan))
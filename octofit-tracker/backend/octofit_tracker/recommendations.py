@@ -0,0 +1,230 @@
+"""
+Workout recommendations from a user's recent activity.
+
+A user's profile is built from the daily rollups of the last
+RECOMMENDATION_WINDOW_DAYS: per activity type, the share of their
+activities, the average session length and the calories burned per minute.
+Every workout in the catalogue is then scored at once with NumPy against
+that profile. The catalogue is held as arrays that are rebuilt only when a
+workout changes, so a request costs one rollup query plus a few vector
+operations, whatever the size of the catalogue.
+
+Each user's ranking is cached in its own bounded store (see
+RECOMMENDATION_CACHE_BACKEND), tagged with the catalogue version and the
+day it was computed. New or changed activities delete the user's entry;
+workout changes bump the catalogue version, which is kept in the database
+so no cache eviction can bring back a stale ranking.
+"""
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import caching
+from .models import ActivityRollup, DerivedState, Workout
+
+# DerivedState row whose version counts workout catalogue changes
+CATALOGUE_STATE = 'workout_catalogue'
+
+# Typical calories burned per minute by a 70 kg adult (from MET values), for
+# synthetic data and workouts without an estimate of their own
+CALORIES_PER_MINUTE = {
+    'Running': 11.5,
+    'Cycling': 8.5,
+    'Swimming': 9.5,
+    'Walking': 4.5,
+    'Weightlifting': 5.5,
+    'Yoga': 3.5,
+    'Boxing': 10.0,
+    'HIIT': 12.0,
+}
+DEFAULT_CALORIES_PER_MINUTE = 7.0
+DEFAULT_SESSION_MINUTES = 30
+DIFFICULTY_LEVELS = {'easy': 0, 'beginner': 0, 'medium': 1, 'intermediate': 1, 'hard': 2, 'advanced': 2}
+# Weekly active minutes at which a user moves up to the next difficulty level
+LEVEL_MINUTES = [90, 180]
+# Weights of type affinity, session-length fit and difficulty fit in the score
+WEIGHTS = (0.5, 0.3, 0.2)
+# Affinity of types the user has not done recently, so they still get suggested
+EXPLORATION = 0.1
+
+
+def calories_per_minute(activity_type):
+    return CALORIES_PER_MINUTE.get(activity_type, DEFAULT_CALORIES_PER_MINUTE)
+
+
+class Catalogue:
+    """The workout catalogue as parallel arrays, with activity types encoded"""
+
+    def __init__(self, workouts):
+        ids, types, difficulties, durations, calories = zip(*workouts) if workouts else ([], [], [], [], [])
+        self.ids = np.array(ids, dtype='int64')
+        self.types, codes = np.unique(np.array(types, dtype=object), return_inverse=True)
+        self.types = list(self.types)
+        self.type_codes = codes.reshape(-1)
+        self.levels = np.array(
+            [DIFFICULTY_LEVELS.get(difficulty.lower(), 1) for difficulty in difficulties], dtype='float64'
+        )
+        self.durations = np.maximum(np.array(durations, dtype='float64'), 1)
+        self.calories = np.array(calories, dtype='float64')
+        # Calories per minute the workout's own estimate implies, or the typical rate for its type
+        typical = np.array([calories_per_minute(activity_type) for activity_type in self.types], dtype='float64')
+        self.rates = np.where(self.calories > 0, self.calories / self.durations, typical[self.type_codes])
+
+    def __len__(self):
+        return len(self.ids)
+
+
+_catalogue = None
+_catalogue_lock = threading.Lock()
+_store = None
+
+
+def get_store():
+    """The store for per-user rankings, built from RECOMMENDATION_CACHE_BACKEND"""
+    global _store
+    if _store is None:
+        backend = import_string(settings.RECOMMENDATION_CACHE_BACKEND)
+        if issubclass(backend, caching.LocalMemoryBackend):
+            _store = backend(max_entries=settings.RECOMMENDATION_CACHE_MAX_ENTRIES)
+        else:
+            _store = backend()
+    return _store
+
+
+def reset():
+    """Drop the ranking store and the loaded catalogue (used by tests and settings changes)"""
+    global _catalogue, _store
+    _catalogue = None
+    _store = None
+
+
+def catalogue_version():
+    return DerivedState.objects.filter(name=CATALOGUE_STATE).values_list('version', flat=True).first() or 0
+
+
+def invalidate_catalogue():
+    """Bump the catalogue version after workouts were created, changed or deleted"""
+    if not DerivedState.objects.filter(name=CATALOGUE_STATE).update(version=F('version') + 1):
+        _, created = DerivedState.objects.get_or_create(name=CATALOGUE_STATE, defaults={'version': 1})
+        if not created:
+            invalidate_catalogue()
+
+
+def get_catalogue(version=None):
+    """
+    The catalogue at the given (or current) version, reloaded from the
+    database when the version changed or, to pick up workouts written by
+    other processes, when it is older than RECOMMENDATION_CATALOGUE_TTL seconds
+    """
+    global _catalogue
+    version = catalogue_version() if version is None else version
+    with _catalogue_lock:
+        if (
+            _catalogue is None or _catalogue[0] != version
+            or time.monotonic() - _catalogue[1] > settings.RECOMMENDATION_CATALOGUE_TTL
+        ):
+            rows = Workout.objects.order_by('id').values_list(
+                'id', 'activity_type', 'difficulty', 'estimated_duration', 'estimated_calories',
+            )
+            _catalogue = (version, time.monotonic(), Catalogue(list(rows)))
+        return _catalogue[2]
+
+
+def user_profile(user_id, today=None):
+    """Per-type totals of the user's activities over the recommendation window"""
+    today = today or timezone.localdate()
+    start = today - timedelta(days=settings.RECOMMENDATION_WINDOW_DAYS)
+    rows = (
+        ActivityRollup.objects.filter(user_id=user_id, period=ActivityRollup.DAY, bucket_start__gt=start)
+        .values('activity_type')
+        .annotate(count=Sum('activity_count'), calories=Sum('total_calories'), duration=Sum('total_duration'))
+    )
+    return {row['activity_type']: row for row in rows if row['count'] > 0}
+
+
+def score_workouts(catalogue, profile):
+    """
+    Score every workout for a profile; returns (scores, estimated calories),
+    both aligned with catalogue.ids
+    """
+    activities = sum(row['count'] for row in profile.values())
+    minutes = sum(row['duration'] for row in profile.values())
+    overall_session = minutes / activities if activities else DEFAULT_SESSION_MINUTES
+
+    # Per-type profile, aligned with the catalogue's type codes; a rate of 0
+    # means no history, so the workout's own estimate is used
+    share = np.zeros(len(catalogue.types))
+    session = np.full(len(catalogue.types), float(overall_session))
+    rate = np.zeros(len(catalogue.types))
+    for code, activity_type in enumerate(catalogue.types):
+        row = profile.get(activity_type)
+        if row:
+            share[code] = row['count'] / activities
+            session[code] = row['duration'] / row['count']
+            if row['duration']:
+                rate[code] = row['calories'] / row['duration']
+
+    codes = catalogue.type_codes
+    affinity = np.maximum(share[codes], EXPLORATION)
+    affinity /= affinity.max() if len(affinity) else 1
+    # 1 when the workout is as long as the user's usual session, falling with the ratio
+    target = session[codes]
+    length_fit = np.minimum(catalogue.durations, target) / np.maximum(catalogue.durations, target)
+    weekly_minutes = minutes * 7 / settings.RECOMMENDATION_WINDOW_DAYS
+    level = float(np.searchsorted(LEVEL_MINUTES, weekly_minutes, side='right'))
+    difficulty_fit = 1 - np.abs(catalogue.levels - level) / 2
+
+    scores = WEIGHTS[0] * affinity + WEIGHTS[1] * length_fit + WEIGHTS[2] * difficulty_fit
+    user_rate = rate[codes]
+    calories = np.where(user_rate > 0, user_rate, catalogue.rates) * catalogue.durations
+    return scores, calories
+
+
+def recommend(user_id, limit):
+    """
+    The user's top workouts as (workout id, score, estimated calories),
+    best first, cached until the user's activities or the catalogue change
+    """
+    store = get_store()
+    version = catalogue_version()
+    today = timezone.localdate().isoformat()
+    entry = store.get(_ranking_key(user_id))
+    if entry is None or entry['catalogue'] != version or entry['date'] != today:
+        catalogue = get_catalogue(version)
+        scores, calories = score_workouts(catalogue, user_profile(user_id, timezone.localdate()))
+        # Keep the best RECOMMENDATION_MAX_RESULTS, ties going to the older
+        # workout: find the cutoff score in linear time, then sort only the
+        # workouts scoring at least that, including every one tied with it
+        top = min(settings.RECOMMENDATION_MAX_RESULTS, len(catalogue))
+        best = np.arange(len(catalogue))
+        if 0 < top < len(catalogue):
+            cutoff = -np.partition(-scores, top - 1)[top - 1]
+            best = np.flatnonzero(scores >= cutoff)
+        best = best[np.lexsort((catalogue.ids[best], -scores[best]))][:top]
+        entry = {
+            'catalogue': version,
+            'date': today,
+            'ranked': [
+                (int(catalogue.ids[index]), round(float(scores[index]), 4), int(round(calories[index])))
+                for index in best
+            ],
+        }
+        store.set(_ranking_key(user_id), entry)
+    return entry['ranked'][:limit]
+
+
+def _ranking_key(user_id):
+    return f'recommendations:{user_id}'
+
+
+def record_activity_changes(added=(), removed=()):
+    """Drop the cached recommendations of users whose activities changed"""
+    store = get_store()
+    for user_id in {activity.user_id for activity in [*added, *removed]}:
+        store.delete(_ranking_key(user_id))
@@ -0,0 +1,138 @@
+import abc
+import csv
+import io
+import json
+from datetime import datetime
+
+from django.utils import timezone
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .fast_serializers import iso_datetime
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+
+def _jsonable(value):
+    if isinstance(value, datetime):
+        return iso_datetime(value) if timezone.is_aware(value) else value.isoformat()
+    return value
+
+
+class StreamingRenderer(BaseRenderer, abc.ABC):
+    """
+    Renderer for exports that are written out row by row. stream() turns an
+    iterator of value tuples into text chunks of batch_size rows each, so a
+    StreamingHttpResponse can send any number of rows in constant memory.
+    render() covers the non-streamed responses of the same view, i.e. errors.
+    """
+    charset = 'utf-8'
+    batch_size = 500
+
+    @abc.abstractmethod
+    def stream(self, fields, rows):
+        """Text chunks for an iterator of value tuples in the order of fields"""
+
+
+class NDJSONRenderer(StreamingRenderer):
+    """Renders one JSON object per line"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        items = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(item, default=_jsonable) + '\n' for item in items).encode(self.charset)
+
+    def stream(self, fields, rows):
+        lines = []
+        for row in rows:
+            lines.append(json.dumps(dict(zip(fields, map(_jsonable, row)))))
+            if len(lines) >= self.batch_size:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+
+class CSVRenderer(StreamingRenderer):
+    """Renders rows as CSV with a header line; null values are left empty"""
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if isinstance(data, dict):
+            # Error details: one row per field
+            writer.writerow(['field', 'detail'])
+            for field, detail in data.items():
+                writer.writerow([field, ' '.join(map(str, detail)) if isinstance(detail, list) else detail])
+        else:
+            rows = data if isinstance(data, list) else [data]
+            fields = list(rows[0]) if rows else []
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow([_jsonable(row[field]) for field in fields])
+        return buffer.getvalue().encode(self.charset)
+
+    def stream(self, fields, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        pending = 0
+        for row in rows:
+            writer.writerow([_jsonable(value) for value in row])
+            pending += 1
+            if pending >= self.batch_size:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+        yield buffer.getvalue()
+
+
+def columnar(rows):
+    """
+    A list of objects as {"fields": [...], "rows": [[...], ...]}, with the
+    keys listed once in first-seen order and missing values as null
+    """
+    fields = list(dict.fromkeys(key for row in rows for key in row))
+    return {'fields': fields, 'rows': [[row.get(field) for field in fields] for row in rows]}
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """
+    JSON with lists of objects sent as a header of keys plus one array per
+    row. Applies to a list response or the results of a paginated one; other
+    responses (errors, single objects) are plain JSON.
+    """
+    media_type = 'application/vnd.octofit.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, list) and all(isinstance(row, dict) for row in data):
+            data = columnar(data)
+        elif isinstance(data, dict) and isinstance(data.get('results'), list):
+            data = {**data, 'results': columnar(data['results'])}
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Renders MessagePack; values JSON cannot hold natively are converted as JSONRenderer does"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=JSONEncoder().default)
+
@@ -0,0 +1,223 @@
+"""
+Time-bucketed activity rollups.
+
+ActivityRollup holds per-user totals for each activity type by day and by
+ISO week. Activity writes apply deltas to the affected buckets, so range
+queries such as "calories this week" read O(buckets) rows instead of
+scanning raw activities.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from . import caching
+from .models import Activity, ActivityRollup
+
+PERIODS = [ActivityRollup.DAY, ActivityRollup.WEEK]
+TOTAL_FIELDS = ['activity_count', 'total_calories', 'total_duration', 'total_distance']
+BATCH_SIZE = 1000
+
+
+def week_start(day):
+    """Monday of the ISO week containing day"""
+    return day - timedelta(days=day.weekday())
+
+
+def bucket_start(period, day):
+    return week_start(day) if period == ActivityRollup.WEEK else day
+
+
+def activity_day(activity):
+    return timezone.localtime(activity.date).date() if timezone.is_aware(activity.date) else activity.date.date()
+
+
+def bucket_deltas(added=(), removed=()):
+    """Net totals change per (user_id, period, bucket_start, activity_type)"""
+    deltas = defaultdict(lambda: [0, 0, 0, 0.0])
+    for sign, activities in ((1, added), (-1, removed)):
+        for activity in activities:
+            day = activity_day(activity)
+            for period in PERIODS:
+                delta = deltas[(activity.user_id, period, bucket_start(period, day), activity.activity_type)]
+                delta[0] += sign
+                delta[1] += sign * activity.calories
+                delta[2] += sign * activity.duration
+                delta[3] += sign * (activity.distance or 0)
+    return {key: tuple(delta) for key, delta in deltas.items() if any(delta)}
+
+
+def apply_bucket_delta(user_id, period, start, activity_type, delta):
+    """Add a delta to one bucket in one atomic increment"""
+    bucket = ActivityRollup.objects.filter(
+        user_id=user_id, period=period, bucket_start=start, activity_type=activity_type
+    )
+    updated = bucket.update(**{field: F(field) + value for field, value in zip(TOTAL_FIELDS, delta)})
+    if updated or delta[0] <= 0:
+        return
+    try:
+        with transaction.atomic():
+            ActivityRollup.objects.create(
+                user_id=user_id, period=period, bucket_start=start, activity_type=activity_type,
+                **dict(zip(TOTAL_FIELDS, delta)),
+            )
+    except IntegrityError:
+        apply_bucket_delta(user_id, period, start, activity_type, delta)
+
+
+def record_activity_changes(added=(), removed=()):
+    """
+    Apply the rollup deltas for added and removed activities: missing
+    buckets are inserted with one bulk_create and existing buckets get an
+    atomic increment each, batched into a single executemany on SQL backends.
+    """
+    deltas = bucket_deltas(added, removed)
+    if not deltas:
+        return
+    user_ids = {key[0] for key in deltas}
+    starts = [key[2] for key in deltas]
+    candidates = ActivityRollup.objects.filter(
+        user_id__in=user_ids, bucket_start__gte=min(starts), bucket_start__lte=max(starts)
+    ).values_list('id', 'user_id', 'period', 'bucket_start', 'activity_type')
+    existing = {}
+    for bucket_id, *key in candidates:
+        if tuple(key) in deltas:
+            existing[tuple(key)] = bucket_id
+    _increment_buckets([(bucket_id, deltas[key]) for key, bucket_id in existing.items()])
+
+    new = {key: delta for key, delta in deltas.items() if key not in existing and delta[0] > 0}
+    try:
+        with transaction.atomic():
+            ActivityRollup.objects.bulk_create(
+                [
+                    ActivityRollup(
+                        user_id=user_id, period=period, bucket_start=start, activity_type=activity_type,
+                        **dict(zip(TOTAL_FIELDS, delta)),
+                    )
+                    for (user_id, period, start, activity_type), delta in new.items()
+                ],
+                batch_size=BATCH_SIZE,
+            )
+    except IntegrityError:
+        # A concurrent writer created some of these buckets first
+        for key, delta in new.items():
+            apply_bucket_delta(*key, delta)
+    # Windowed leaderboards are summed from the daily buckets
+    caching.invalidate_leaderboard()
+
+
+def _increment_buckets(increments):
+    """Add (bucket_id, delta) increments, one UPDATE per bucket sent as a single batch"""
+    if not increments:
+        return
+    if connection.vendor == 'djongo':
+        # djongo cannot translate column arithmetic in raw SQL, so go through the ORM
+        for bucket_id, delta in increments:
+            ActivityRollup.objects.filter(id=bucket_id).update(
+                **{field: F(field) + value for field, value in zip(TOTAL_FIELDS, delta)}
+            )
+        return
+    quote = connection.ops.quote_name
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+        quote(ActivityRollup._meta.db_table),
+        ', '.join(f'{quote(field)} = {quote(field)} + %s' for field in TOTAL_FIELDS),
+        quote('id'),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(*delta, bucket_id) for bucket_id, delta in increments])
+
+
+def _create_buckets(buckets):
+    ActivityRollup.objects.bulk_create(
+        [
+            ActivityRollup(
+                user_id=user_id, period=period, bucket_start=start, activity_type=activity_type,
+                **dict(zip(TOTAL_FIELDS, totals)),
+            )
+            for (user_id, period, start, activity_type), totals in buckets.items()
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    return len(buckets)
+
+
+def rebuild_rollups():
+    """
+    Rebuild every rollup from Activity with one grouped aggregation per day,
+    read in user order; weekly buckets are folded from the daily ones. Buckets
+    are written out whenever BATCH_SIZE of them are complete, at a change of
+    user, so memory is bounded by the batch rather than the table. Returns
+    the bucket count.
+    """
+    days = (
+        Activity.objects
+        .annotate(day=TruncDate('date'))
+        .values('user_id', 'day', 'activity_type')
+        .annotate(
+            activity_count=Count('id'),
+            total_calories=Sum('calories'),
+            total_duration=Sum('duration'),
+            total_distance=Coalesce(Sum('distance'), 0.0),
+        )
+        .order_by('user_id')
+    )
+    created = 0
+    buckets = defaultdict(lambda: [0, 0, 0, 0.0])
+    user_id = None
+    with transaction.atomic():
+        ActivityRollup.objects.all().delete()
+        for row in days.iterator(chunk_size=BATCH_SIZE):
+            if row['user_id'] != user_id:
+                # Every bucket of the previous users is complete
+                if len(buckets) >= BATCH_SIZE:
+                    created += _create_buckets(buckets)
+                    buckets.clear()
+                user_id = row['user_id']
+            for period in PERIODS:
+                bucket = buckets[(user_id, period, bucket_start(period, row['day']), row['activity_type'])]
+                for position, field in enumerate(TOTAL_FIELDS):
+                    bucket[position] += row[field]
+        created += _create_buckets(buckets)
+    caching.invalidate_leaderboard()
+    return created
+
+
+def compact_rollups(retain_days, today=None):
+    """
+    Delete daily buckets older than retain_days and buckets that have been
+    emptied by deletions. Weekly buckets are kept for long-range stats.
+    Returns the number of buckets deleted.
+    """
+    today = today or timezone.localdate()
+    cutoff = today - timedelta(days=retain_days)
+    expired = ActivityRollup.objects.filter(period=ActivityRollup.DAY, bucket_start__lt=cutoff)
+    deleted, _ = expired.delete()
+    emptied, _ = ActivityRollup.objects.filter(activity_count__lte=0).delete()
+    return deleted + emptied
+
+
+def user_stats(user_id, period, start=None, end=None, activity_type=None):
+    """
+    Totals per bucket for one user between start (inclusive) and end
+    (exclusive), each with a per-activity-type breakdown.
+    """
+    rows = ActivityRollup.objects.filter(user_id=user_id, period=period)
+    if start is not None:
+        rows = rows.filter(bucket_start__gte=bucket_start(period, start))
+    if end is not None:
+        rows = rows.filter(bucket_start__lt=end)
+    if activity_type is not None:
+        rows = rows.filter(activity_type=activity_type)
+
+    buckets = {}
+    for row in rows.order_by('bucket_start', 'activity_type').values('bucket_start', 'activity_type', *TOTAL_FIELDS):
+        bucket = buckets.get(row['bucket_start'])
+        if bucket is None:
+            bucket = buckets[row['bucket_start']] = {**dict.fromkeys(TOTAL_FIELDS, 0), 'by_type': {}}
+        for field in TOTAL_FIELDS:
+            bucket[field] += row[field]
+        bucket['by_type'][row['activity_type']] = {field: row[field] for field in TOTAL_FIELDS}
+    return [{'bucket_start': day, **totals} for day, totals in buckets.items()]
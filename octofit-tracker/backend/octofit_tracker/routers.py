@@ -0,0 +1,102 @@
+"""
+Primary/replica database routing.
+
+When a 'replica' database alias is configured, queries made while serving a
+safe request (GET, HEAD, OPTIONS) read from the replica; everything else,
+writes, unsafe requests, management commands and background jobs, uses the
+primary. Replicas lag behind the primary, so reads stick to the primary:
+
+- for the rest of a request once it has written anything;
+- for REPLICA_STICKY_SECONDS after a client's last unsafe request, tracked
+  with a cookie so it holds across processes;
+- inside `primary()` blocks, for reads that feed a write.
+
+Without a replica alias every query goes to the primary.
+"""
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = 'replica'
+STICKY_COOKIE = 'octofit_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica_reads = ContextVar('octofit_replica_reads', default=False)
+
+
+def replica_configured():
+    return REPLICA_DB_ALIAS in connections.settings
+
+
+@contextmanager
+def primary():
+    """Read from the primary inside the block"""
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """Send reads of safe requests to the replica and all other queries to the primary"""
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and replica_configured():
+            return REPLICA_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Read your own writes for the rest of the request
+        _replica_reads.set(False)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        databases = {DEFAULT_DB_ALIAS, REPLICA_DB_ALIAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """Allow replica reads for safe requests and pin clients to the primary after they write"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function, as MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _replica_reads.set(self.reads_from_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _replica_reads.reset(token)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        token = _replica_reads.set(self.reads_from_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _replica_reads.reset(token)
+        return self.finish(request, response)
+
+    def reads_from_replica(self, request):
+        return request.method in SAFE_METHODS and STICKY_COOKIE not in request.COOKIES and replica_configured()
+
+    def finish(self, request, response):
+        if request.method not in SAFE_METHODS and replica_configured():
+            response.set_cookie(
+                STICKY_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
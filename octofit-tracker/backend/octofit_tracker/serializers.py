@@ -1,18 +1,24 @@
 from rest_framework import serializers
-from .models import User, Team, Activity, Leaderboard, Workout
+from .expansion import ExpandableListSerializer, ExpandableSerializerMixin, Expansion
+from .metrics import TimedSerializerMixin
+from .models import User, Team, Activity, Job, Leaderboard, Workout
 
 
-class UserSerializer(serializers.ModelSerializer):
-    """Serializer for User model"""
+class UserSerializer(ExpandableSerializerMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    """Serializer for User model, with an expandable team"""
     id = serializers.IntegerField(read_only=True)
+    expandable = {
+        'team': Expansion('octofit_tracker.serializers.TeamSerializer', source='team_id'),
+    }
     
     class Meta:
         model = User
         fields = ['id', 'name', 'email', 'team_id', 'created_at']
         read_only_fields = ['created_at']
+        list_serializer_class = ExpandableListSerializer
 
 
-class TeamSerializer(serializers.ModelSerializer):
+class TeamSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Team model"""
     id = serializers.IntegerField(read_only=True)
     
@@ -22,27 +28,99 @@ class TeamSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at']
 
 
-class ActivitySerializer(serializers.ModelSerializer):
-    """Serializer for Activity model"""
+class ActivityListSerializer(TimedSerializerMixin, ExpandableListSerializer):
+    """List serializer for Activity batches that validates each item on its own"""
+    
+    def validate_each(self):
+        """
+        Validate every item in initial_data and return (valid, errors), where
+        valid holds the validated data of the good items and errors the index
+        and error detail of the rejected ones.
+        """
+        if not isinstance(self.initial_data, list):
+            raise serializers.ValidationError({
+                'non_field_errors': ['Expected a list of items but got type "%s".' % type(self.initial_data).__name__]
+            })
+        
+        valid, errors = [], []
+        for index, item in enumerate(self.initial_data):
+            try:
+                valid.append(self.child.run_validation(item))
+            except serializers.ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+        return valid, errors
+
+
+class ActivitySerializer(ExpandableSerializerMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    """Serializer for Activity model, with expandable user and team"""
     id = serializers.IntegerField(read_only=True)
+    expandable = {
+        'user': Expansion('octofit_tracker.serializers.UserSerializer', source='user_id'),
+        'team': Expansion('octofit_tracker.serializers.TeamSerializer', source='team_id', through='user'),
+    }
     
     class Meta:
         model = Activity
-        fields = ['id', 'user_id', 'activity_type', 'duration', 'distance', 'calories', 'date', 'created_at']
+        fields = [
+            'id', 'user_id', 'activity_type', 'duration', 'distance', 'calories', 'date', 'external_id', 'created_at',
+        ]
         read_only_fields = ['created_at']
+        list_serializer_class = ActivityListSerializer
+    
+    def validate_external_id(self, value):
+        # Creates with a stored external_id return the stored activity, but an
+        # update must not take another activity's id
+        if (
+            self.instance is not None and value is not None and value != self.instance.external_id
+            and Activity.objects.filter(external_id=value).exists()
+        ):
+            raise serializers.ValidationError('Another activity already has this external_id.')
+        return value
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
-    """Serializer for Leaderboard model"""
+class LeaderboardSerializer(ExpandableSerializerMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    """Serializer for Leaderboard model, with expandable user and team"""
     id = serializers.IntegerField(read_only=True)
+    expandable = ActivitySerializer.expandable
     
     class Meta:
         model = Leaderboard
         fields = ['id', 'user_id', 'total_calories', 'total_activities', 'total_duration', 'rank', 'updated_at']
         read_only_fields = ['updated_at']
+        list_serializer_class = ExpandableListSerializer
+
+
+class TeamLeaderboardSerializer(TimedSerializerMixin, serializers.Serializer):
+    """Serializer for team leaderboard rows"""
+    rank = serializers.IntegerField()
+    team_id = serializers.IntegerField()
+    name = serializers.CharField()
+    member_count = serializers.IntegerField()
+    total_calories = serializers.IntegerField()
+    total_activities = serializers.IntegerField()
+    total_duration = serializers.IntegerField()
+
 
+class WindowedLeaderboardSerializer(TimedSerializerMixin, serializers.Serializer):
+    """Serializer for rows of a time-windowed leaderboard"""
+    rank = serializers.IntegerField()
+    user_id = serializers.IntegerField()
+    total_calories = serializers.IntegerField()
+    total_activities = serializers.IntegerField()
+    total_duration = serializers.IntegerField()
 
-class WorkoutSerializer(serializers.ModelSerializer):
+
+class ActivityBucketSerializer(TimedSerializerMixin, serializers.Serializer):
+    """Serializer for per-user rollup buckets"""
+    bucket_start = serializers.DateField()
+    activity_count = serializers.IntegerField()
+    total_calories = serializers.IntegerField()
+    total_duration = serializers.IntegerField()
+    total_distance = serializers.FloatField()
+    by_type = serializers.DictField()
+
+
+class WorkoutSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for Workout model"""
     id = serializers.IntegerField(read_only=True)
     
@@ -50,3 +128,11 @@ class WorkoutSerializer(serializers.ModelSerializer):
         model = Workout
         fields = ['id', 'name', 'description', 'activity_type', 'difficulty', 'estimated_duration', 'estimated_calories', 'created_at']
         read_only_fields = ['created_at']
+
+
+class JobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Serializer for Job model"""
+    
+    class Meta:
+        model = Job
+        fields = ['id', 'name', 'status', 'attempts', 'error', 'enqueued_at', 'started_at', 'finished_at']
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 from pathlib import Path
+import importlib.util
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -52,6 +53,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.metrics.RequestMetricsMiddleware',
+    'octofit_tracker.routers.ReplicaRoutingMiddleware',
+    'octofit_tracker.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -86,18 +90,50 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# MongoDB through octofit_tracker.mongo, a djongo backend that shares one
+# pooled MongoClient per process. Django keeps a connection open for
+# DB_CONN_MAX_AGE seconds and pings the server before reusing it when
+# DB_CONN_HEALTH_CHECKS is on; the MONGO_* pool options are passed to pymongo
+# (see /api/diagnostics/database/ for live pool counters).
 DATABASES = {
     'default': {
-        'ENGINE': 'djongo',
-        'NAME': 'octofit_db',
+        'ENGINE': 'octofit_tracker.mongo',
+        'NAME': os.environ.get('MONGO_DB_NAME', 'octofit_db'),
         'ENFORCE_SCHEMA': False,
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', 'true').lower() in ('1', 'true', 'yes'),
         'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
+            'host': os.environ.get('MONGO_HOST', 'localhost'),
+            'port': int(os.environ.get('MONGO_PORT', 27017)),
+            'maxPoolSize': int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+            'minPoolSize': int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+            'maxIdleTimeMS': int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000)),
+            'serverSelectionTimeoutMS': int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+            'connectTimeoutMS': int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+            'waitQueueTimeoutMS': int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
         }
     }
 }
 
+# Optional read replica. With MONGO_REPLICA_HOST set, reads made while serving
+# GET/HEAD/OPTIONS requests go to it (see routers.py). A client that sent a
+# write reads from the primary for the next REPLICA_STICKY_SECONDS, so it
+# sees its own changes despite replication lag.
+if os.environ.get('MONGO_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'CLIENT': {
+            **DATABASES['default']['CLIENT'],
+            'host': os.environ['MONGO_REPLICA_HOST'],
+            'port': int(os.environ.get('MONGO_REPLICA_PORT', 27017)),
+            'readPreference': os.environ.get('MONGO_REPLICA_READ_PREFERENCE', 'secondaryPreferred'),
+        },
+    }
+
+DATABASE_ROUTERS = ['octofit_tracker.routers.PrimaryReplicaRouter']
+
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -140,6 +176,89 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST Framework
+# Every list endpoint is keyset (cursor) paginated; clients pick a size with ?page_size=
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 100))
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 1000))
+
+# Responses are JSON by default. Clients can ask for columnar JSON (keys
+# once, rows as arrays) or, with the msgpack package installed, MessagePack
+# through the Accept header or ?format=columnar|msgpack.
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetPagination',
+    'PAGE_SIZE': API_PAGE_SIZE,
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'octofit_tracker.renderers.ColumnarJSONRenderer',
+        *(['octofit_tracker.renderers.MessagePackRenderer'] if importlib.util.find_spec('msgpack') else []),
+    ],
+}
+
+# Compress responses of at least COMPRESSION_MIN_SIZE bytes with Brotli (when
+# the brotli package is installed) or gzip, whichever the client accepts.
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+
+# List pages are serialized from .values() rows through precompiled field
+# conversions (see fast_serializers.py). Set to false, or pass
+# ?serializer=classic, to go through the DRF serializers instead.
+API_FAST_LIST_SERIALIZATION = os.environ.get('API_FAST_LIST_SERIALIZATION', 'true').lower() in ('1', 'true', 'yes')
+
+# Leaderboard response cache. LocalMemoryBackend caches per process; use
+# octofit_tracker.caching.DjangoCacheBackend with a shared CACHES backend
+# (e.g. Redis or Memcached) when running several worker processes.
+LEADERBOARD_CACHE_BACKEND = os.environ.get('LEADERBOARD_CACHE_BACKEND', 'octofit_tracker.caching.LocalMemoryBackend')
+
+# Serve /api/teams/leaderboard/ from the incrementally maintained TeamStats
+# snapshot instead of aggregating over users and leaderboard entries per request
+TEAM_STATS_SNAPSHOT = os.environ.get('TEAM_STATS_SNAPSHOT', '').lower() in ('1', 'true', 'yes')
+
+# Daily activity rollups older than this are removed by compact_rollups; the
+# windowed leaderboards (7d, 30d, month) need at least 31 days
+ROLLUP_DAY_RETENTION_DAYS = int(os.environ.get('ROLLUP_DAY_RETENTION_DAYS', 62))
+
+# Bulk activity ingestion: largest batch accepted per request and bulk_create chunk size
+ACTIVITY_BULK_MAX_ITEMS = int(os.environ.get('ACTIVITY_BULK_MAX_ITEMS', 10000))
+ACTIVITY_BULK_CHUNK_SIZE = int(os.environ.get('ACTIVITY_BULK_CHUNK_SIZE', 500))
+
+# Rows fetched per database round trip by the streaming activity export
+ACTIVITY_EXPORT_CHUNK_SIZE = int(os.environ.get('ACTIVITY_EXPORT_CHUNK_SIZE', 2000))
+
+# Columnar activity snapshot for analytics (see columnar.py), refreshed by
+# `manage.py refresh_activity_columns`.
+ACTIVITY_COLUMNS_DIR = os.environ.get('ACTIVITY_COLUMNS_DIR', str(BASE_DIR / 'activity_columns'))
+
+# Workout recommendations (see recommendations.py) score the catalogue against
+# the user's activities of the last RECOMMENDATION_WINDOW_DAYS.
+RECOMMENDATION_WINDOW_DAYS = int(os.environ.get('RECOMMENDATION_WINDOW_DAYS', 28))
+RECOMMENDATION_MAX_RESULTS = int(os.environ.get('RECOMMENDATION_MAX_RESULTS', 50))
+RECOMMENDATION_CATALOGUE_TTL = int(os.environ.get('RECOMMENDATION_CATALOGUE_TTL', 300))
+
+# Store for per-user recommendation rankings, separate from the leaderboard
+# cache. LocalMemoryBackend keeps up to RECOMMENDATION_CACHE_MAX_ENTRIES users
+# per process; use octofit_tracker.caching.DjangoCacheBackend with a shared
+# CACHES backend when running several worker processes.
+RECOMMENDATION_CACHE_BACKEND = os.environ.get(
+    'RECOMMENDATION_CACHE_BACKEND', 'octofit_tracker.caching.LocalMemoryBackend'
+)
+RECOMMENDATION_CACHE_MAX_ENTRIES = int(os.environ.get('RECOMMENDATION_CACHE_MAX_ENTRIES', 10000))
+
+# Recompute derived data (leaderboard ranks, team stats) in background jobs
+# instead of on the request path; reads serve the previous ranks meanwhile and
+# /api/status/ reports what is stale. LocalJobStore runs jobs in-process after
+# the response is sent; DatabaseJobStore queues them in the jobs table for
+# `manage.py run_jobs` workers. A running job counts as stalled after JOB_TIMEOUT seconds.
+DERIVED_DATA_JOBS = os.environ.get('DERIVED_DATA_JOBS', '').lower() in ('1', 'true', 'yes')
+JOB_STORE = os.environ.get('JOB_STORE', 'octofit_tracker.jobs.LocalJobStore')
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 600))
+
+# Per-request query count and timing: adds Server-Timing headers and per-route
+# histograms at /api/metrics/. Off by default; the middleware unloads itself.
+REQUEST_METRICS = os.environ.get('REQUEST_METRICS', '').lower() in ('1', 'true', 'yes')
+
 # CORS Configuration
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_METHODS = [
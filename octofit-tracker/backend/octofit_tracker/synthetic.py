@@ -0,0 +1,98 @@
+"""
+Synthetic data generation for load testing.
+
+Rows are generated lazily and written with chunked bulk_create, so memory
+stays bounded by the chunk size no matter how many rows are requested.
+"""
+import random
+from datetime import timedelta
+from itertools import islice
+
+from django.utils import timezone
+
+from .models import Activity, Team, User
+from .recommendations import calories_per_minute
+
+ACTIVITY_TYPES = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Yoga', 'Boxing', 'HIIT']
+DISTANCE_TYPES = ['Running', 'Cycling', 'Swimming']
+
+
+def chunked(iterable, size):
+    """Yield lists of at most size items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class SyntheticDataGenerator:
+    """
+    Reproducible generator of teams, users and activities. The same seed
+    always produces the same rows.
+    """
+
+    def __init__(self, seed=None, days=30, activities_per_user=(5, 10), chunk_size=5000):
+        self.random = random.Random(seed)
+        self.days = days
+        self.activities_per_user = activities_per_user
+        self.chunk_size = chunk_size
+        self.now = timezone.now()
+
+    def activity_fields(self, user_id):
+        """Field values for one random activity"""
+        activity_type = self.random.choice(ACTIVITY_TYPES)
+        duration = self.random.randint(20, 120)  # 20-120 minutes
+        return {
+            'user_id': user_id,
+            'activity_type': activity_type,
+            'duration': duration,
+            'distance': round(self.random.uniform(1.0, 20.0), 2) if activity_type in DISTANCE_TYPES else None,
+            'calories': round(duration * calories_per_minute(activity_type) * self.random.uniform(0.8, 1.2)),
+            'date': self.now - timedelta(seconds=self.random.randint(0, self.days * 86400)),
+        }
+
+    def create_teams(self, count, offset=0):
+        """Create count teams and return their ids"""
+        teams = Team.objects.bulk_create(
+            [Team(name=f'Team {offset + i}', description='Synthetic load-test team') for i in range(1, count + 1)],
+            batch_size=self.chunk_size,
+        )
+        return _ids(Team, teams, 'name', [team.name for team in teams])
+
+    def iter_user_chunks(self, count, team_ids, offset=0):
+        """Create count users spread over team_ids, yielding each chunk's ids as it is written"""
+        numbers = range(offset + 1, offset + count + 1)
+        for chunk in chunked(numbers, self.chunk_size):
+            users = User.objects.bulk_create([
+                User(
+                    name=f'Athlete {number}',
+                    email=f'athlete{number}@octofit.example',
+                    team_id=self.random.choice(team_ids) if team_ids else None,
+                )
+                for number in chunk
+            ])
+            yield _ids(User, users, 'email', [user.email for user in users])
+
+    def iter_activities(self, user_ids):
+        low, high = self.activities_per_user
+        for user_id in user_ids:
+            for _ in range(self.random.randint(low, high)):
+                yield Activity(**self.activity_fields(user_id))
+
+    def create_activities(self, user_ids):
+        """Create activities for user_ids in chunks and return how many were written"""
+        created = 0
+        for chunk in chunked(self.iter_activities(user_ids), self.chunk_size):
+            Activity.objects.bulk_create(chunk)
+            created += len(chunk)
+        return created
+
+
+def _ids(model, objects, key_field, keys):
+    """Primary keys of freshly bulk-created objects, looked up by key_field on backends that do not return them"""
+    if all(obj.pk is not None for obj in objects):
+        return [obj.pk for obj in objects]
+    return list(model.objects.filter(**{f'{key_field}__in': keys}).values_list('id', flat=True))
+
@@ -0,0 +1,159 @@
+"""
+Team leaderboard.
+
+Team totals are the sums of the members' Leaderboard totals. They are either
+aggregated live, grouping leaderboard entries by their user's team, or, with
+TEAM_STATS_SNAPSHOT enabled, read from the TeamStats snapshot that is kept up
+to date incrementally so reads stay O(teams).
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from . import caching
+from .models import Leaderboard, Team, TeamStats, User
+
+TOTAL_FIELDS = ['total_calories', 'total_activities', 'total_duration']
+BATCH_SIZE = 1000
+
+
+def snapshot_enabled():
+    return settings.TEAM_STATS_SNAPSHOT
+
+
+def aggregate_team_totals():
+    """
+    Per-team member count and totals: one grouped count of users per team
+    merged with the members' leaderboard totals summed per team
+    """
+    members = User.objects.filter(team_id__isnull=False).order_by().values('team_id').annotate(member_count=Count('id'))
+    totals = leaderboard_totals_by_team()
+    return [
+        {
+            'team_id': row['team_id'],
+            'member_count': row['member_count'],
+            **totals.get(row['team_id'], dict.fromkeys(TOTAL_FIELDS, 0)),
+        }
+        for row in members
+    ]
+
+
+def leaderboard_totals_by_team():
+    """Leaderboard totals summed per team of the entry's user, by team id"""
+    if connection.vendor == 'djongo':
+        # djongo cannot translate correlated subqueries, so merge two flat reads
+        teams = dict(User.objects.filter(team_id__isnull=False).order_by().values_list('id', 'team_id'))
+        totals = defaultdict(lambda: dict.fromkeys(TOTAL_FIELDS, 0))
+        entries = Leaderboard.objects.order_by().values_list('user_id', *TOTAL_FIELDS).iterator(chunk_size=BATCH_SIZE)
+        for user_id, *values in entries:
+            if user_id in teams:
+                team_totals = totals[teams[user_id]]
+                for field, value in zip(TOTAL_FIELDS, values):
+                    team_totals[field] += value
+        return dict(totals)
+    # One grouped query over the entries, each annotated with its user's team
+    team = User.objects.filter(pk=OuterRef('user_id')).order_by().values('team_id')[:1]
+    rows = (
+        Leaderboard.objects.order_by()
+        .annotate(team_id=Subquery(team, output_field=IntegerField()))
+        .values('team_id')
+        .annotate(**{f'sum_{field}': Sum(field) for field in TOTAL_FIELDS})
+    )
+    return {
+        row['team_id']: {field: row[f'sum_{field}'] or 0 for field in TOTAL_FIELDS}
+        for row in rows if row['team_id'] is not None
+    }
+
+
+def team_leaderboard():
+    """Teams ranked by total calories, with names attached"""
+    if snapshot_enabled():
+        rows = TeamStats.objects.values('team_id', 'member_count', *TOTAL_FIELDS)
+    else:
+        rows = aggregate_team_totals()
+    rows = sorted(rows, key=lambda row: (-row['total_calories'], row['team_id']))
+    names = dict(Team.objects.filter(id__in=[row['team_id'] for row in rows]).values_list('id', 'name'))
+    for rank, row in enumerate(rows, start=1):
+        row['rank'] = rank
+        row['name'] = names.get(row['team_id'], '')
+    return rows
+
+
+def refresh_team_stats():
+    """Rebuild the TeamStats snapshot from the live aggregation"""
+    totals = {row.pop('team_id'): row for row in aggregate_team_totals()}
+    fields = ['member_count'] + TOTAL_FIELDS
+    with transaction.atomic():
+        changed = []
+        stale_ids = []
+        for stats in TeamStats.objects.all():
+            expected = totals.pop(stats.team_id, None)
+            if expected is None:
+                stale_ids.append(stats.id)
+            elif any(getattr(stats, field) != expected[field] for field in fields):
+                for field in fields:
+                    setattr(stats, field, expected[field])
+                stats.updated_at = timezone.now()
+                changed.append(stats)
+        TeamStats.objects.filter(id__in=stale_ids).delete()
+        TeamStats.objects.bulk_update(changed, fields + ['updated_at'], batch_size=BATCH_SIZE)
+        TeamStats.objects.bulk_create(
+            [TeamStats(team_id=team_id, **row) for team_id, row in totals.items()],
+            batch_size=BATCH_SIZE,
+        )
+    caching.invalidate_leaderboard()
+
+
+def apply_team_delta(team_id, members=0, calories=0, activities=0, duration=0):
+    """Add a delta to a team's snapshot row in one atomic increment"""
+    updated = TeamStats.objects.filter(team_id=team_id).update(
+        member_count=F('member_count') + members,
+        total_calories=F('total_calories') + calories,
+        total_activities=F('total_activities') + activities,
+        total_duration=F('total_duration') + duration,
+        updated_at=timezone.now(),
+    )
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            TeamStats.objects.create(
+                team_id=team_id,
+                member_count=members,
+                total_calories=calories,
+                total_activities=activities,
+                total_duration=duration,
+            )
+    except IntegrityError:
+        apply_team_delta(team_id, members, calories, activities, duration)
+
+
+def record_user_deltas(deltas):
+    """Fold per-user (calories, activities, duration) deltas into their teams"""
+    if not snapshot_enabled() or not deltas:
+        return
+    team_ids = dict(User.objects.filter(id__in=list(deltas), team_id__isnull=False).values_list('id', 'team_id'))
+    team_deltas = defaultdict(lambda: [0, 0, 0])
+    for user_id, delta in deltas.items():
+        if user_id in team_ids:
+            team_delta = team_deltas[team_ids[user_id]]
+            for position, value in enumerate(delta):
+                team_delta[position] += value
+    for team_id, delta in team_deltas.items():
+        apply_team_delta(team_id, 0, *delta)
+
+
+def record_membership_change(user_id, old_team_id, new_team_id):
+    """Move a user, with their leaderboard totals, from one team to another"""
+    if old_team_id == new_team_id:
+        return
+    if snapshot_enabled():
+        entry = Leaderboard.objects.filter(user_id=user_id).values_list(*TOTAL_FIELDS).first() or (0, 0, 0)
+        if old_team_id is not None:
+            apply_team_delta(old_team_id, -1, *(-value for value in entry))
+        if new_team_id is not None:
+            apply_team_delta(new_team_id, 1, *entry)
+    caching.invalidate_leaderboard()
@@ -1,8 +1,32 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.migrations.loader import MigrationLoader
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import User, Team, Activity, Leaderboard, Workout
+from . import (
+    benchmarking, caching, columnar, compression, jobs, leaderboard, metrics, recommendations, rollups, routers,
+    team_stats, upserts,
+)
+from .models import User, Team, Activity, ActivityRollup, DerivedState, Job, Leaderboard, TeamStats, Workout
+from .mongo.operations import AddPartialUniqueConstraint
+from .mongo.pool import PoolStats
+from .query_plans import explain, hot_queries
+from .renderers import StreamingRenderer, msgpack
+from .serializers import TeamSerializer, UserSerializer
 
 
 class UserModelTest(TestCase):
@@ -153,3 +177,1570 @@ class ActivityAPITest(APITestCase):
         }
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class LeaderboardMaintenanceTest(APITestCase):
+    """Test incremental leaderboard maintenance on activity writes"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+    
+    def create_activity(self, user_id=1, calories=300, duration=30):
+        data = {
+            'user_id': user_id,
+            'activity_type': 'Running',
+            'duration': duration,
+            'calories': calories,
+            'date': timezone.now().isoformat()
+        }
+        response = self.client.post('/api/activities/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+    
+    def test_create_update_delete_apply_deltas(self):
+        """Test that activity writes keep leaderboard totals in step"""
+        first = self.create_activity(calories=300, duration=30)
+        self.create_activity(calories=200, duration=20)
+        entry = Leaderboard.objects.get(user_id=1)
+        self.assertEqual(entry.total_calories, 500)
+        self.assertEqual(entry.total_activities, 2)
+        self.assertEqual(entry.total_duration, 50)
+        
+        response = self.client.patch(f"/api/activities/{first['id']}/", {'calories': 400}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Leaderboard.objects.get(user_id=1).total_calories, 600)
+        
+        response = self.client.patch(f"/api/activities/{first['id']}/", {'user_id': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Leaderboard.objects.get(user_id=1).total_activities, 1)
+        self.assertEqual(Leaderboard.objects.get(user_id=2).total_calories, 400)
+        
+        response = self.client.delete(f"/api/activities/{first['id']}/")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        entry = Leaderboard.objects.get(user_id=2)
+        self.assertEqual((entry.total_calories, entry.total_activities, entry.total_duration), (0, 0, 0))
+    
+    def test_ranks_recomputed_lazily_on_read(self):
+        """Test that ranks are only reassigned when the leaderboard is read"""
+        self.create_activity(user_id=1, calories=100)
+        self.create_activity(user_id=2, calories=500)
+        self.assertEqual(set(Leaderboard.objects.values_list('rank', flat=True)), {0})
+        
+        response = self.client.get('/api/leaderboard/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ranks = dict(Leaderboard.objects.values_list('user_id', 'rank'))
+        self.assertEqual(ranks, {2: 1, 1: 2})
+    
+    def test_stale_ranks_seen_by_other_processes(self):
+        """Test that the stale flag does not depend on the writing process's local cache"""
+        self.create_activity(user_id=1, calories=100)
+        self.create_activity(user_id=2, calories=500)
+        # Another worker process shares the database but not this process's memory
+        cache.clear()
+        caching.reset_backend()
+        self.assertTrue(leaderboard.ranks_are_stale())
+        self.assertEqual(self.client.get('/api/leaderboard/').status_code, status.HTTP_200_OK)
+        self.assertEqual(dict(Leaderboard.objects.values_list('user_id', 'rank')), {2: 1, 1: 2})
+        self.assertFalse(leaderboard.ranks_are_stale())
+    
+    def test_reconcile_repairs_drift(self):
+        """Test that reconcile_leaderboard rebuilds totals from activities"""
+        self.create_activity(user_id=1, calories=300, duration=30)
+        Leaderboard.objects.filter(user_id=1).update(total_calories=1, total_activities=9)
+        Activity.objects.create(
+            user_id=3, activity_type='Yoga', duration=60, calories=150, date=timezone.now()
+        )
+        call_command('reconcile_leaderboard', stdout=StringIO())
+        entries = {e.user_id: e for e in Leaderboard.objects.all()}
+        self.assertEqual(entries[1].total_calories, 300)
+        self.assertEqual(entries[1].total_activities, 1)
+        self.assertEqual(entries[3].total_duration, 60)
+        self.assertEqual(entries[1].rank, 1)
+        self.assertEqual(entries[3].rank, 2)
+
+
+class ActivityBulkAPITest(APITestCase):
+    """Test bulk activity ingestion"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+        self.date = timezone.now().isoformat()
+    
+    def activity(self, user_id=1, calories=300):
+        return {
+            'user_id': user_id,
+            'activity_type': 'Cycling',
+            'duration': 45,
+            'calories': calories,
+            'date': self.date
+        }
+    
+    def test_bulk_create_json_array(self):
+        """Test creating a JSON array of activities in one request"""
+        data = [self.activity(1), self.activity(2), self.activity(1, calories=100)]
+        response = self.client.post('/api/activities/bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(response.data['errors'], [])
+        self.assertEqual(Activity.objects.count(), 3)
+        self.assertEqual(Leaderboard.objects.get(user_id=1).total_calories, 400)
+    
+    def test_bulk_create_reports_per_item_errors(self):
+        """Test that invalid items are rejected without failing the batch"""
+        invalid = self.activity()
+        del invalid['calories']
+        data = [self.activity(), invalid, self.activity(2)]
+        response = self.client.post('/api/activities/bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(len(response.data['errors']), 1)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertIn('calories', response.data['errors'][0]['errors'])
+        self.assertEqual(Activity.objects.count(), 2)
+    
+    def test_bulk_create_ndjson(self):
+        """Test creating activities from an NDJSON stream"""
+        body = '\n'.join(json.dumps(self.activity(user_id)) for user_id in (1, 2, 3)) + '\n'
+        response = self.client.post('/api/activities/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Activity.objects.count(), 3)
+    
+    def test_bulk_create_marks_ranks_stale_once(self):
+        """Test that a batch across many users touches the rank state once, not once per user"""
+        data = [self.activity(user_id) for user_id in range(1, 21)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/activities/bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        state_queries = [query for query in queries.captured_queries if 'derived_state' in query['sql']]
+        self.assertLessEqual(len(state_queries), 3)
+    
+    @override_settings(ACTIVITY_BULK_MAX_ITEMS=2)
+    def test_oversized_ndjson_stops_parsing(self):
+        """Test that an NDJSON batch over the cap is rejected before the rest is parsed"""
+        body = '\n'.join(json.dumps(self.activity(user_id)) for user_id in (1, 2, 3)) + '\nnot json\n'
+        response = self.client.post('/api/activities/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('at most 2 activities', str(response.data))
+        self.assertEqual(Activity.objects.count(), 0)
+    
+    def test_bulk_create_rejects_non_list(self):
+        """Test that a single object is not accepted as a batch"""
+        response = self.client.post('/api/activities/bulk/', self.activity(), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Activity.objects.count(), 0)
+
+
+class PaginationAPITest(APITestCase):
+    """Test keyset pagination of list endpoints"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+    
+    def collect_pages(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.data['results'])
+            url = response.data['next']
+        return pages
+    
+    def test_activities_paginated_by_date_then_id(self):
+        """Test that activities are paged in (date, id) order"""
+        now = timezone.now()
+        for days_ago in (3, 1, 2, 1, 0):
+            Activity.objects.create(
+                user_id=1, activity_type='Running', duration=30, calories=300,
+                date=now - timedelta(days=days_ago)
+            )
+        pages = self.collect_pages('/api/activities/?page_size=2')
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        rows = [row for page in pages for row in page]
+        expected = list(Activity.objects.order_by('date', 'id').values_list('id', flat=True))
+        self.assertEqual([row['id'] for row in rows], expected)
+    
+    def test_leaderboard_paginated_by_rank(self):
+        """Test that leaderboard entries are paged in rank order"""
+        for user_id, rank in ((1, 3), (2, 1), (3, 2)):
+            Leaderboard.objects.create(user_id=user_id, rank=rank)
+        pages = self.collect_pages('/api/leaderboard/?page_size=2')
+        ranks = [row['rank'] for page in pages for row in page]
+        self.assertEqual(ranks, [1, 2, 3])
+    
+    def test_page_size_is_capped(self):
+        """Test that clients cannot request pages above the maximum size"""
+        Team.objects.create(name='Team')
+        response = self.client.get('/api/teams/?page_size=1000000')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class QueryPlanTest(TestCase):
+    """Test that the hot API queries are backed by indexes"""
+    
+    def test_hot_queries_use_indexes(self):
+        """Test that no hot query falls back to a full scan"""
+        for hot_query in hot_queries():
+            plan = explain(hot_query)
+            self.assertFalse(plan.full_scan, f'{plan.name} does a full scan: {plan.plan}')
+            self.assertTrue(plan.indexes, f'{plan.name} uses no index: {plan.plan}')
+    
+    def test_explain_queries_command(self):
+        """Test that explain_queries reports an index for each hot query"""
+        out = StringIO()
+        call_command('explain_queries', '--fail-on-scan', stdout=out)
+        self.assertIn('activity_user_date_idx', out.getvalue())
+
+
+class ActivityFilterAPITest(APITestCase):
+    """Test server-side filtering of the activities list"""
+    
+    def setUp(self):
+        self.now = timezone.now()
+        team = Team.objects.create(name='Filter Team')
+        self.member = User.objects.create(name='Member', email='member@example.com', team_id=team.id)
+        self.team_id = team.id
+        rows = [
+            (self.member.id, 'Running', 1),
+            (self.member.id, 'Yoga', 3),
+            (self.member.id, 'Running', 10),
+            (self.member.id + 100, 'Running', 1),
+        ]
+        for user_id, activity_type, days_ago in rows:
+            Activity.objects.create(
+                user_id=user_id, activity_type=activity_type, duration=30, calories=300,
+                date=self.now - timedelta(days=days_ago)
+            )
+    
+    def list_activities(self, params):
+        response = self.client.get('/api/activities/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results']
+    
+    def test_filter_by_user_and_type(self):
+        """Test filtering by user_id and activity_type"""
+        rows = self.list_activities({'user_id': self.member.id, 'activity_type': 'Running'})
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(all(row['activity_type'] == 'Running' for row in rows))
+    
+    def test_filter_by_date_window(self):
+        """Test filtering by a half-open date window"""
+        week_ago = (self.now - timedelta(days=7)).isoformat()
+        rows = self.list_activities({'user_id': self.member.id, 'date__gte': week_ago, 'date__lt': self.now.isoformat()})
+        self.assertEqual(len(rows), 2)
+    
+    def test_filter_by_team(self):
+        """Test that team_id resolves to the team's members"""
+        rows = self.list_activities({'team_id': self.team_id})
+        self.assertEqual({row['user_id'] for row in rows}, {self.member.id})
+        self.assertEqual(len(rows), 3)
+    
+    def test_invalid_filter_values(self):
+        """Test that malformed filter values are rejected"""
+        response = self.client.get('/api/activities/', {'date__gte': 'last tuesday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/activities/', {'user_id': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class LeaderboardCacheAPITest(APITestCase):
+    """Test the cached, ETag-aware leaderboard list"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+        Leaderboard.objects.create(user_id=1, total_calories=500, rank=1)
+    
+    def test_etag_and_not_modified(self):
+        """Test that a matching If-None-Match gets 304 Not Modified"""
+        response = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        
+        response = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+    
+    def test_cached_response_is_identical(self):
+        """Test that a cache hit returns the same bytes without querying"""
+        first = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+    
+    def test_activity_write_invalidates_cache(self):
+        """Test that new activities change the cached leaderboard"""
+        etag = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json')['ETag']
+        data = {
+            'user_id': 1,
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories': 300,
+            'date': timezone.now().isoformat()
+        }
+        self.client.post('/api/activities/', data, format='json')
+        response = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['total_calories'], 800)
+    
+    @override_settings(LEADERBOARD_CACHE_BACKEND='octofit_tracker.caching.DjangoCacheBackend')
+    def test_django_cache_backend(self):
+        """Test the shared backend through the Django cache framework"""
+        caching.reset_backend()
+        self.assertIsInstance(caching.get_backend(), caching.DjangoCacheBackend)
+        version = caching.leaderboard_version()
+        caching.invalidate_leaderboard()
+        self.assertEqual(caching.leaderboard_version(), version + 1)
+        etag = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json')['ETag']
+        response = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        caching.reset_backend()
+
+
+class TeamLeaderboardAPITest(APITestCase):
+    """Test the team leaderboard endpoint"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+        self.red = Team.objects.create(name='Red')
+        self.blue = Team.objects.create(name='Blue')
+        self.users = [
+            User.objects.create(name=f'User {i}', email=f'user{i}@example.com', team_id=team.id)
+            for i, team in enumerate([self.red, self.red, self.blue])
+        ]
+    
+    def log_activity(self, user, calories, duration=30):
+        data = {
+            'user_id': user.id,
+            'activity_type': 'Running',
+            'duration': duration,
+            'calories': calories,
+            'date': timezone.now().isoformat()
+        }
+        response = self.client.post('/api/activities/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    
+    def get_team_leaderboard(self):
+        response = self.client.get('/api/teams/leaderboard/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {row['name']: row for row in response.json()}
+    
+    def test_live_team_totals(self):
+        """Test that team totals are aggregated from members' entries"""
+        self.log_activity(self.users[0], 300)
+        self.log_activity(self.users[1], 200, duration=20)
+        self.log_activity(self.users[2], 400)
+        rows = self.get_team_leaderboard()
+        self.assertEqual(rows['Red']['total_calories'], 500)
+        self.assertEqual(rows['Red']['total_duration'], 50)
+        self.assertEqual(rows['Red']['member_count'], 2)
+        self.assertEqual(rows['Red']['rank'], 1)
+        self.assertEqual(rows['Blue']['total_activities'], 1)
+        self.assertEqual(rows['Blue']['rank'], 2)
+        # One grouped query for member counts and one for the totals
+        with self.assertNumQueries(2):
+            team_stats.aggregate_team_totals()
+    
+    @override_settings(TEAM_STATS_SNAPSHOT=True)
+    def test_snapshot_tracks_live_totals(self):
+        """Test that the incrementally maintained snapshot matches the live aggregation"""
+        team_stats.refresh_team_stats()
+        self.log_activity(self.users[0], 300)
+        self.log_activity(self.users[2], 400)
+        response = self.client.patch(f'/api/users/{self.users[0].id}/', {'team_id': self.blue.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.post('/api/users/', {'name': 'New', 'email': 'new@example.com', 'team_id': self.red.id}, format='json')
+        
+        live = {row['team_id']: row for row in team_stats.aggregate_team_totals()}
+        snapshot = {row['team_id']: row for row in TeamStats.objects.values('team_id', 'member_count', *team_stats.TOTAL_FIELDS)}
+        self.assertEqual(snapshot, live)
+        rows = self.get_team_leaderboard()
+        self.assertEqual(rows['Blue']['total_calories'], 700)
+        self.assertEqual(rows['Blue']['member_count'], 2)
+        self.assertEqual(rows['Red']['member_count'], 2)
+
+
+class ActivityRollupTest(APITestCase):
+    """Test the daily and weekly activity rollups"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+        self.user = User.objects.create(name='Roller', email='roller@example.com')
+        # A Sunday and the following Monday fall in different ISO weeks
+        self.sunday = timezone.make_aware(datetime(2026, 3, 1, 12))
+        self.monday = self.sunday + timedelta(days=1)
+    
+    def log_activity(self, date, activity_type='Running', calories=300, duration=30, distance=5.0):
+        data = {
+            'user_id': self.user.id,
+            'activity_type': activity_type,
+            'duration': duration,
+            'distance': distance,
+            'calories': calories,
+            'date': date.isoformat()
+        }
+        response = self.client.post('/api/activities/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+    
+    def rollup_rows(self):
+        return sorted(ActivityRollup.objects.values_list(
+            'user_id', 'period', 'bucket_start', 'activity_type', *rollups.TOTAL_FIELDS
+        ))
+    
+    def test_incremental_rollups_match_rebuild(self):
+        """Test that write-time deltas agree with a full rebuild"""
+        first = self.log_activity(self.sunday)
+        self.log_activity(self.sunday, activity_type='Yoga', distance=None)
+        self.log_activity(self.monday, calories=100)
+        self.client.patch(f"/api/activities/{first['id']}/", {'date': self.monday.isoformat()}, format='json')
+        incremental = [row for row in self.rollup_rows() if row[4]]
+        
+        rollups.rebuild_rollups()
+        self.assertEqual(incremental, self.rollup_rows())
+    
+    def test_rebuild_flushes_in_batches(self):
+        """Test that a rebuild written in several batches keeps every bucket"""
+        other = User.objects.create(name='Second', email='second@example.com')
+        self.log_activity(self.sunday)
+        self.log_activity(self.monday, activity_type='Yoga', distance=None)
+        Activity.objects.create(user_id=other.id, activity_type='Running', duration=30, calories=200, date=self.monday)
+        rollups.rebuild_rollups()
+        expected = self.rollup_rows()
+        
+        with mock.patch.object(rollups, 'BATCH_SIZE', 2), \
+                mock.patch.object(rollups, '_create_buckets', wraps=rollups._create_buckets) as create:
+            self.assertEqual(rollups.rebuild_rollups(), len(expected))
+        self.assertEqual(create.call_count, 2)
+        self.assertEqual(self.rollup_rows(), expected)
+    
+    def test_weekly_stats_endpoint(self):
+        """Test per-week totals with a per-type breakdown"""
+        self.log_activity(self.sunday, calories=300)
+        self.log_activity(self.monday, calories=100)
+        self.log_activity(self.monday, activity_type='Yoga', calories=50, distance=None)
+        response = self.client.get(f'/api/users/{self.user.id}/stats/', {'granularity': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        buckets = response.data['buckets']
+        self.assertEqual([bucket['bucket_start'] for bucket in buckets], ['2026-02-23', '2026-03-02'])
+        self.assertEqual(buckets[1]['total_calories'], 150)
+        self.assertEqual(buckets[1]['activity_count'], 2)
+        self.assertEqual(buckets[1]['by_type']['Yoga']['total_calories'], 50)
+        
+        response = self.client.get(f'/api/users/{self.user.id}/stats/', {'granularity': 'day', 'start': '2026-03-02'})
+        self.assertEqual(len(response.data['buckets']), 1)
+    
+    def test_invalid_granularity(self):
+        """Test that unknown granularities are rejected"""
+        response = self.client.get(f'/api/users/{self.user.id}/stats/', {'granularity': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WindowedLeaderboardAPITest(APITestCase):
+    """Test the time-windowed leaderboards"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+        self.now = timezone.now()
+    
+    def log_activity(self, user_id, calories, days_ago):
+        data = {
+            'user_id': user_id,
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories': calories,
+            'date': (self.now - timedelta(days=days_ago)).isoformat()
+        }
+        response = self.client.post('/api/activities/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    
+    def get_window(self, window):
+        response = self.client.get('/api/leaderboard/', {'window': window}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(row['user_id'], row['total_calories'], row['rank']) for row in response.json()['results']]
+    
+    def test_rolling_windows(self):
+        """Test that late joiners can lead the short windows"""
+        self.log_activity(1, 1000, days_ago=20)
+        self.log_activity(1, 100, days_ago=1)
+        self.log_activity(2, 300, days_ago=2)
+        self.assertEqual(self.get_window('7d'), [(2, 300, 1), (1, 100, 2)])
+        self.assertEqual(self.get_window('30d'), [(1, 1100, 1), (2, 300, 2)])
+        
+        self.log_activity(1, 500, days_ago=0)
+        self.assertEqual(self.get_window('7d'), [(1, 600, 1), (2, 300, 2)])
+    
+    def test_unknown_window(self):
+        """Test that unknown windows are rejected"""
+        response = self.client.get('/api/leaderboard/', {'window': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_compaction_expires_old_daily_buckets(self):
+        """Test that compaction keeps recent daily and all weekly buckets"""
+        self.log_activity(1, 100, days_ago=100)
+        self.log_activity(1, 200, days_ago=1)
+        call_command('compact_rollups', '--retain-days', '40', stdout=StringIO())
+        days = ActivityRollup.objects.filter(period=ActivityRollup.DAY)
+        self.assertEqual(list(days.values_list('total_calories', flat=True)), [200])
+        self.assertEqual(ActivityRollup.objects.filter(period=ActivityRollup.WEEK).count(), 2)
+        self.assertEqual(self.get_window('7d'), [(1, 200, 1)])
+
+
+class LeaderboardAroundAPITest(APITestCase):
+    """Test rank lookups around a user"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+        # user 3 and user 4 are tied
+        for user_id, calories in ((1, 900), (2, 800), (3, 700), (4, 700), (5, 600), (6, 500)):
+            Leaderboard.objects.create(user_id=user_id, total_calories=calories)
+        leaderboard.recompute_ranks()
+    
+    def get_around(self, user_id, **params):
+        response = self.client.get(f'/api/leaderboard/around/{user_id}/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+    
+    def test_neighbours_with_competition_ranking(self):
+        """Test that tied users share a rank and the next rank is skipped"""
+        data = self.get_around(4, radius=2)
+        self.assertEqual(data['rank'], 3)
+        self.assertEqual(
+            [(row['user_id'], row['rank']) for row in data['entries']],
+            [(2, 2), (3, 3), (4, 3), (5, 5), (6, 6)]
+        )
+    
+    def test_neighbours_with_dense_ranking(self):
+        """Test that dense ranking does not skip ranks after a tie"""
+        data = self.get_around(5, radius=1, ranking='dense')
+        self.assertEqual(data['rank'], 4)
+        self.assertEqual([(row['user_id'], row['rank']) for row in data['entries']], [(4, 3), (5, 4), (6, 5)])
+    
+    def test_dense_ranks_are_stored(self):
+        """Test that dense lookups read the stored rank instead of counting totals"""
+        self.assertEqual(
+            list(Leaderboard.objects.order_by('rank').values_list('dense_rank', flat=True)), [1, 2, 3, 3, 4, 5]
+        )
+        with CaptureQueriesContext(connection) as queries:
+            ranked = leaderboard.entries_around(5, radius=1, ranking='dense')
+        self.assertEqual([rank for entry, rank in ranked], [3, 4, 5])
+        self.assertFalse(any('DISTINCT' in query['sql'] for query in queries.captured_queries))
+    
+    @override_settings(DERIVED_DATA_JOBS=True, JOB_STORE='octofit_tracker.jobs.DatabaseJobStore')
+    def test_window_while_ranks_are_stale(self):
+        """Test that entries not ranked yet do not all fall into the window"""
+        jobs.reset_store()
+        self.addCleanup(jobs.reset_store)
+        Leaderboard.objects.bulk_create([Leaderboard(user_id=user_id, total_calories=100) for user_id in range(10, 20)])
+        leaderboard.mark_ranks_stale()
+        data = self.get_around(12, radius=1)
+        self.assertEqual([row['user_id'] for row in data['entries']], [11, 12, 13])
+        self.assertEqual(Leaderboard.objects.get(user_id=12).rank, 0)
+    
+    def test_window_clipped_at_top(self):
+        """Test that the window stops at the first entry"""
+        data = self.get_around(1, radius=3)
+        self.assertEqual([row['user_id'] for row in data['entries']], [1, 2, 3, 4])
+        self.assertEqual(data['entries'][0]['rank'], 1)
+    
+    def test_unknown_user_and_bad_radius(self):
+        """Test missing entries and invalid parameters"""
+        self.assertEqual(self.client.get('/api/leaderboard/around/99/').status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get('/api/leaderboard/around/1/', {'radius': 'lots'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PopulateDbCommandTest(TestCase):
+    """Test the populate_db command"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+    
+    def test_superhero_roster(self):
+        """Test that the default run creates the superhero data set"""
+        call_command('populate_db', '--seed', '1', stdout=StringIO())
+        self.assertEqual(Team.objects.count(), 2)
+        self.assertEqual(User.objects.count(), 12)
+        self.assertEqual(Leaderboard.objects.count(), 12)
+        self.assertEqual(Workout.objects.count(), 10)
+    
+    def test_synthetic_data_is_reproducible(self):
+        """Test that the same seed generates the same synthetic data"""
+        options = ['--users', '30', '--teams', '3', '--activities-per-user', '2-4', '--days', '7', '--seed', '42', '--chunk-size', '7']
+        call_command('populate_db', *options, stdout=StringIO())
+        first = list(Activity.objects.order_by('id').values_list('activity_type', 'duration', 'calories'))
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Team.objects.count(), 3)
+        self.assertTrue(60 <= len(first) <= 120)
+        self.assertEqual(Leaderboard.objects.count(), 30)
+        self.assertEqual(sum(Leaderboard.objects.values_list('total_activities', flat=True)), len(first))
+        
+        call_command('populate_db', *options, stdout=StringIO())
+        second = list(Activity.objects.order_by('id').values_list('activity_type', 'duration', 'calories'))
+        self.assertEqual(first, second)
+    
+    def test_append_keeps_existing_data(self):
+        """Test that --append adds users without clearing"""
+        call_command('populate_db', '--users', '5', '--activities-per-user', '1', stdout=StringIO())
+        call_command('populate_db', '--users', '5', '--activities-per-user', '1', '--append', stdout=StringIO())
+        self.assertEqual(User.objects.count(), 10)
+        self.assertEqual(Activity.objects.count(), 10)
+
+
+class BenchmarkingTest(TestCase):
+    """Test cases for benchmark statistics and baseline comparison"""
+    
+    def test_summarize_percentiles(self):
+        """Test nearest-rank percentiles and throughput"""
+        stats = benchmarking.summarize([i / 1000 for i in range(1, 101)])
+        self.assertEqual(stats['iterations'], 100)
+        self.assertAlmostEqual(stats['p50_ms'], 50)
+        self.assertAlmostEqual(stats['p90_ms'], 90)
+        self.assertAlmostEqual(stats['p99_ms'], 99)
+        self.assertAlmostEqual(stats['max_ms'], 100)
+        self.assertAlmostEqual(stats['ops_per_sec'], 100 / 5.05)
+    
+    def test_find_regressions(self):
+        """Test that only slowdowns beyond the threshold are reported"""
+        baseline = {'users.list': {'p50_ms': 10.0, 'p90_ms': 20.0}, 'teams.list': {'p50_ms': 5.0, 'p90_ms': 5.0}}
+        results = {
+            'users.list': {'p50_ms': 11.0, 'p90_ms': 30.0},
+            'teams.list': {'p50_ms': 4.0, 'p90_ms': 5.5},
+            'workouts.list': {'p50_ms': 100.0, 'p90_ms': 100.0},
+        }
+        self.assertEqual(
+            benchmarking.find_regressions(results, baseline, 0.2),
+            [('users.list', 'p90_ms', 20.0, 30.0)],
+        )
+
+
+@override_settings(REQUEST_METRICS=True)
+class RequestMetricsTest(APITestCase):
+    """Test cases for per-request query count and timing instrumentation"""
+    
+    def setUp(self):
+        metrics.registry.reset()
+        for i in range(3):
+            Activity.objects.create(
+                user_id=1, activity_type='Running', duration=30, calories=300, date=timezone.now()
+            )
+    
+    def test_server_timing_header(self):
+        """Test that responses carry database, serializer and total timings"""
+        response = self.client.get('/api/activities/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('serializer;dur=', timing)
+        self.assertIn('total;dur=', timing)
+        self.assertNotIn('desc="0 queries"', timing)
+    
+    def test_metrics_endpoint_histograms(self):
+        """Test that requests are aggregated per route"""
+        self.client.get('/api/activities/')
+        self.client.get('/api/activities/')
+        response = self.client.get('/api/metrics/')
+        self.assertTrue(response.data['enabled'])
+        route = response.data['routes']['GET activity-list']
+        self.assertEqual(route['total_ms']['count'], 2)
+        self.assertEqual(route['total_ms']['buckets'][-1], {'le': '+Inf', 'count': 2})
+        self.assertGreater(route['db_queries']['sum'], 0)
+        self.assertGreater(route['serializer_ms']['sum'], 0)
+    
+    @override_settings(REQUEST_METRICS=False)
+    def test_disabled(self):
+        """Test that nothing is recorded when metrics are disabled"""
+        response = self.client.get('/api/activities/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(metrics.registry.snapshot(), {})
+
+
+class ActivityExportAPITest(APITestCase):
+    """Test cases for the streaming activity export"""
+    
+    def setUp(self):
+        now = timezone.now()
+        for i, (user_id, activity_type, distance) in enumerate([(1, 'Running', 5.5), (1, 'Yoga', None), (2, 'Cycling', 20.0)]):
+            Activity.objects.create(
+                user_id=user_id, activity_type=activity_type, duration=30, distance=distance,
+                calories=300 + i, date=now - timedelta(days=3 - i)
+            )
+        self.listed = self.client.get('/api/activities/').data['results']
+    
+    def export(self, params):
+        response = self.client.get('/api/activities/export/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+    
+    def test_ndjson_matches_list(self):
+        """Test that NDJSON rows match the list endpoint's representation"""
+        response, body = self.export({'format': 'ndjson'})
+        self.assertTrue(response['Content-Type'].startswith('application/x-ndjson'))
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(rows, json.loads(json.dumps(self.listed)))
+    
+    def test_csv_export(self):
+        """Test CSV output with a header row and empty nulls"""
+        response, body = self.export({'format': 'csv'})
+        self.assertIn('activities.csv', response['Content-Disposition'])
+        rows = list(csv.DictReader(body.splitlines()))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['date'], self.listed[0]['date'])
+        self.assertEqual(rows[1]['distance'], '')
+    
+    def test_export_filters(self):
+        """Test that the list filters apply to exports"""
+        _, body = self.export({'format': 'ndjson', 'user_id': 1, 'activity_type': 'Yoga'})
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row['activity_type'] for row in rows], ['Yoga'])
+    
+    def test_invalid_filter(self):
+        """Test that invalid filters are rejected before streaming"""
+        response = self.client.get('/api/activities/export/', {'format': 'csv', 'user_id': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(b'user_id', response.content)
+    
+    def test_streaming_renderer_requires_stream(self):
+        """Test that a streaming renderer without stream() cannot be instantiated"""
+        class IncompleteRenderer(StreamingRenderer):
+            media_type = 'text/plain'
+        
+        with self.assertRaises(TypeError):
+            IncompleteRenderer()
+
+
+class FastListSerializationTest(APITestCase):
+    """Test cases for the compiled list serialization path"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+        team = Team.objects.create(name='Fast Team', description='Quick')
+        now = timezone.now()
+        for i in range(5):
+            user = User.objects.create(name=f'Fast {i}', email=f'fast{i}@example.com', team_id=team.id if i % 2 else None)
+            Activity.objects.create(
+                user_id=user.id, activity_type='Running', duration=30 + i,
+                distance=5.25 if i % 2 else None, calories=300 + i,
+                date=now - timedelta(days=i, microseconds=i),
+            )
+            Leaderboard.objects.create(user_id=user.id, total_calories=300 + i, total_activities=1, total_duration=30 + i)
+        Workout.objects.create(
+            name='Sprint', description='Short sprints', activity_type='Running',
+            difficulty='Advanced', estimated_duration=20, estimated_calories=250,
+        )
+    
+    def test_output_identical_to_serializers(self):
+        """Test that every list endpoint renders the same bytes on both paths"""
+        for url in ['/api/users/', '/api/teams/', '/api/activities/', '/api/leaderboard/', '/api/workouts/']:
+            for params in [{}, {'page_size': 2}]:
+                with override_settings(API_FAST_LIST_SERIALIZATION=False):
+                    caching.get_backend().clear()
+                    classic = self.client.get(url, params)
+                with override_settings(API_FAST_LIST_SERIALIZATION=True):
+                    caching.get_backend().clear()
+                    fast = self.client.get(url, params)
+                self.assertEqual(fast.status_code, status.HTTP_200_OK)
+                self.assertEqual(fast.content, classic.content, url)
+    
+    def test_pagination_follows_cursor(self):
+        """Test that cursors produced by the fast path page through every row"""
+        seen = []
+        url = '/api/activities/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(sorted(seen), sorted(Activity.objects.values_list('id', flat=True)))
+    
+    def test_classic_query_param(self):
+        """Test that ?serializer=classic returns the same rows"""
+        fast = self.client.get('/api/users/')
+        classic = self.client.get('/api/users/', {'serializer': 'classic'})
+        self.assertEqual(json.loads(fast.content)['results'], json.loads(classic.content)['results'])
+
+
+class AsyncReadAPITest(TestCase):
+    """Test cases for the async read endpoints"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+        now = timezone.now()
+        for user_id, calories in [(1, 500), (2, 900), (3, 500), (4, 100)]:
+            Leaderboard.objects.create(user_id=user_id, total_calories=calories, total_activities=1, total_duration=30)
+        self.activities = [
+            Activity.objects.create(
+                user_id=1, activity_type='Running' if i % 2 else 'Yoga', duration=30,
+                calories=100 + i, date=now - timedelta(hours=i)
+            )
+            for i in range(5)
+        ]
+        leaderboard.recompute_ranks()
+    
+    async def test_leaderboard_pages(self):
+        """Test rank-ordered pages linked through after_rank"""
+        response = await self.async_client.get('/api/async/leaderboard/', {'page_size': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content)
+        self.assertEqual([row['user_id'] for row in data['results']], [2, 1, 3])
+        response = await self.async_client.get(data['next'])
+        data = json.loads(response.content)
+        self.assertEqual([row['user_id'] for row in data['results']], [4])
+        self.assertIsNone(data['next'])
+    
+    async def test_pages_through_stale_ranks(self):
+        """Test that entries sharing a rank, as new entries do before a recompute, are not skipped"""
+        new_entries = [Leaderboard(user_id=user_id, total_calories=50) for user_id in range(10, 15)]
+        await Leaderboard.objects.abulk_create(new_entries)
+        seen = []
+        data = {'next': '/api/async/leaderboard/?page_size=2'}
+        while data['next']:
+            data = json.loads((await self.async_client.get(data['next'])).content)
+            seen.extend(row['user_id'] for row in data['results'])
+        self.assertEqual(seen, [10, 11, 12, 13, 14, 2, 1, 3, 4])
+    
+    async def test_rank_lookup(self):
+        """Test competition and dense ranks of a tied user"""
+        response = await self.async_client.get('/api/async/leaderboard/rank/3/')
+        self.assertEqual(json.loads(response.content)['rank'], 2)
+        response = await self.async_client.get('/api/async/leaderboard/rank/4/', {'ranking': 'dense'})
+        self.assertEqual(json.loads(response.content)['rank'], 3)
+        response = await self.async_client.get('/api/async/leaderboard/rank/99/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    async def test_user_activities(self):
+        """Test newest-first activity pages, filters and items matching the DRF API"""
+        response = await self.async_client.get('/api/async/users/1/activities/', {'page_size': 2})
+        data = json.loads(response.content)
+        self.assertEqual([row['id'] for row in data['results']], [self.activities[0].id, self.activities[1].id])
+        seen = [row['id'] for row in data['results']]
+        while data['next']:
+            data = json.loads((await self.async_client.get(data['next'])).content)
+            seen.extend(row['id'] for row in data['results'])
+        self.assertEqual(seen, [activity.id for activity in self.activities])
+        
+        response = await self.async_client.get('/api/async/users/1/activities/', {'activity_type': 'Yoga'})
+        self.assertEqual(len(json.loads(response.content)['results']), 3)
+        response = await self.async_client.get('/api/async/users/1/activities/', {'date__gte': 'not-a-date'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_items_match_drf(self):
+        """Test that async items render exactly like the DRF list items"""
+        async_rows = json.loads(self.client.get('/api/async/users/1/activities/').content)['results']
+        drf_rows = json.loads(self.client.get('/api/activities/', {'user_id': 1}).content)['results']
+        self.assertEqual(async_rows, list(reversed(drf_rows)))
+        self.assertEqual(self.client.post('/api/async/leaderboard/').status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+    
+    @override_settings(ROOT_URLCONF='octofit_tracker.management.commands.benchmark_concurrency')
+    async def test_sync_twins_match(self):
+        """Test that the benchmark's sync twins answer exactly like the async views"""
+        for url in ['leaderboard/?page_size=3', 'leaderboard/rank/4/?ranking=dense', 'users/1/activities/?page_size=2']:
+            sync_response = await sync_to_async(self.client.get)('/sync/' + url)
+            async_response = await self.async_client.get('/async/' + url)
+            self.assertEqual(sync_response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                json.loads(sync_response.content.replace(b'/sync/', b'/async/')), json.loads(async_response.content)
+            )
+
+
+def failing_job():
+    raise RuntimeError('boom')
+
+
+class JobQueueTest(APITestCase):
+    """Test cases for background derived-data jobs"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+        jobs.reset_store()
+        self.addCleanup(jobs.reset_store)
+    
+    def create_activity(self, user_id, calories):
+        response = self.client.post('/api/activities/', {
+            'user_id': user_id, 'activity_type': 'Running', 'duration': 30,
+            'calories': calories, 'date': timezone.now().isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    
+    @override_settings(JOB_STORE='octofit_tracker.jobs.DatabaseJobStore')
+    def test_enqueue_coalesces(self):
+        """Test that queueing a pending job again is a no-op"""
+        self.assertTrue(jobs.enqueue('recompute_ranks'))
+        self.assertFalse(jobs.enqueue('recompute_ranks'))
+        self.assertTrue(jobs.enqueue('refresh_team_stats'))
+        self.assertEqual(Job.objects.filter(status=Job.PENDING).count(), 2)
+        with self.assertRaises(ValueError):
+            jobs.enqueue('unknown')
+    
+    @override_settings(DERIVED_DATA_JOBS=True, JOB_STORE='octofit_tracker.jobs.DatabaseJobStore')
+    def test_worker_recomputes_ranks(self):
+        """Test that reads leave ranks to the worker and report them as stale"""
+        self.create_activity(1, 100)
+        self.create_activity(2, 300)
+        self.assertEqual(self.client.get('/api/leaderboard/').status_code, status.HTTP_200_OK)
+        self.assertEqual(set(Leaderboard.objects.values_list('rank', flat=True)), {0})
+        
+        data = self.client.get('/api/status/').data
+        self.assertTrue(data['leaderboard_ranks']['stale'])
+        self.assertEqual([(job['name'], job['status']) for job in data['jobs']], [('recompute_ranks', Job.PENDING)])
+        
+        # The worker and the web process share only the database
+        cache.clear()
+        call_command('run_jobs', '--once', stdout=StringIO())
+        cache.clear()
+        self.assertEqual(Leaderboard.objects.get(user_id=2).rank, 1)
+        data = self.client.get('/api/status/').data
+        self.assertFalse(data['leaderboard_ranks']['stale'])
+        self.assertIsNotNone(data['leaderboard_ranks']['recomputed_at'])
+        self.assertEqual([(job['name'], job['status']) for job in data['jobs']], [('recompute_ranks', Job.DONE)])
+        
+        # The next write stales the ranks again and queues another recompute
+        self.create_activity(1, 500)
+        self.assertEqual(Job.objects.filter(name='recompute_ranks', status=Job.PENDING).count(), 1)
+    
+    @override_settings(DERIVED_DATA_JOBS=True, JOB_STORE='octofit_tracker.jobs.LocalJobStore')
+    def test_local_store_runs_after_response(self):
+        """Test that the in-process store runs jobs once the response is finished"""
+        self.create_activity(1, 100)
+        self.create_activity(2, 300)
+        self.assertEqual(Leaderboard.objects.get(user_id=2).rank, 1)
+        self.assertFalse(leaderboard.ranks_are_stale())
+        self.assertEqual([job.status for job in jobs.get_store().recent()], [Job.DONE])
+    
+    @override_settings(JOB_STORE='octofit_tracker.jobs.DatabaseJobStore', JOB_MAX_ATTEMPTS=2)
+    def test_failing_job_is_retried(self):
+        """Test that failures are retried up to JOB_MAX_ATTEMPTS and recorded"""
+        with mock.patch.dict(jobs.JOBS, {'broken': 'octofit_tracker.tests.failing_job'}):
+            jobs.enqueue('broken')
+            with self.assertLogs('octofit_tracker.jobs', 'ERROR'):
+                self.assertEqual(jobs.run_pending(), 2)
+        job = Job.objects.get(name='broken')
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIn('boom', job.error)
+
+
+class RankAssignmentTest(TestCase):
+    """Test cases for single-pass rank reassignment"""
+    
+    def test_assign_ranks_returns_only_changes(self):
+        """Test that entries already at their position are skipped"""
+        entries = [(7, 900, 1, 1), (3, 800, 3, 2), (5, 800, 2, 2), (9, 700, 4, 4)]
+        self.assertEqual(leaderboard.assign_ranks(entries), [(3, 2, 2), (5, 3, 2), (9, 4, 3)])
+    
+    def test_recompute_writes_changed_ranks_only(self):
+        """Test that unchanged entries keep their row untouched"""
+        for user_id, calories in [(1, 300), (2, 200), (3, 100)]:
+            Leaderboard.objects.create(user_id=user_id, total_calories=calories)
+        self.assertEqual(leaderboard.recompute_ranks(), 3)
+        untouched = Leaderboard.objects.get(user_id=1).updated_at
+        
+        Leaderboard.objects.filter(user_id=3).update(total_calories=250)
+        self.assertEqual(leaderboard.recompute_ranks(), 2)
+        self.assertEqual(
+            list(Leaderboard.objects.order_by('rank').values_list('user_id', flat=True)), [1, 3, 2]
+        )
+        self.assertEqual(Leaderboard.objects.get(user_id=1).updated_at, untouched)
+        self.assertEqual(leaderboard.recompute_ranks(), 0)
+    
+    def test_ranks_only_command(self):
+        """Test reassigning ranks from the reconcile command"""
+        Leaderboard.objects.create(user_id=1, total_calories=100)
+        Leaderboard.objects.create(user_id=2, total_calories=200)
+        out = StringIO()
+        call_command('reconcile_leaderboard', '--ranks-only', stdout=out)
+        self.assertIn('2 entries moved', out.getvalue())
+        self.assertEqual(Leaderboard.objects.get(user_id=2).rank, 1)
+
+
+class DatabaseDiagnosticsTest(APITestCase):
+    """Test cases for connection pool counters and the diagnostics endpoint"""
+    
+    def event(self, address=('db', 27017)):
+        return mock.Mock(address=address)
+    
+    def test_pool_stats_count_events(self):
+        """Test that checkouts, sockets and clears are counted per server"""
+        stats = PoolStats()
+        stats.pool_created(self.event())
+        for _ in range(2):
+            stats.connection_created(self.event())
+            stats.connection_checked_out(self.event())
+        stats.connection_checked_in(self.event())
+        stats.connection_closed(self.event())
+        stats.connection_check_out_failed(self.event())
+        stats.pool_cleared(self.event(('replica', 27018)))
+        
+        snapshot = stats.snapshot()
+        self.assertEqual(list(snapshot), ['db:27017', 'replica:27018'])
+        pool = snapshot['db:27017']
+        self.assertEqual(pool['created'], 2)
+        self.assertEqual(pool['open'], 1)
+        self.assertEqual(pool['checked_out'], 2)
+        self.assertEqual(pool['in_use'], 1)
+        self.assertEqual(pool['max_in_use'], 2)
+        self.assertEqual(pool['checkout_failures'], 1)
+        self.assertEqual(snapshot['replica:27018']['clears'], 1)
+        stats.reset()
+        self.assertEqual(stats.snapshot(), {})
+    
+    def test_diagnostics_endpoint(self):
+        """Test that connection settings are reported without the server address"""
+        response = self.client.get('/api/diagnostics/database/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(response.data),
+            {'vendor', 'engine', 'conn_max_age', 'conn_health_checks', 'pool_options', 'pools'},
+        )
+        self.assertNotIn('host', response.data['pool_options'])
+
+
+class ReplicaRoutingTest(APITestCase):
+    """Test cases for primary/replica routing against a second test database"""
+    
+    @classmethod
+    def setUpClass(cls):
+        # Attach a replica alias on the same engine with its own test database.
+        # It is added here rather than in settings so the rest of the suite
+        # keeps reading from the primary.
+        primary = connections['default'].settings_dict
+        connections.settings[routers.REPLICA_DB_ALIAS] = {
+            **primary, 'NAME': f'{primary["NAME"]}_replica', 'TEST': {**primary['TEST'], 'NAME': None},
+        }
+        connections[routers.REPLICA_DB_ALIAS].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        cls.databases = {'default', routers.REPLICA_DB_ALIAS}
+        super().setUpClass()
+    
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        replica = connections[routers.REPLICA_DB_ALIAS]
+        replica.creation.destroy_test_db(replica.settings_dict['NAME'], verbosity=0)
+        replica.close()
+        del connections[routers.REPLICA_DB_ALIAS]
+        del connections.settings[routers.REPLICA_DB_ALIAS]
+    
+    def create_workout(self, name, database=None):
+        return Workout.objects.db_manager(database).create(
+            name=name, description='Easy run', activity_type='Running', difficulty='Easy',
+            estimated_duration=30, estimated_calories=300,
+        )
+    
+    def workout_names(self, url='/api/workouts/'):
+        return [workout['name'] for workout in self.client.get(url).data['results']]
+    
+    def test_safe_requests_read_from_replica(self):
+        """Test that list and retrieve are served from the replica"""
+        self.create_workout('On primary')
+        replica_only = self.create_workout('On replica', routers.REPLICA_DB_ALIAS)
+        self.assertEqual(self.workout_names(), ['On replica'])
+        response = self.client.get(f'/api/workouts/{replica_only.id}/')
+        self.assertEqual(response.data['name'], 'On replica')
+    
+    def test_client_reads_own_writes(self):
+        """Test that a client that wrote reads from the primary for a while"""
+        self.create_workout('On replica', routers.REPLICA_DB_ALIAS)
+        response = self.client.post('/api/workouts/', {
+            'name': 'New', 'description': 'Easy run', 'activity_type': 'Running', 'difficulty': 'Easy',
+            'estimated_duration': 30, 'estimated_calories': 300,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.workout_names(), ['New'])
+        
+        self.client.cookies.pop(routers.STICKY_COOKIE)
+        self.assertEqual(self.workout_names(), ['On replica'])
+    
+    def test_outside_requests_use_primary(self):
+        """Test that commands, jobs and primary() blocks read from the primary"""
+        self.create_workout('On primary')
+        self.assertEqual(list(Workout.objects.values_list('name', flat=True)), ['On primary'])
+        token = routers._replica_reads.set(True)
+        try:
+            self.assertEqual(Workout.objects.db, routers.REPLICA_DB_ALIAS)
+            with routers.primary():
+                self.assertEqual(Workout.objects.db, 'default')
+            # A write pins the rest of the request to the primary
+            self.create_workout('Written')
+            self.assertEqual(Workout.objects.db, 'default')
+        finally:
+            routers._replica_reads.reset(token)
+
+
+class ColumnarStoreTest(APITestCase):
+    """Test cases for the columnar activity snapshot and its analytics endpoint"""
+    
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(ACTIVITY_COLUMNS_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for activity_type, calories, distance, day in [
+            ('Running', 300, 5.0, datetime(2024, 1, 1, 7)),
+            ('Running', 200, None, datetime(2024, 1, 31, 23)),
+            ('Cycling', 500, 20.0, datetime(2024, 2, 1, 8)),
+            ('Running', 100, 2.5, datetime(2024, 2, 3, 9)),
+        ]:
+            self.create_activity(activity_type, calories, distance, day)
+    
+    def create_activity(self, activity_type, calories, distance=None, day=datetime(2024, 3, 1)):
+        return Activity.objects.create(
+            user_id=1, activity_type=activity_type, duration=30, distance=distance, calories=calories,
+            date=timezone.make_aware(day),
+        )
+    
+    def test_group_by_type_and_month(self):
+        """Test that grouped totals match the activities"""
+        self.assertEqual(columnar.refresh_columns(), (4, True))
+        columns = columnar.open_columns()
+        self.assertEqual(columns.types, ['Running', 'Cycling'])
+        self.assertEqual(columns.aggregate(['month', 'activity_type'], ['count', 'calories', 'distance']), [
+            {'month': '2024-01', 'activity_type': 'Running', 'count': 2, 'calories': 500, 'distance': 5.0},
+            {'month': '2024-02', 'activity_type': 'Running', 'count': 1, 'calories': 100, 'distance': 2.5},
+            {'month': '2024-02', 'activity_type': 'Cycling', 'count': 1, 'calories': 500, 'distance': 20.0},
+        ])
+        self.assertEqual(
+            [row['week'] for row in columns.aggregate(['week'], ['count'])], ['2024-01-01', '2024-01-29'],
+        )
+    
+    def test_range_totals(self):
+        """Test filtering by type and half-open date range"""
+        columnar.refresh_columns()
+        columns = columnar.open_columns()
+        totals = columns.totals(
+            ['count', 'calories'], activity_type='Running',
+            date_gte=timezone.make_aware(datetime(2024, 1, 31)), date_lt=timezone.make_aware(datetime(2024, 2, 3, 9)),
+        )
+        self.assertEqual(totals, {'count': 1, 'calories': 200})
+        self.assertEqual(columns.totals(['count'], activity_type='Swimming'), {'count': 0})
+    
+    def test_incremental_refresh(self):
+        """Test that new activities are appended and changed ones trigger a rebuild"""
+        columnar.refresh_columns()
+        generation_files = sorted(os.listdir(self.directory))
+        self.create_activity('Swimming', 400)
+        self.assertEqual(columnar.refresh_columns(), (1, False))
+        self.assertEqual(sorted(os.listdir(self.directory)), generation_files)
+        self.assertEqual(columnar.open_columns().totals(['count'], activity_type='Swimming'), {'count': 1})
+        self.assertEqual(columnar.refresh_columns(), (0, False))
+        
+        Activity.objects.filter(activity_type='Cycling').delete()
+        self.assertEqual(columnar.refresh_columns(), (4, True))
+        self.assertEqual(columnar.open_columns().totals(['count', 'calories']), {'count': 4, 'calories': 1000})
+    
+    def test_edit_through_api_triggers_rebuild(self):
+        """Test that an edited activity is picked up by the next refresh"""
+        columnar.refresh_columns()
+        activity = Activity.objects.get(activity_type='Cycling')
+        response = self.client.patch(f'/api/activities/{activity.id}/', {'calories': 550}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The refresh command runs in another process, without this one's cache
+        cache.clear()
+        self.assertEqual(columnar.refresh_columns(), (4, True))
+        self.assertEqual(columnar.open_columns().totals(['calories'], activity_type='Cycling'), {'calories': 550})
+    
+    def test_analytics_endpoint(self):
+        """Test the analytics endpoint before and after the snapshot is built"""
+        response = self.client.get('/api/activities/analytics/')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        
+        call_command('refresh_activity_columns', stdout=StringIO())
+        response = self.client.get('/api/activities/analytics/?group_by=activity_type&metrics=count,calories')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rows'], 4)
+        self.assertEqual(response.data['results'], [
+            {'activity_type': 'Running', 'count': 3, 'calories': 600},
+            {'activity_type': 'Cycling', 'count': 1, 'calories': 500},
+        ])
+        response = self.client.get('/api/activities/analytics/?group_by=hour')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WorkoutRecommendationAPITest(APITestCase):
+    """Test cases for workout recommendations"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+        recommendations.reset()
+        self.user = User.objects.create(name='Runner', email='runner@example.com')
+        self.workouts = {
+            name: Workout.objects.create(
+                name=name, description=name, activity_type=activity_type, difficulty=difficulty,
+                estimated_duration=duration, estimated_calories=duration * 8,
+            )
+            for name, activity_type, difficulty, duration in [
+                ('Easy run', 'Running', 'Easy', 30),
+                ('Long run', 'Running', 'Hard', 90),
+                ('Stretch', 'Yoga', 'Easy', 30),
+                ('Laps', 'Swimming', 'Medium', 60),
+            ]
+        }
+        recommendations.invalidate_catalogue()
+        for days_ago in range(3):
+            self.log_activity('Running', 30, 300, days_ago)
+    
+    def log_activity(self, activity_type, duration, calories, days_ago=0):
+        response = self.client.post('/api/activities/', {
+            'user_id': self.user.id, 'activity_type': activity_type, 'duration': duration,
+            'calories': calories, 'date': (timezone.now() - timedelta(days=days_ago)).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    
+    def recommended(self, **params):
+        response = self.client.get(f'/api/users/{self.user.id}/recommended-workouts/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results']
+    
+    def test_ranks_by_recent_activity(self):
+        """Test that workouts matching the user's habits come first, with personal calorie estimates"""
+        results = self.recommended()
+        self.assertEqual([workout['name'] for workout in results], ['Easy run', 'Long run', 'Stretch', 'Laps'])
+        self.assertEqual(results[0]['score'], 1.0)
+        # 10 calories per minute from the user's runs; their estimate for types they have not done
+        self.assertEqual(results[0]['estimated_calories_for_user'], 300)
+        self.assertEqual(results[3]['estimated_calories_for_user'], 480)
+        self.assertEqual(len(self.recommended(limit=2)), 2)
+    
+    @override_settings(RECOMMENDATION_MAX_RESULTS=3)
+    def test_ties_at_cutoff_go_to_older_workouts(self):
+        """Test that the last kept slot goes to the oldest of the workouts tied for it"""
+        Workout.objects.all().delete()
+        for name, activity_type, difficulty, duration in [('Stretch', 'Yoga', 'Easy', 30)] * 3 + [
+            ('Easy run', 'Running', 'Easy', 30), ('Long run', 'Running', 'Hard', 90),
+        ] + [('Stretch', 'Yoga', 'Easy', 30)] * 20:
+            Workout.objects.create(
+                name=name, description=name, activity_type=activity_type, difficulty=difficulty,
+                estimated_duration=duration, estimated_calories=duration * 8,
+            )
+        recommendations.invalidate_catalogue()
+        results = self.recommended()
+        self.assertEqual([workout['name'] for workout in results], ['Easy run', 'Long run', 'Stretch'])
+        self.assertEqual(results[2]['id'], Workout.objects.filter(name='Stretch').order_by('id')[0].id)
+    
+    def test_cached_until_activities_change(self):
+        """Test that results are cached per user and refreshed by new activities"""
+        with mock.patch.object(recommendations, 'score_workouts', wraps=recommendations.score_workouts) as score:
+            self.recommended()
+            self.recommended(limit=1)
+            self.assertEqual(score.call_count, 1)
+            for days_ago in range(6):
+                self.log_activity('Yoga', 30, 120, days_ago)
+            self.assertEqual(self.recommended()[0]['name'], 'Stretch')
+            self.assertEqual(score.call_count, 2)
+    
+    def test_rankings_do_not_evict_leaderboard_pages(self):
+        """Test that rankings live in their own store, apart from the leaderboard cache"""
+        self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json')
+        leaderboard_entries = dict(caching.get_backend()._data)
+        with override_settings(RECOMMENDATION_CACHE_MAX_ENTRIES=1):
+            recommendations.reset()
+            self.recommended()
+            other = User.objects.create(name='Walker', email='walker@example.com')
+            self.client.get(f'/api/users/{other.id}/recommended-workouts/')
+            self.assertEqual(len(recommendations.get_store()._data), 1)
+        self.assertEqual(caching.get_backend()._data, leaderboard_entries)
+        # Evicting a ranking only costs a recompute; the catalogue version is kept in the database
+        self.assertEqual(recommendations.catalogue_version(), 1)
+    
+    def test_catalogue_changes(self):
+        """Test that new and deleted workouts are reflected"""
+        self.recommended()
+        response = self.client.post('/api/workouts/', {
+            'name': 'Tempo run', 'description': 'Steady', 'activity_type': 'Running', 'difficulty': 'Easy',
+            'estimated_duration': 30, 'estimated_calories': 250,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.delete(f'/api/workouts/{self.workouts["Easy run"].id}/')
+        self.assertEqual(self.recommended()[0]['name'], 'Tempo run')
+    
+    def test_validation(self):
+        """Test limit validation and unknown users"""
+        response = self.client.get(f'/api/users/{self.user.id}/recommended-workouts/', {'limit': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/users/999/recommended-workouts/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ExpandedFieldsAPITest(APITestCase):
+    """Test cases for sparse fieldsets and expanded relations"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+        self.teams = [Team.objects.create(name=f'Team {i}', description='') for i in range(2)]
+        self.users = [
+            User.objects.create(name=f'User {i}', email=f'user{i}@example.com', team_id=self.teams[i % 2].id)
+            for i in range(4)
+        ]
+        self.users.append(User.objects.create(name='Solo', email='solo@example.com'))
+        for i, user in enumerate(self.users):
+            Leaderboard.objects.create(user_id=user.id, total_calories=100 * (i + 1), rank=len(self.users) - i)
+            Activity.objects.create(
+                user_id=user.id, activity_type='Running', duration=30, calories=300, date=timezone.now(),
+            )
+    
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data
+    
+    def test_leaderboard_expansions_batched(self):
+        """Test that users and teams are embedded with one query per model"""
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.get('/api/leaderboard/', expand='user,team')['results']
+        tables = [query['sql'] for query in queries.captured_queries]
+        self.assertEqual(len([sql for sql in tables if 'FROM "users"' in sql]), 1)
+        self.assertEqual(len([sql for sql in tables if 'FROM "teams"' in sql]), 1)
+        
+        top = rows[0]
+        self.assertEqual(top['user'], UserSerializer(self.users[4]).data)
+        self.assertIsNone(top['team'])
+        self.assertEqual(rows[1]['team']['name'], 'Team 1')
+        self.assertEqual(rows[1]['user_id'], self.users[3].id)
+        # The classic serializer path gives the same output
+        classic = self.get('/api/leaderboard/', expand='user,team', serializer='classic')['results']
+        self.assertEqual(json.loads(json.dumps(classic)), json.loads(json.dumps(rows)))
+    
+    def test_sparse_fieldsets(self):
+        """Test narrowing rows and embedded objects to selected fields"""
+        rows = self.get('/api/leaderboard/', fields='rank,user.name,team.name', expand='user,team')['results']
+        self.assertEqual(rows[1], {'rank': 2, 'user': {'name': 'User 3'}, 'team': {'name': 'Team 1'}})
+        rows = self.get('/api/activities/', fields='id,team', expand='team')['results']
+        self.assertEqual(set(rows[0]), {'id', 'team'})
+        self.assertEqual(rows[0]['team']['id'], self.teams[0].id)
+        for serializer in ['fast', 'classic']:
+            rows = self.get('/api/users/', fields='name', serializer=serializer)['results']
+            self.assertEqual(rows[0], {'name': 'User 0'})
+    
+    def test_retrieve_and_around(self):
+        """Test expansions on detail views and around-rank windows"""
+        user = self.get(f'/api/users/{self.users[1].id}/', expand='team')
+        self.assertEqual(user['team'], TeamSerializer(self.teams[1]).data)
+        around = self.get(f'/api/leaderboard/around/{self.users[2].id}/', radius=1, expand='user')
+        self.assertEqual([entry['user']['name'] for entry in around['entries']], ['User 3', 'User 2', 'User 1'])
+        self.assertEqual([entry['rank'] for entry in around['entries']], [2, 3, 4])
+    
+    def test_invalid_selections(self):
+        """Test that unknown fields and expansions are rejected"""
+        for params in [
+            {'expand': 'workout'}, {'fields': 'nickname'}, {'fields': 'user.name'},
+            {'fields': 'user.age', 'expand': 'user'},
+        ]:
+            response = self.client.get('/api/leaderboard/', params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        response = self.client.get(f'/api/users/{self.users[0].id}/', {'expand': 'user'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ResponseFormatAPITest(APITestCase):
+    """Test cases for compressed responses and alternative response formats"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+        for i in range(40):
+            user = User.objects.create(name=f'User {i}', email=f'user{i}@example.com')
+            Leaderboard.objects.create(user_id=user.id, total_calories=100 * i, rank=40 - i)
+    
+    def test_gzip_negotiated(self):
+        """Test that large responses are gzipped for clients that only accept gzip"""
+        response = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))['results']), 40)
+    
+    @skipUnless(compression.brotli is not None, 'brotli is not installed')
+    def test_brotli_preferred(self):
+        """Test that Brotli is chosen when the client accepts it"""
+        response = self.client.get(
+            '/api/leaderboard/', HTTP_ACCEPT='application/json', HTTP_ACCEPT_ENCODING='gzip, deflate, br',
+        )
+        self.assertEqual(response['Content-Encoding'], 'br')
+        data = json.loads(compression.brotli.decompress(response.content))
+        self.assertEqual(len(data['results']), 40)
+        response = self.client.get(
+            '/api/leaderboard/', HTTP_ACCEPT='application/json', HTTP_ACCEPT_ENCODING='gzip;q=1, br;q=0.5',
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+    
+    def test_uncompressed_responses(self):
+        """Test that small responses and clients without Accept-Encoding get identity"""
+        response = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        response = self.client.get(
+            '/api/leaderboard/', {'page_size': 1}, HTTP_ACCEPT='application/json', HTTP_ACCEPT_ENCODING='gzip',
+        )
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(compression.negotiate('gzip;q=0, identity'), None)
+        self.assertEqual(compression.negotiate('*'), compression.available_encodings()[0])
+    
+    def test_weak_etag_revalidates(self):
+        """Test that the weak ETag of a compressed response still gets 304 Not Modified"""
+        response = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json', HTTP_ACCEPT_ENCODING='gzip')
+        response = self.client.get(
+            '/api/leaderboard/', HTTP_ACCEPT='application/json', HTTP_ACCEPT_ENCODING='gzip',
+            HTTP_IF_NONE_MATCH=response['ETag'],
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_columnar_format(self):
+        """Test that list results are sent as field names plus row arrays"""
+        expected = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json').json()
+        response = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/vnd.octofit.columnar+json')
+        self.assertEqual(response['Content-Type'], 'application/vnd.octofit.columnar+json')
+        results = response.json()['results']
+        self.assertEqual([dict(zip(results['fields'], row)) for row in results['rows']], expected['results'])
+        self.assertEqual(response.json()['next'], expected['next'])
+        user = self.client.get(f'/api/users/{User.objects.first().id}/', {'format': 'columnar'}).json()
+        self.assertEqual(user['name'], 'User 0')
+    
+    @skipUnless(msgpack is not None, 'msgpack is not installed')
+    def test_msgpack_format(self):
+        """Test that MessagePack responses decode to the JSON representation"""
+        expected = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/json').json()
+        response = self.client.get('/api/leaderboard/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), expected)
+
+
+class IdempotentActivityAPITest(APITestCase):
+    """Test cases for activity creates keyed on external ids"""
+    
+    def setUp(self):
+        cache.clear()
+        caching.reset_backend()
+        self.date = timezone.now().isoformat()
+    
+    def activity(self, external_id, user_id=1, calories=300):
+        return {
+            'user_id': user_id, 'activity_type': 'Running', 'duration': 30, 'calories': calories,
+            'date': self.date, 'external_id': external_id,
+        }
+    
+    def test_retried_create_returns_existing(self):
+        """Test that a retried POST returns the stored activity without counting it twice"""
+        first = self.client.post('/api/activities/', self.activity('phone-1:2026-10-18T07:00'), format='json')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        retry = self.client.post(
+            '/api/activities/', self.activity('phone-1:2026-10-18T07:00', calories=999), format='json',
+        )
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Activity.objects.count(), 1)
+        self.assertEqual(Leaderboard.objects.get(user_id=1).total_calories, 300)
+        # Activities without an external id are never deduplicated
+        for _ in range(2):
+            self.client.post('/api/activities/', self.activity(None), format='json')
+        self.assertEqual(Activity.objects.filter(external_id__isnull=True).count(), 2)
+    
+    def test_bulk_create_skips_existing(self):
+        """Test that bulk items with stored or repeated external ids are not inserted"""
+        stored = self.client.post('/api/activities/', self.activity('a'), format='json').data
+        data = [self.activity('a'), self.activity('b'), self.activity('b'), self.activity(None, user_id=2)]
+        response = self.client.post('/api/activities/bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['existing'][0], {'external_id': 'a', 'id': stored['id']})
+        self.assertEqual([item['external_id'] for item in response.data['existing']], ['a', 'b'])
+        self.assertEqual(Leaderboard.objects.get(user_id=1).total_calories, 600)
+        response = self.client.post('/api/activities/bulk/', data[:3], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 0)
+    
+    def test_concurrent_insert(self):
+        """Test that losing a race on the unique external id returns the winner's row"""
+        winner = Activity.objects.create(
+            user_id=1, activity_type='Running', duration=30, calories=300, date=timezone.now(), external_id='a',
+        )
+        with mock.patch.object(upserts, 'find_existing', side_effect=[{}, {'a': winner}]):
+            activity, created = upserts.create_activity({**self.activity('a'), 'date': timezone.now()})
+        self.assertFalse(created)
+        self.assertEqual(activity, winner)
+    
+    def test_update_cannot_take_external_id(self):
+        """Test that an update may not reuse another activity's external id"""
+        self.client.post('/api/activities/', self.activity('a'), format='json')
+        other = self.client.post('/api/activities/', self.activity('b'), format='json').data
+        response = self.client.patch(f'/api/activities/{other["id"]}/', {'external_id': 'a'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(f'/api/activities/{other["id"]}/', {'external_id': 'b'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class PartialIndexMigrationTest(TestCase):
+    """Test cases for conditional unique constraints on MongoDB"""
+    
+    def djongo_editor(self):
+        from djongo.schema import DatabaseSchemaEditor
+        
+        fake = mock.MagicMock(vendor='djongo', alias='default')
+        self.collection = fake.connection.__getitem__.return_value
+        return DatabaseSchemaEditor(fake)
+    
+    def migrate(self, migration_name):
+        """Run a migration's partial unique constraint through djongo's schema editor"""
+        loader = MigrationLoader(connection)
+        migration = loader.get_migration('octofit_tracker', migration_name)
+        state = loader.project_state(('octofit_tracker', migration_name))
+        operation = next(op for op in migration.operations if isinstance(op, AddPartialUniqueConstraint))
+        editor = self.djongo_editor()
+        operation.database_forwards('octofit_tracker', editor, state, state)
+        # No SQL reaches djongo's translator, which would drop the condition
+        editor.connection.cursor.assert_not_called()
+    
+    def test_job_pending_index(self):
+        """Test that only pending jobs are unique by name"""
+        self.migrate('0006_job')
+        self.collection.create_index.assert_called_once_with(
+            [('name', 1)], name='job_pending_name_uniq', unique=True, partialFilterExpression={'status': 'pending'},
+        )
+    
+    def test_activity_external_id_index(self):
+        """Test that only activities with an external id are unique by it"""
+        self.migrate('0007_activity_external_id')
+        self.collection.create_index.assert_called_once_with(
+            [('external_id', 1)], name='activity_external_id_uniq', unique=True,
+            partialFilterExpression={'external_id': {'$type': 'string'}},
+        )
+    
+    def test_duplicate_key_is_integrity_error(self):
+        """Test that the MongoDB backend reports unique index violations as IntegrityError"""
+        from djongo import database
+        from pymongo.errors import DuplicateKeyError
+        from .mongo.base import Cursor
+        
+        cursor = Cursor(mock.Mock(), mock.Mock(), mock.Mock())
+        with mock.patch('djongo.cursor.Query', side_effect=DuplicateKeyError('E11000 duplicate key', 11000)):
+            with self.assertRaises(database.IntegrityError):
+                cursor.execute('INSERT INTO "activities" ("external_id") VALUES (%s)', ['a'])
+        with mock.patch('djongo.cursor.Query', side_effect=ValueError('unsupported')):
+            with self.assertRaises(database.DatabaseError) as raised:
+                cursor.execute('SELECT 1')
+        self.assertNotIsInstance(raised.exception, database.IntegrityError)
+    
+    def test_job_enqueue_after_finished_jobs(self):
+        """Test that finished jobs do not block enqueuing the same name on SQL backends"""
+        Job.objects.create(name='recompute_ranks', status=Job.DONE)
+        Job.objects.create(name='recompute_ranks', status=Job.FAILED)
+        self.assertTrue(jobs.DatabaseJobStore().enqueue('recompute_ranks'))
+        self.assertFalse(jobs.DatabaseJobStore().enqueue('recompute_ranks'))
+
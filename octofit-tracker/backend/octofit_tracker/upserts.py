@@ -0,0 +1,74 @@
+"""
+Idempotent activity creation keyed on client-provided external ids.
+
+Mobile clients retry POSTs on flaky networks. An activity sent with an
+external_id that is already stored is not inserted again: the stored row is
+returned as is and no derived store changes, so retries cost one indexed
+lookup. The partial unique constraint on external_id settles races between
+concurrent retries; the loser looks the winner's row up instead of failing.
+"""
+from django.db import IntegrityError, transaction
+
+from .models import Activity
+
+
+def find_existing(external_ids):
+    """Stored activities with the given external ids, by external id"""
+    external_ids = [external_id for external_id in external_ids if external_id is not None]
+    if not external_ids:
+        return {}
+    return {activity.external_id: activity for activity in Activity.objects.filter(external_id__in=external_ids)}
+
+
+def create_activity(data):
+    """
+    Create an activity from validated data and return (activity, created);
+    when its external_id is already stored, the stored activity is returned
+    """
+    external_id = data.get('external_id')
+    existing = find_existing([external_id])
+    if existing:
+        return existing[external_id], False
+    try:
+        with transaction.atomic():
+            return Activity.objects.create(**data), True
+    except IntegrityError:
+        # A concurrent request stored the same external_id first
+        existing = find_existing([external_id])
+        if not existing:
+            raise
+        return existing[external_id], False
+
+
+def create_activities(items, batch_size=None):
+    """
+    Insert validated activities whose external_id is not stored yet and
+    return (created, existing), existing mapping the external ids that were
+    skipped to their stored activities. Repeats of an external_id within
+    the batch are skipped as well, mapped to the first occurrence.
+    """
+    for attempt in range(2):
+        existing = find_existing({data.get('external_id') for data in items})
+        pending, seen, repeats = [], {}, []
+        for data in items:
+            external_id = data.get('external_id')
+            if external_id in existing:
+                continue
+            if external_id is not None and external_id in seen:
+                repeats.append(external_id)
+                continue
+            activity = Activity(**data)
+            pending.append(activity)
+            if external_id is not None:
+                seen[external_id] = activity
+        try:
+            with transaction.atomic():
+                created = Activity.objects.bulk_create(pending, batch_size=batch_size)
+        except IntegrityError:
+            # A concurrent request stored some of the external ids; look them up again
+            if attempt:
+                raise
+            continue
+        for external_id in repeats:
+            existing[external_id] = seen[external_id]
+        return created, existing
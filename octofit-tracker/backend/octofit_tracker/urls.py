@@ -17,8 +17,9 @@ import os
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
+from . import async_views
 from .views import (
-    api_root, UserViewSet, TeamViewSet, ActivityViewSet,
+    api_root, database_diagnostics, derived_data_status, request_metrics, UserViewSet, TeamViewSet, ActivityViewSet,
     LeaderboardViewSet, WorkoutViewSet
 )
 
@@ -41,5 +42,12 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', api_root, name='api-root'),
     path('api/', api_root, name='api-root'),
+    path('api/metrics/', request_metrics, name='request-metrics'),
+    path('api/status/', derived_data_status, name='derived-data-status'),
+    path('api/diagnostics/database/', database_diagnostics, name='database-diagnostics'),
+    # Async reads for ASGI deployments (see DEPLOYMENT.md)
+    path('api/async/leaderboard/', async_views.leaderboard_list, name='async-leaderboard-list'),
+    path('api/async/leaderboard/rank/<int:user_id>/', async_views.leaderboard_rank, name='async-leaderboard-rank'),
+    path('api/async/users/<int:user_id>/activities/', async_views.user_activities, name='async-user-activities'),
     path('api/', include(router.urls)),
 ]
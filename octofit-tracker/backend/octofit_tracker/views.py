@@ -1,13 +1,41 @@
+import copy
+
+from django.conf import settings
+from django.db import connection, router, transaction
+from django.db.models import Max
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
-from .models import User, Team, Activity, Leaderboard, Workout
+from . import (
+    caching, columnar, derived, jobs, leaderboard, metrics, recommendations, rollups, team_stats, upserts
+)
+from .fast_serializers import FastListModelMixin
+from .mongo.pool import pool_stats
+from .filters import ActivityFilterBackend, date_param, datetime_param, int_param
+from .models import User, Team, Activity, ActivityRollup, Leaderboard, TeamStats, Workout
+from .pagination import ActivityPagination, LeaderboardPagination
+from .parsers import NDJSONParser
+from .renderers import CSVRenderer, NDJSONRenderer
 from .serializers import (
     UserSerializer, TeamSerializer, ActivitySerializer,
-    LeaderboardSerializer, WorkoutSerializer
+    LeaderboardSerializer, WorkoutSerializer, TeamLeaderboardSerializer,
+    ActivityBucketSerializer, WindowedLeaderboardSerializer, JobSerializer
 )
 
+MAX_AROUND_RADIUS = 50
+DEFAULT_RECOMMENDATIONS = 10
+
+# MongoClient options safe to report; host, port and credentials are left out
+POOL_OPTIONS = [
+    'maxPoolSize', 'minPoolSize', 'maxIdleTimeMS', 'serverSelectionTimeoutMS',
+    'connectTimeoutMS', 'waitQueueTimeoutMS',
+]
+
 
 @api_view(['GET'])
 def api_root(request, format=None):
@@ -23,41 +51,390 @@ def api_root(request, format=None):
     })
 
 
-class UserViewSet(viewsets.ModelViewSet):
+@api_view(['GET'])
+def request_metrics(request, format=None):
+    """
+    Per-route histograms of request time, database time, serializer time and
+    query count recorded by RequestMetricsMiddleware in this process
+    """
+    return Response({
+        'enabled': metrics.metrics_enabled(),
+        'routes': metrics.registry.snapshot(),
+    })
+
+
+@api_view(['GET'])
+def database_diagnostics(request, format=None):
+    """
+    Connection settings of the default database and the MongoDB connection
+    pool counters of this process
+    """
+    database = connection.settings_dict
+    client = database.get('CLIENT', {})
+    return Response({
+        'vendor': connection.vendor,
+        'engine': database['ENGINE'],
+        'conn_max_age': database['CONN_MAX_AGE'],
+        'conn_health_checks': database['CONN_HEALTH_CHECKS'],
+        'pool_options': {name: client[name] for name in POOL_OPTIONS if name in client},
+        'pools': pool_stats.snapshot(),
+    })
+
+
+@api_view(['GET'])
+def derived_data_status(request, format=None):
+    """
+    Freshness of the derived data (leaderboard ranks, team stats snapshot)
+    and the state of the background job queue
+    """
+    return Response({
+        'jobs_enabled': jobs.enabled(),
+        'leaderboard_ranks': {
+            'stale': leaderboard.ranks_are_stale(),
+            'recomputed_at': leaderboard.ranks_recomputed_at(),
+        },
+        'team_stats': {
+            'snapshot': team_stats.snapshot_enabled(),
+            'updated_at': TeamStats.objects.aggregate(Max('updated_at'))['updated_at__max'],
+        },
+        'jobs': JobSerializer(jobs.get_store().recent(), many=True).data,
+    })
+
+
+class UserViewSet(FastListModelMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing User instances.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
+    def perform_create(self, serializer):
+        user = serializer.save()
+        team_stats.record_membership_change(user.id, None, user.team_id)
+
+    def perform_update(self, serializer):
+        old_team_id = serializer.instance.team_id
+        user = serializer.save()
+        team_stats.record_membership_change(user.id, old_team_id, user.team_id)
+        # Cached leaderboards may embed the user (?expand=user)
+        caching.invalidate_leaderboard()
+
+    def perform_destroy(self, instance):
+        user_id = instance.id
+        instance.delete()
+        team_stats.record_membership_change(user_id, instance.team_id, None)
+        caching.invalidate_leaderboard()
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """
+        Activity totals per day or ISO week (?granularity=day|week), read from
+        the rollups. Optional start/end dates bound the range (end exclusive).
+        """
+        user = self.get_object()
+        granularity = request.query_params.get('granularity', ActivityRollup.DAY)
+        if granularity not in rollups.PERIODS:
+            raise ValidationError({'granularity': [f'Choose one of: {", ".join(rollups.PERIODS)}.']})
+        buckets = rollups.user_stats(
+            user.id, granularity,
+            start=date_param(request.query_params, 'start'),
+            end=date_param(request.query_params, 'end'),
+            activity_type=request.query_params.get('activity_type'),
+        )
+        return Response({
+            'user_id': user.id,
+            'granularity': granularity,
+            'buckets': ActivityBucketSerializer(buckets, many=True).data,
+        })
 
-class TeamViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'], url_path='recommended-workouts')
+    def recommended_workouts(self, request, pk=None):
+        """
+        Workouts ranked by fit with the user's recent activities: the types
+        they do, their usual session length and their weekly volume.
+        Each carries its score and the calories the user would likely burn,
+        from their own calories per minute for the type. ?limit= caps the list.
+        """
+        user = self.get_object()
+        limit = DEFAULT_RECOMMENDATIONS
+        if 'limit' in request.query_params:
+            limit = int_param(request.query_params, 'limit')
+            if not 1 <= limit <= settings.RECOMMENDATION_MAX_RESULTS:
+                raise ValidationError({'limit': [f'Choose from 1 to {settings.RECOMMENDATION_MAX_RESULTS}.']})
+
+        ranked = recommendations.recommend(user.id, limit)
+        workouts = Workout.objects.in_bulk([workout_id for workout_id, _, _ in ranked])
+        results = []
+        for workout_id, score, calories in ranked:
+            # A workout deleted since the ranking was cached is skipped
+            if workout_id in workouts:
+                data = WorkoutSerializer(workouts[workout_id]).data
+                results.append({**data, 'score': score, 'estimated_calories_for_user': calories})
+        return Response({
+            'user_id': user.id,
+            'window_days': settings.RECOMMENDATION_WINDOW_DAYS,
+            'results': results,
+        })
+
+
+class TeamViewSet(FastListModelMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Team instances.
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
 
+    def perform_update(self, serializer):
+        serializer.save()
+        # Cached leaderboards show team names and may embed teams (?expand=team)
+        caching.invalidate_leaderboard()
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        caching.invalidate_leaderboard()
 
-class ActivityViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'], url_path='leaderboard')
+    def team_leaderboard(self, request):
+        """
+        Teams ranked by their members' total calories, with duration,
+        activity and member counts.
+        """
+        def render():
+            serializer = TeamLeaderboardSerializer(team_stats.team_leaderboard(), many=True)
+            return Response(serializer.data)
+        return caching.cached_response(request, 'team-leaderboard', caching.leaderboard_version(), render)
+
+
+class ActivityViewSet(FastListModelMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Activity instances.
+    Lists and exports can be filtered with user_id, team_id, activity_type, date__gte and date__lt.
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    pagination_class = ActivityPagination
+    filter_backends = [ActivityFilterBackend]
+
+    def create(self, request, *args, **kwargs):
+        """
+        Create an activity. A retry carrying an external_id that is already
+        stored returns the stored activity with 200 OK and changes nothing.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            activity, created = upserts.create_activity(serializer.validated_data)
+            if created:
+                derived.record_activity_changes(added=[activity])
+        serializer.instance = activity
+        if not created:
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(serializer.data))
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous = copy.copy(serializer.instance)
+        activity = serializer.save()
+        derived.record_activity_changes(added=[activity], removed=[previous])
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        derived.record_activity_changes(removed=[instance])
+
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[JSONParser, NDJSONParser])
+    def bulk_create(self, request):
+        """
+        Create a batch of activities from a JSON array or an NDJSON stream.
+        Invalid items are reported by index without failing the rest of the batch.
+        Items whose external_id is already stored are not inserted again and
+        are listed under existing with the stored activity's id.
+        """
+        if isinstance(request.data, list) and len(request.data) > settings.ACTIVITY_BULK_MAX_ITEMS:
+            raise ValidationError({
+                'non_field_errors': [f'A batch may hold at most {settings.ACTIVITY_BULK_MAX_ITEMS} activities.']
+            })
+        serializer = self.get_serializer(data=request.data, many=True)
+        valid, errors = serializer.validate_each()
+
+        with transaction.atomic():
+            created, existing = upserts.create_activities(valid, batch_size=settings.ACTIVITY_BULK_CHUNK_SIZE)
+            derived.record_activity_changes(added=created)
+
+        if errors:
+            response_status = status.HTTP_207_MULTI_STATUS if created or existing else status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        return Response({
+            'created': len(created),
+            'ids': [activity.pk for activity in created if activity.pk is not None],
+            'existing': [
+                {'external_id': external_id, 'id': activity.pk} for external_id, activity in existing.items()
+            ],
+            'errors': errors,
+        }, status=response_status)
+
+    @action(detail=False, methods=['get'], url_path='export', renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """
+        Stream every matching activity, ordered by (date, id), as CSV or NDJSON
+        (?format=csv|ndjson or the Accept header). Rows are read with a
+        server-side cursor and written as they arrive, so memory use does not
+        grow with the size of the export.
+        """
+        fields = ActivitySerializer.Meta.fields
+        rows = (
+            self.filter_queryset(self.get_queryset())
+            # Rows are read after the response leaves the middleware, so pick the database now
+            .using(router.db_for_read(Activity))
+            .order_by('date', 'id')
+            .values_list(*fields)
+            .iterator(chunk_size=settings.ACTIVITY_EXPORT_CHUNK_SIZE)
+        )
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(fields, rows),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}',
+        )
+        response['Content-Disposition'] = f'attachment; filename="activities.{renderer.format}"'
+        return response
+
+    @action(detail=False, methods=['get'], url_path='analytics')
+    def analytics(self, request):
+        """
+        Activity totals from the columnar snapshot, grouped by ?group_by=
+        (comma-separated: activity_type, user_id, year, month, week, day)
+        and filtered by activity_type, user_id, date__gte and date__lt.
+        ?metrics= picks among count, calories, duration and distance. The
+        snapshot lags behind writes until refresh_activity_columns runs.
+        """
+        columns = columnar.open_columns()
+        if columns is None:
+            return Response(
+                {'detail': 'The activity snapshot has not been built; run refresh_activity_columns.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
 
+        params = request.query_params
+        group_by = [name for name in params.get('group_by', '').split(',') if name]
+        unknown = [name for name in group_by if name not in columnar.GROUPS]
+        if unknown:
+            raise ValidationError({'group_by': [f'Choose from: {", ".join(columnar.GROUPS)}.']})
+        metric_names = [name for name in params.get('metrics', '').split(',') if name] or columnar.METRICS
+        if any(name not in columnar.METRICS for name in metric_names):
+            raise ValidationError({'metrics': [f'Choose from: {", ".join(columnar.METRICS)}.']})
+        filters = {
+            'activity_type': params.get('activity_type') or None,
+            'user_id': int_param(params, 'user_id') if 'user_id' in params else None,
+            'date_gte': datetime_param(params, 'date__gte') if 'date__gte' in params else None,
+            'date_lt': datetime_param(params, 'date__lt') if 'date__lt' in params else None,
+        }
+        return Response({
+            'rows': len(columns),
+            'watermark': columns.watermark,
+            'results': columns.aggregate(group_by, metric_names, **filters),
+        })
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+
+class LeaderboardViewSet(FastListModelMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Leaderboard instances.
     """
     queryset = Leaderboard.objects.all()
     serializer_class = LeaderboardSerializer
+    pagination_class = LeaderboardPagination
+
+    def list(self, request, *args, **kwargs):
+        window = request.query_params.get('window')
+        if window is not None:
+            return self.windowed_list(request, window)
+        def render():
+            # Writes that stale the ranks also bump the cache version, so hits skip the check
+            leaderboard.ensure_ranks_fresh()
+            return super(LeaderboardViewSet, self).list(request, *args, **kwargs)
+        return caching.cached_response(request, 'leaderboard', caching.leaderboard_version(), render)
+
+    def windowed_list(self, request, window):
+        """Top users for ?window=7d|30d|month, summed from the daily rollups"""
+        if window not in leaderboard.WINDOWS:
+            raise ValidationError({'window': [f'Choose one of: {", ".join(leaderboard.WINDOWS)}.']})
+        limit = self.paginator.get_page_size(request)
+        today = timezone.localdate()
+
+        def render():
+            rows = leaderboard.windowed_leaderboard(window, limit, today)
+            return Response({
+                'window': window,
+                'start': leaderboard.window_start(window, today),
+                'end': today,
+                'results': WindowedLeaderboardSerializer(rows, many=True).data,
+            })
+        return caching.cached_response(request, f'leaderboard:{today}', caching.leaderboard_version(), render)
+
+    def retrieve(self, request, *args, **kwargs):
+        leaderboard.ensure_ranks_fresh()
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'], url_path=r'around/(?P<user_id>\d+)')
+    def around(self, request, user_id=None):
+        """
+        A user's rank and the entries just above and below them
+        (?radius=5, ?ranking=competition|dense).
+        """
+        try:
+            radius = int(request.query_params.get('radius', 5))
+        except ValueError:
+            radius = -1
+        if not 0 <= radius <= MAX_AROUND_RADIUS:
+            raise ValidationError({'radius': [f'Enter an integer between 0 and {MAX_AROUND_RADIUS}.']})
+        ranking = request.query_params.get('ranking', leaderboard.COMPETITION)
+        if ranking not in leaderboard.RANKINGS:
+            raise ValidationError({'ranking': [f'Choose one of: {", ".join(leaderboard.RANKINGS)}.']})
+
+        ranked = leaderboard.entries_around(int(user_id), radius, ranking)
+        if ranked is None:
+            raise NotFound(f'User {user_id} has no leaderboard entry.')
+        # One serializer for all entries, so ?expand= is resolved in one batch
+        entries = self.get_serializer([entry for entry, _ in ranked], many=True).data
+        for data, (entry, rank) in zip(entries, ranked):
+            if 'rank' in data:
+                data['rank'] = rank
+        return Response({
+            'user_id': int(user_id),
+            'rank': next(rank for entry, rank in ranked if entry.user_id == int(user_id)),
+            'ranking': ranking,
+            'entries': entries,
+        })
 
+    def perform_create(self, serializer):
+        entry = serializer.save()
+        leaderboard.record_entry_change(current=entry)
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+    def perform_update(self, serializer):
+        previous = copy.copy(serializer.instance)
+        entry = serializer.save()
+        leaderboard.record_entry_change(previous=previous, current=entry)
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        leaderboard.record_entry_change(previous=instance)
+
+
+class WorkoutViewSet(FastListModelMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Workout instances.
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+
+    def perform_create(self, serializer):
+        serializer.save()
+        recommendations.invalidate_catalogue()
+
+    def perform_update(self, serializer):
+        serializer.save()
+        recommendations.invalidate_catalogue()
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        recommendations.invalidate_catalogue()